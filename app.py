@@ -1,56 +1,44 @@
 #!/usr/bin/env python3
 """
 Petechoes后端应用入口文件
-放在根目录便于Zeabur部署
+放在根目录便于Zeabur部署，提供的是 backend/app.py 的完整应用（任务队列、轮询、回调、限流）
+导入时只创建应用，不连接数据库、不打印路由，数据库不可达时也能立即启动
 """
 
 import sys
 import os
+import logging
+import importlib.util
 
 # 添加backend目录到Python路径
-backend_dir = os.path.join(os.path.dirname(__file__), 'backend')
+backend_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'backend')
 sys.path.insert(0, backend_dir)
 
-print("🚀 Petechoes后端启动中...")
-print(f"📁 Backend目录: {backend_dir}")
-print(f"🐍 Python路径: {sys.path[:3]}")
+logger = logging.getLogger(__name__)
+
+# 本文件在 gunicorn app:app 下的模块名就是app，backend/app.py 用另一个名字加载，避免导入到自己
+BACKEND_MODULE = 'petechoes_backend_app'
 
 try:
-    # 尝试导入完整的应用
-    print("🔄 尝试导入完整应用...")
-    import postgres_server
-    app = postgres_server.app
-    print("✅ 成功导入完整应用 (postgres_server)")
-    
-    # 验证关键路由是否存在
-    routes = [rule.rule for rule in app.url_map.iter_rules()]
-    print(f"📋 可用路由: {routes}")
-    
-    if '/upload' in routes:
-        print("✅ 确认包含/upload路由")
-    else:
-        print("❌ 警告: 缺少/upload路由")
-        
+    spec = importlib.util.spec_from_file_location(BACKEND_MODULE, os.path.join(backend_dir, 'app.py'))
+    backend_app = importlib.util.module_from_spec(spec)
+    sys.modules[BACKEND_MODULE] = backend_app
+    spec.loader.exec_module(backend_app)
+    # create_app()的应用，gunicorn.conf.py的post_worker_init / worker_exit通过app.extensions启停任务调度
+    app = backend_app.app
 except ImportError as e:
-    print(f"❌ 导入完整应用失败: {e}")
-    print("🔄 尝试导入简化版本...")
-    try:
-        from app import app as backup_app
-        app = backup_app
-        print("⚠️ 使用简化版本应用")
-    except ImportError as e2:
-        print(f"❌ 导入简化版本也失败: {e2}")
-        # 创建最基本的应用
-        from flask import Flask, jsonify
-        app = Flask(__name__)
-        
-        @app.route('/')
-        def emergency():
-            return jsonify({"error": "应用启动失败", "message": "请检查依赖和配置"})
-        
-        print("🆘 使用紧急备用应用")
+    sys.modules.pop(BACKEND_MODULE, None)
+    logger.error(f"❌ 导入应用失败: {e}")
+    # 创建最基本的应用
+    from flask import Flask, jsonify
+    app = Flask(__name__)
+
+    @app.route('/')
+    def emergency():
+        return jsonify({"error": "应用启动失败", "message": "请检查依赖和配置"})
 
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 5001))
     print(f"🚀 启动服务器在端口 {port}")
-    app.run(host='0.0.0.0', port=port, debug=False) 
\ No newline at end of file
+    print(f"📋 可用路由: {[rule.rule for rule in app.url_map.iter_rules()]}")
+    app.run(host='0.0.0.0', port=port, debug=False)
@@ -3,27 +3,79 @@
 完整的Flask应用 - 集成所有功能
 """
 
-from flask import Flask, request, jsonify, send_file
+from flask import Flask, Blueprint, Response, current_app, request, jsonify, send_file, redirect
 from flask_cors import CORS
 import psycopg2
 from psycopg2.extras import RealDictCursor
 import os
-import requests
 from PIL import Image
 import io
-import threading
+import json
+import queue
 import time
 import logging
+import db_pool
+from http_client import http_client, RETRY_STATUSES
+from sample_download import download_sample, download_stats, SampleDownloadError
+from input_delivery import input_image_reference, describe_reference, verify_blob_signature, delivery_stats
+from webhooks import (
+    webhooks_enabled, webhook_fields, verify_signature, parse_completion, webhook_stats,
+    count as count_webhook, WEBHOOK_CONFIG
+)
+from generation_executor import generation_executor, bfl_submit_limiter, QueueFullError
+from provider_guard import (
+    bfl_breaker, bfl_submit_concurrency, guard_stats,
+    ProviderBusyError, ProviderOverloadedError, PROVIDER_GUARD_CONFIG
+)
+from job_queue import (
+    JobQueue, JobDispatcher,
+    JOB_KIND_STUDIO, JOB_KIND_MEMORY_PHOTO, JOB_QUEUE_CONFIG, DISPATCH_INTERVAL
+)
+from bfl_poller import bfl_poller, PollTask, POLL_READY, POLL_FAILED, POLL_TIMEOUT
+from blob_store import get_blob_store, record_blob, content_etag, cache_control, BLOB_CONFIG
+from image_cache import (
+    ByteLRUCache, StudioBackgroundCache, studio_background_entry,
+    IMAGE_CACHE_CONFIG, STUDIO_BACKGROUND_CHANNEL, ACTIVE_STUDIO_BACKGROUND_SQL
+)
+from pg_listener import PgListener, notify
+from image_processing import image_normalizer, InvalidImageError
+from upload_ingest import IngestRequest, UPLOAD_CONFIG, UPLOAD_REJECTIONS, ingested, upload_rejection_message
+from status_events import (
+    status_broker, notify_status, status_response_data, status_rows_data, parse_image_ids, sse_event,
+    IMAGE_STATUS_CHANNEL, STATUS_STREAM_CONFIG, TERMINAL_STATUSES
+)
+from images_schema import STATUS_QUERY, INSERT_IMAGE_SQL, IMAGE_CONTENT_QUERIES
+from generation_presets import GENERATION_PRESETS, preset_dedup_key
+from dedup import find_duplicate_generation, duplicate_generation_data
+from renditions import (
+    create_renditions, record_renditions, negotiate_format, find_rendition,
+    RENDITION_SIZES, RENDITION_FORMATS
+)
+from upload_batches import (
+    create_batch, insert_images, add_batch_images, aggregate_status,
+    load_batch_members, BATCH_MAX_FILES
+)
+from migrations import schema_status
 
 # 设置日志
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-app = Flask(__name__)
-CORS(app)
+# 所有路由注册在蓝图上，由create_app()创建应用
+api = Blueprint('api', __name__)
+
+# 在Apache/lighttpd等支持X-Sendfile的前端后面运行时，本地图片由前端直接发送
+USE_X_SENDFILE = os.getenv('USE_X_SENDFILE', 'false').lower() == 'true'
+
+# 是否在本进程中运行任务调度，独立worker进程可以通过环境变量关闭
+JOB_DISPATCHER_ENABLED = os.getenv('JOB_DISPATCHER_ENABLED', 'true').lower() == 'true'
+
+# 就绪检查等待连接池的最长时间（秒）
+READINESS_TIMEOUT = float(os.getenv('READINESS_TIMEOUT', '3'))
 
 # Black Forest Lab API配置
-BFL_API_URL = 'https://api.bfl.ai/v1/flux-kontext-max'
+# 本地测试时可以指向模拟服务（python fake_bfl.py）
+BFL_API_URL = os.getenv('BFL_API_URL', 'https://api.bfl.ai/v1/flux-kontext-max')
 
 # 数据库配置
 DB_CONFIG = {
@@ -31,116 +83,61 @@ DB_CONFIG = {
     'port': int(os.getenv('POSTGRES_PORT', '30177')),
     'database': os.getenv('POSTGRES_DATABASE', os.getenv('POSTGRES_DB', 'zeabur')),
     'user': os.getenv('POSTGRES_USERNAME', os.getenv('POSTGRES_USER', 'root')),
-    'password': os.getenv('POSTGRES_PASSWORD', os.getenv('PASSWORD', 'laKs69d7AVXmTJ5H1wLGBrIqv0h43k28'))
+    'password': os.getenv('POSTGRES_PASSWORD', os.getenv('PASSWORD', 'laKs69d7AVXmTJ5H1wLGBrIqv0h43k28')),
+    # 数据库不可达时尽快失败，不让请求线程和就绪检查卡住
+    'connect_timeout': int(os.getenv('POSTGRES_CONNECT_TIMEOUT', '5'))
 }
 
 BFL_API_KEY = os.getenv('BFL_API_KEY', '7b9e4ba5-8136-4a85-94e6-e1c45fd5d0c0')
 
-print("🚀 Petechoes完整应用启动中...")
-print(f"🔧 数据库配置: {DB_CONFIG['host']}:{DB_CONFIG['port']}")
-print(f"🔑 BFL API Key: {'✅已设置' if BFL_API_KEY else '❌未设置'}")
-
 def get_db_connection_with_retry(max_retries=3, retry_delay=1):
-    """带重试逻辑的数据库连接"""
-    for attempt in range(max_retries):
-        try:
-            conn = psycopg2.connect(**DB_CONFIG)
-            return conn
-        except psycopg2.OperationalError as e:
-            logger.warning(f"数据库连接失败 (第{attempt + 1}次): {e}")
-            if attempt < max_retries - 1:
-                time.sleep(retry_delay)
-            else:
-                raise e
-    return None
+    """从共享连接池借出连接（需要新建物理连接时带重试逻辑）"""
+    return db_pool.get_connection(DB_CONFIG, retries=max_retries, retry_delay=retry_delay)
 
 def get_db_connection():
-    """获取数据库连接"""
+    """获取数据库连接，用完调用 conn.close() 归还连接池"""
     try:
         return get_db_connection_with_retry(max_retries=3, retry_delay=1)
     except Exception as e:
         logger.error(f"数据库连接失败: {e}")
         return None
 
-def init_database():
-    """初始化数据库表"""
-    try:
-        conn = get_db_connection()
-        if not conn:
-            return False
-            
-        cursor = conn.cursor()
-        
-        # 创建图片表
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS images (
-                id SERIAL PRIMARY KEY,
-                original_image BYTEA NOT NULL,
-                generated_image BYTEA,
-                status VARCHAR(50) DEFAULT 'pending',
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        # 创建照相馆背景图片表
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS studio_backgrounds (
-                id SERIAL PRIMARY KEY,
-                image_data BYTEA NOT NULL,
-                is_active BOOLEAN DEFAULT true,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        # 检查是否已有背景图片
-        cursor.execute("SELECT COUNT(*) FROM studio_backgrounds WHERE is_active = true")
-        count = cursor.fetchone()[0]
-        
-        if count == 0:
-            # 如果没有背景图片，插入默认的图片2（需要从项目中读取）
-            logger.info("📸 正在初始化照相馆背景图片...")
-            init_studio_background(cursor)
-        
-        conn.commit()
-        cursor.close()
-        conn.close()
-        logger.info("✅ 数据库表初始化成功")
-        return True
-        
-    except Exception as e:
-        logger.error(f"❌ 数据库初始化失败: {e}")
-        return False
+def generation_busy_response(retry_after):
+    """生成队列已满时返回429和重试提示"""
+    response = jsonify({
+        'error': '生成任务繁忙，请稍后重试',
+        'retry_after': retry_after
+    })
+    response.headers['Retry-After'] = str(retry_after)
+    return response, 429
+
+def upload_rejected_response(e):
+    """上传内容过大（413）或不是图片（415）时的响应"""
+    return jsonify({'error': upload_rejection_message(e)}), e.code
 
-def init_studio_background(cursor):
-    """初始化照相馆背景图片"""
+def generation_dedup_key_for(kind, input_key):
+    """按当前提示词和参数计算去重键，照相馆照片还取决于当前背景"""
+    background_key = None
+    if kind == JOB_KIND_STUDIO:
+        background = active_studio_background()
+        background_key = background.etag if background else None
+    return preset_dedup_key(kind, input_key, background_key)
+
+def duplicate_generation_response(duplicate, normalized):
+    """复用已有生成时的上传响应，客户端按返回的image_id继续查询状态"""
+    return jsonify(duplicate_generation_data(duplicate, normalized))
+
+def submit_generation(job):
+    """提交后台生成任务，队列已满时把图片标记为失败并返回429响应"""
     try:
-        # 这里需要读取项目中的图片2并插入数据库
-        # 由于这是后端代码，我们需要从iOS项目的Assets中获取图片
-        # 暂时先插入一个占位符，实际部署时需要手动上传图片2
-        
-        # 创建一个小的占位图片
-        from PIL import Image as PILImage
-        import io
-        
-        # 创建一个402x874的占位图片
-        placeholder = PILImage.new('RGB', (402, 874), color='#F5DEB3')  # 浅黄色背景
-        
-        # 将图片转换为字节
-        img_byte_arr = io.BytesIO()
-        placeholder.save(img_byte_arr, format='JPEG', quality=90)
-        img_byte_arr = img_byte_arr.getvalue()
-        
-        cursor.execute(
-            "INSERT INTO studio_backgrounds (image_data, is_active) VALUES (%s, %s)",
-            (img_byte_arr, True)
-        )
-        
-        logger.info("📸 已插入占位符背景图片，请通过管理接口上传实际的图片2")
-        
-    except Exception as e:
-        logger.error(f"❌ 初始化背景图片失败: {e}")
+        generation_executor.submit(job_dispatcher.run_job, job)
+        return None
+    except QueueFullError as e:
+        update_image_status(job['image_id'], 'failed')
+        generation_jobs.finish(job['id'], error='queue full')
+        return generation_busy_response(e.retry_after)
 
-@app.route('/', methods=['GET'])
+@api.route('/', methods=['GET'])
 def home():
     """根路径"""
     return jsonify({
@@ -149,19 +146,27 @@ def home():
         'status': 'running',
         'version': '2.0.0',
         'endpoints': [
-            '/health - 健康检查',
+            '/health - 存活检查（不访问数据库）',
+            '/ready - 就绪检查（数据库和表结构）',
             '/upload - 图片上传',
             '/upload-studio-background - 上传照相馆背景图片',
             '/upload-memory-photo - 上传记忆照片',
+            '/upload-memory-photos - 批量上传记忆照片',
+            '/upload-memory-photos/<batch_id>/status - 查询批次状态',
             '/studio-background - 获取照相馆背景图片',
             '/status/<id> - 查询状态',
+            '/status/<id>/events - 状态推送（Server-Sent Events）',
+            '/status?ids=1,2,3 或 POST /status/batch - 批量查询状态',
             '/image/<id> - 获取图片',
+            '/blob/<key>?expires=&sig= - 签名的输入图片（供生成服务读取）',
+            'POST /webhooks/bfl/<job_id> - BFL任务完成回调（签名校验）',
             '/test - 测试接口',
-            '/test-api - 测试BFL API'
+            '/test-api - 测试BFL API',
+            '/metrics - 运行指标'
         ]
     })
 
-@app.route('/health', methods=['GET'])
+@api.route('/health', methods=['GET'])
 def health_check():
     """健康检查接口"""
     return jsonify({
@@ -170,7 +175,47 @@ def health_check():
         'version': '2.0.0'
     })
 
-@app.route('/test', methods=['GET'])
+@api.route('/ready', methods=['GET'])
+def readiness_check():
+    """
+    就绪检查：数据库可以连接且表结构已迁移到最新版本时返回200，否则返回503
+    /health只表示进程存活，不访问数据库
+    """
+    try:
+        conn = db_pool.get_connection(DB_CONFIG, timeout=READINESS_TIMEOUT, retries=1)
+    except Exception as e:
+        return jsonify({'status': 'unavailable', 'reason': f'数据库连接失败: {e}'}), 503
+    try:
+        ready, details = schema_status(conn)
+    except Exception as e:
+        conn.discard()
+        return jsonify({'status': 'unavailable', 'reason': f'读取迁移版本失败: {e}'}), 503
+    conn.close()
+    if not ready:
+        return jsonify(dict(details, status='unavailable', reason='数据库表结构需要迁移')), 503
+    return jsonify(dict(details, status='ready'))
+
+@api.route('/metrics', methods=['GET'])
+def metrics():
+    """运行指标（连接池等）"""
+    return jsonify({
+        'db_pool': db_pool.pool_stats(),
+        'generation': generation_executor.stats(),
+        'bfl_submit_limiter': bfl_submit_limiter.stats(),
+        'bfl_guard': guard_stats(),
+        'jobs': generation_jobs.stats(),
+        'bfl_poller': bfl_poller.stats(),
+        'webhooks': webhook_stats(),
+        'sample_download': download_stats(),
+        'http_client': http_client.stats(),
+        'input_delivery': delivery_stats(),
+        'image_cache': image_cache.stats(),
+        'pg_listener': pg_listener.stats(),
+        'image_normalizer': image_normalizer.stats(),
+        'status_stream': status_broker.stats()
+    })
+
+@api.route('/test', methods=['GET'])
 def test():
     """测试接口"""
     env_info = {
@@ -195,7 +240,7 @@ def test():
         }
     })
 
-@app.route('/test-api', methods=['GET'])
+@api.route('/test-api', methods=['GET'])
 def test_bfl_api():
     """测试Black Forest Lab API"""
     try:
@@ -220,12 +265,7 @@ def test_bfl_api():
         logger.info(f"🧪 测试payload: {payload}")
         logger.info(f"🧪 API Key: {BFL_API_KEY[:10]}...")
         
-        response = requests.post(
-            BFL_API_URL, 
-            json=payload, 
-            headers=headers,
-            timeout=60
-        )
+        response = http_client.post(BFL_API_URL, endpoint='bfl.test', json=payload, headers=headers)
         
         logger.info(f"🧪 API测试响应: {response.status_code}")
         logger.info(f"🧪 API测试内容: {response.text}")
@@ -251,7 +291,7 @@ def test_bfl_api():
             'message': f'API测试异常: {str(e)}'
         }), 500
 
-@app.route('/upload', methods=['POST'])
+@api.route('/upload', methods=['POST'])
 def upload_image():
     """上传图片并触发AI生成"""
     try:
@@ -262,9 +302,17 @@ def upload_image():
         if file.filename == '':
             return jsonify({'error': '没有选择文件'}), 400
         
-        # 读取图片数据
-        image_data = file.read()
-        logger.info(f"📸 收到图片上传，大小: {len(image_data)} bytes")
+        # 上传内容已经在解析请求时流式写入临时文件（同时校验了文件头和大小）
+        upload = ingested(file)
+        logger.info(f"📸 收到图片上传，大小: {upload.size} bytes，SHA-256: {upload.sha256[:12]}")
+        
+        # 校验并规范化图片（EXIF旋转、缩小、去掉元数据、重新编码）
+        normalized = image_normalizer.normalize(upload.name)
+        
+        # 图片内容写入blob存储
+        blob = get_blob_store().put(normalized.data, normalized.content_type)
+        # 去重键在取数据库连接之前计算：读取当前背景可能要用到另一个连接
+        dedup_key = generation_dedup_key_for(JOB_KIND_STUDIO, blob.key)
         
         # 保存到数据库
         conn = get_db_connection()
@@ -272,31 +320,55 @@ def upload_image():
             return jsonify({'error': '数据库连接失败'}), 500
         
         cursor = conn.cursor()
+        record_blob(cursor, blob)
+        
+        # 相同的生成已完成或正在进行时直接复用，不再调用BFL
+        duplicate = find_duplicate_generation(cursor, dedup_key)
+        if duplicate:
+            conn.commit()
+            cursor.close()
+            conn.close()
+            return duplicate_generation_response(duplicate, normalized)
+        
+        if not generation_executor.has_capacity():
+            conn.rollback()
+            cursor.close()
+            conn.close()
+            return generation_busy_response(generation_executor.retry_after)
+        
         cursor.execute(
-            "INSERT INTO images (original_image, status) VALUES (%s, %s) RETURNING id",
-            (image_data, 'processing')
+            INSERT_IMAGE_SQL,
+            (blob.key, 'processing', dedup_key)
         )
         image_id = cursor.fetchone()[0]
+        job = generation_jobs.enqueue(cursor, image_id, JOB_KIND_STUDIO)
         conn.commit()
         cursor.close()
         conn.close()
         
         logger.info(f"✅ 图片保存成功，ID: {image_id}")
         
-        # 在后台线程中生成新图片
-        threading.Thread(target=generate_new_image, args=(image_id,)).start()
+        # 提交到生成执行器
+        busy = submit_generation(job)
+        if busy:
+            return busy
         
         return jsonify({
             'success': True,
             'image_id': image_id,
-            'message': '图片上传成功，正在生成新图片...'
+            'message': '图片上传成功，正在生成新图片...',
+            'normalization': normalized.summary()
         })
         
+    except UPLOAD_REJECTIONS as e:
+        return upload_rejected_response(e)
+    except InvalidImageError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         logger.error(f"❌ 上传失败: {e}")
         return jsonify({'error': f'上传失败: {str(e)}'}), 500
 
-@app.route('/upload-studio-background', methods=['POST'])
+@api.route('/upload-studio-background', methods=['POST'])
 def upload_studio_background():
     """上传照相馆背景图片（管理员接口）"""
     try:
@@ -307,9 +379,15 @@ def upload_studio_background():
         if file.filename == '':
             return jsonify({'error': '没有选择文件'}), 400
         
-        # 读取图片数据
-        image_data = file.read()
-        logger.info(f"🖼️ 收到照相馆背景图片上传，大小: {len(image_data)} bytes")
+        # 上传内容已经在解析请求时流式写入临时文件（同时校验了文件头和大小）
+        upload = ingested(file)
+        logger.info(f"🖼️ 收到照相馆背景图片上传，大小: {upload.size} bytes，SHA-256: {upload.sha256[:12]}")
+        
+        # 校验并规范化图片（EXIF旋转、缩小、去掉元数据、重新编码）
+        normalized = image_normalizer.normalize(upload.name)
+        
+        # 图片内容写入blob存储
+        blob = get_blob_store().put(normalized.data, normalized.content_type)
         
         # 保存到数据库
         conn = get_db_connection()
@@ -322,27 +400,36 @@ def upload_studio_background():
         cursor.execute("UPDATE studio_backgrounds SET is_active = false")
         
         # 插入新的背景图片
+        record_blob(cursor, blob)
         cursor.execute(
-            "INSERT INTO studio_backgrounds (image_data, is_active) VALUES (%s, %s)",
-            (image_data, True)
+            "INSERT INTO studio_backgrounds (blob_key, is_active) VALUES (%s, %s)",
+            (blob.key, True)
         )
+        # 通知所有进程丢弃缓存的旧背景（随事务提交送达）
+        notify(cursor, STUDIO_BACKGROUND_CHANNEL, blob.key)
         
         conn.commit()
         cursor.close()
         conn.close()
         
+        studio_background_cache.invalidate()
         logger.info(f"✅ 照相馆背景图片上传成功")
         
         return jsonify({
             'success': True,
-            'message': '照相馆背景图片上传成功'
+            'message': '照相馆背景图片上传成功',
+            'normalization': normalized.summary()
         })
         
+    except UPLOAD_REJECTIONS as e:
+        return upload_rejected_response(e)
+    except InvalidImageError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         logger.error(f"❌ 背景图片上传失败: {e}")
         return jsonify({'error': f'背景图片上传失败: {str(e)}'}), 500
 
-@app.route('/upload-memory-photo', methods=['POST'])
+@api.route('/upload-memory-photo', methods=['POST'])
 def upload_memory_photo():
     """上传记忆照片并进行AI风格化处理"""
     try:
@@ -353,11 +440,23 @@ def upload_memory_photo():
         if file.filename == '':
             return jsonify({'error': '没有选择文件'}), 400
         
-        photo_index = request.form.get('photo_index', '0')
+        # 在写入存储之前校验参数，无效时不留下孤立的blob
+        try:
+            photo_index = int(request.form.get('photo_index', '0'))
+        except ValueError:
+            return jsonify({'error': 'photo_index必须是整数'}), 400
+        
+        # 上传内容已经在解析请求时流式写入临时文件（同时校验了文件头和大小）
+        upload = ingested(file)
+        logger.info(f"📸 收到记忆照片上传，索引: {photo_index}，大小: {upload.size} bytes，SHA-256: {upload.sha256[:12]}")
         
-        # 读取图片数据
-        image_data = file.read()
-        logger.info(f"📸 收到记忆照片上传，索引: {photo_index}，大小: {len(image_data)} bytes")
+        # 校验并规范化图片（EXIF旋转、缩小、去掉元数据、重新编码）
+        normalized = image_normalizer.normalize(upload.name)
+        
+        # 图片内容写入blob存储
+        blob = get_blob_store().put(normalized.data, normalized.content_type)
+        # 去重键在取数据库连接之前计算：读取当前背景可能要用到另一个连接
+        dedup_key = generation_dedup_key_for(JOB_KIND_MEMORY_PHOTO, blob.key)
         
         # 保存到数据库
         conn = get_db_connection()
@@ -365,76 +464,282 @@ def upload_memory_photo():
             return jsonify({'error': '数据库连接失败'}), 500
         
         cursor = conn.cursor()
+        record_blob(cursor, blob)
+        
+        # 相同的生成已完成或正在进行时直接复用，不再调用BFL
+        duplicate = find_duplicate_generation(cursor, dedup_key)
+        if duplicate:
+            conn.commit()
+            cursor.close()
+            conn.close()
+            return duplicate_generation_response(duplicate, normalized)
+        
+        if not generation_executor.has_capacity():
+            conn.rollback()
+            cursor.close()
+            conn.close()
+            return generation_busy_response(generation_executor.retry_after)
+        
         cursor.execute(
-            "INSERT INTO images (original_image, status) VALUES (%s, %s) RETURNING id",
-            (image_data, 'processing')
+            INSERT_IMAGE_SQL,
+            (blob.key, 'processing', dedup_key)
         )
         image_id = cursor.fetchone()[0]
+        job = generation_jobs.enqueue(cursor, image_id, JOB_KIND_MEMORY_PHOTO, photo_index)
         conn.commit()
         cursor.close()
         conn.close()
         
         logger.info(f"✅ 记忆照片保存成功，ID: {image_id}")
         
-        # 在后台线程中进行AI风格化处理
-        threading.Thread(target=stylize_memory_photo, args=(image_id, int(photo_index))).start()
+        # 提交到生成执行器进行AI风格化处理
+        busy = submit_generation(job)
+        if busy:
+            return busy
         
         return jsonify({
             'success': True,
             'image_id': image_id,
-            'message': '记忆照片上传成功，正在进行风格化处理...'
+            'message': '记忆照片上传成功，正在进行风格化处理...',
+            'normalization': normalized.summary()
         })
         
+    except UPLOAD_REJECTIONS as e:
+        return upload_rejected_response(e)
+    except InvalidImageError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         logger.error(f"❌ 记忆照片上传失败: {e}")
         return jsonify({'error': f'记忆照片上传失败: {str(e)}'}), 500
 
-def stylize_memory_photo(image_id, photo_index):
-    """对记忆照片进行AI风格化处理"""
+@api.route('/upload-memory-photos', methods=['POST'])
+def upload_memory_photos():
+    """
+    批量上传记忆照片（多个images字段，可选对应的photo_index字段）
+    所有照片在一个事务中写入并创建任务，返回批次ID，客户端只需查询一次批次状态
+    """
     try:
-        logger.info(f"🎨 开始风格化记忆照片 {image_id} (索引: {photo_index})")
+        files = [file for file in request.files.getlist('images') + request.files.getlist('image') if file.filename]
+        if not files:
+            return jsonify({'error': '没有找到图片文件'}), 400
+        if len(files) > BATCH_MAX_FILES:
+            return jsonify({'error': f'一次最多上传 {BATCH_MAX_FILES} 张照片'}), 400
+        
+        raw_indexes = request.form.getlist('photo_index')
+        try:
+            photo_indexes = [int(index) for index in raw_indexes] if raw_indexes else list(range(len(files)))
+        except ValueError:
+            return jsonify({'error': 'photo_index必须是整数'}), 400
+        if len(photo_indexes) != len(files) or len(set(photo_indexes)) != len(photo_indexes):
+            return jsonify({'error': 'photo_index的数量必须和照片一致且不能重复'}), 400
+        
+        uploads = [ingested(file) for file in files]
+        logger.info(f"📸 收到批量记忆照片上传，共 {len(uploads)} 张，{sum(u.size for u in uploads)} bytes")
+        
+        # 所有照片在进程池中并行规范化
+        normalized = image_normalizer.normalize_many([upload.name for upload in uploads])
+        store = get_blob_store()
+        blobs = [store.put(image.data, image.content_type) for image in normalized]
+        dedup_keys = [generation_dedup_key_for(JOB_KIND_MEMORY_PHOTO, blob.key) for blob in blobs]
+        
+        conn = get_db_connection()
+        if not conn:
+            return jsonify({'error': '数据库连接失败'}), 500
+        
+        cursor = conn.cursor()
+        for blob in blobs:
+            record_blob(cursor, blob)
+        batch_id = create_batch(cursor, JOB_KIND_MEMORY_PHOTO)
+        
+        # 同一批次中相同的照片只生成一次；按去重键排序后加锁，两个批次不会互相等待advisory锁
+        duplicates = {}
+        for dedup_key in sorted(set(dedup_keys)):
+            duplicate = find_duplicate_generation(cursor, dedup_key)
+            if duplicate:
+                duplicates[dedup_key] = duplicate
+        
+        new_images = {}
+        for blob, dedup_key, photo_index in zip(blobs, dedup_keys, photo_indexes):
+            if dedup_key not in duplicates and dedup_key not in new_images:
+                new_images[dedup_key] = (blob.key, photo_index)
+        
+        if new_images and not generation_executor.has_capacity(len(new_images)):
+            conn.rollback()
+            cursor.close()
+            conn.close()
+            return generation_busy_response(generation_executor.retry_after)
+        
+        # 一条多行INSERT写入图片，一条写入任务
+        image_ids = insert_images(cursor, [(original_key, dedup_key) for dedup_key, (original_key, _) in new_images.items()])
+        image_ids = dict(zip(new_images, image_ids))
+        jobs = generation_jobs.enqueue_many(
+            cursor, [(image_ids[dedup_key], JOB_KIND_MEMORY_PHOTO, photo_index)
+                     for dedup_key, (_, photo_index) in new_images.items()]
+        )
+        
+        photos = []
+        for dedup_key, photo_index, image in zip(dedup_keys, photo_indexes, normalized):
+            if dedup_key in duplicates:
+                image_id, status = duplicates[dedup_key]
+            else:
+                image_id, status = image_ids[dedup_key], 'processing'
+            photos.append({
+                'photo_index': photo_index,
+                'image_id': image_id,
+                'status': status,
+                'deduplicated': dedup_key in duplicates or new_images[dedup_key][1] != photo_index,
+                'normalization': image.summary()
+            })
+        add_batch_images(cursor, batch_id, [(photo['photo_index'], photo['image_id']) for photo in photos])
+        conn.commit()
+        cursor.close()
+        conn.close()
         
-        # 构建用户图片的公开URL
-        base_url = os.getenv('PUBLIC_URL', 'https://petecho.zeabur.app')
-        user_image_url = f"{base_url}/image/{image_id}?type=original"
+        logger.info(f"✅ 批量记忆照片保存成功，批次: {batch_id}，新任务: {len(jobs)}，复用: {len(photos) - len(jobs)}")
         
-        logger.info(f"✅ 构建记忆照片URL: {user_image_url}")
+        # 各张照片并行风格化；执行器已满时释放任务，由调度器稍后接手，不把整批标记为失败
+        for job in jobs:
+            try:
+                generation_executor.submit(job_dispatcher.run_job, job)
+            except QueueFullError:
+                generation_jobs.release([job['id']])
         
-        # 记忆照片风格化提示词
-        prompt = """Transform this photo into a warm, anime-style illustration with the same cozy atmosphere as a pet photography studio.
+        return jsonify({
+            'success': True,
+            'batch_id': batch_id,
+            'photos': photos,
+            'message': f'{len(photos)} 张记忆照片上传成功，正在进行风格化处理...'
+        })
+        
+    except UPLOAD_REJECTIONS as e:
+        return upload_rejected_response(e)
+    except InvalidImageError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        logger.error(f"❌ 批量记忆照片上传失败: {e}")
+        return jsonify({'error': f'批量记忆照片上传失败: {str(e)}'}), 500
 
-Requirements:
-- Convert to soft anime/cartoon art style
-- Maintain warm golden lighting and gentle atmosphere
-- Keep all objects and details recognizable but stylized
-- Use soft pastels and warm colors
-- Create a heartwarming, memorial-like mood
-- Style should match pet photography studio ambiance
-- Output format: suitable for mobile app display
+@api.route('/upload-memory-photos/<int:batch_id>/status', methods=['GET'])
+def get_batch_status(batch_id):
+    """批次的汇总状态和每张照片的状态（一次查询）"""
+    try:
+        conn = get_db_connection()
+        if not conn:
+            return jsonify({'error': '数据库连接失败'}), 500
+        try:
+            cursor = conn.cursor()
+            members = load_batch_members(cursor, batch_id)
+            cursor.close()
+        finally:
+            conn.close()
+        if members is None:
+            return jsonify({'error': '批次不存在'}), 404
+        
+        photos = [
+            dict(status_response_data(image_id, status, has_generated_image), photo_index=photo_index, image_id=image_id)
+            for photo_index, image_id, status, has_generated_image in members
+        ]
+        statuses = [photo['status'] for photo in photos]
+        return jsonify({
+            'batch_id': batch_id,
+            'status': aggregate_status(statuses),
+            'total': len(statuses),
+            'completed': statuses.count('completed'),
+            'failed': statuses.count('failed'),
+            'photos': photos
+        })
+        
+    except Exception as e:
+        logger.error(f"❌ 获取批次状态失败: {e}")
+        return jsonify({'error': f'获取批次状态失败: {str(e)}'}), 500
 
-将这张照片转换成温馨的动漫风格插画，保持与宠物照相馆相同的舒适氛围。
-使用柔和的动漫风格，温暖的色调，营造治愈系的纪念氛围。"""
+def original_input_reference(image_id):
+    """上传图片在BFL请求中的引用（按BFL_INPUT_DELIVERY为base64或签名地址）"""
+    conn = get_db_connection()
+    if not conn:
+        raise RuntimeError('数据库连接失败')
+    try:
+        cursor = conn.cursor()
+        # 尚未迁移的旧数据直接读取BYTEA
+        cursor.execute(
+            "SELECT original_key, CASE WHEN original_key IS NULL THEN original_image END FROM images WHERE id = %s",
+            (image_id,)
+        )
+        row = cursor.fetchone()
+        cursor.close()
+    finally:
+        conn.close()
+    if not row or not (row[0] or row[1]):
+        raise RuntimeError(f'图片 {image_id} 不存在')
+    blob_key, legacy_data = row
+    return input_image_reference(
+        'bfl', blob_key, bytes(legacy_data) if legacy_data is not None else None,
+        public_path=f"/image/{image_id}?type=original"
+    )
+
+def post_bfl_task(payload, headers):
+    """
+    向BFL提交任务，经过熔断器和自适应并发限制
+    熔断或等不到名额时抛出ProviderBusyError（请求没有发出），
+    429 / 5xx / 网络错误计入熔断器后抛出ProviderOverloadedError，其余响应原样返回
+    """
+    if bfl_breaker.is_open():
+        raise ProviderBusyError('熔断', bfl_breaker.retry_after())
+    if not bfl_submit_concurrency.acquire(timeout=PROVIDER_GUARD_CONFIG['acquire_timeout']):
+        raise ProviderBusyError('并发已满', PROVIDER_GUARD_CONFIG['acquire_timeout'])
+    if not bfl_breaker.allow():
+        bfl_submit_concurrency.cancel()
+        raise ProviderBusyError('熔断', bfl_breaker.retry_after())
+    
+    started = time.monotonic()
+    try:
+        response = http_client.post(BFL_API_URL, endpoint='bfl.submit', json=payload, headers=headers)
+    except Exception as e:
+        bfl_submit_concurrency.release((time.monotonic() - started) * 1000, overloaded=True)
+        bfl_breaker.record(False)
+        raise ProviderOverloadedError(f"BFL请求失败: {e}") from e
+    overloaded = response.status_code in RETRY_STATUSES
+    bfl_submit_concurrency.release((time.monotonic() - started) * 1000, overloaded=overloaded)
+    bfl_breaker.record(not overloaded)
+    if overloaded:
+        raise ProviderOverloadedError(f"BFL返回 {response.status_code}")
+    return response
 
+def stylize_memory_photo(image_id, photo_index, job_id=None):
+    """
+    对记忆照片进行AI风格化处理（提交BFL任务），job_id用于完成回调地址
+    返回 (task_id, polling_url) 表示需要继续轮询，返回None表示任务已结束
+    """
+    try:
+        logger.info(f"🎨 开始风格化记忆照片 {image_id} (索引: {photo_index})")
+        
+        # 按BFL_INPUT_DELIVERY把已规范化的图片直接放进请求（或使用签名地址），BFL不需要回头请求我们的服务
+        user_image = original_input_reference(image_id)
+        logger.info(f"✅ 记忆照片输入: {describe_reference(user_image)}")
+        
         # 调用BFL API进行风格化
         headers = {
             'x-key': BFL_API_KEY,
             'Content-Type': 'application/json'
         }
         
+        preset = GENERATION_PRESETS[JOB_KIND_MEMORY_PHOTO]
         payload = {
-            'prompt': prompt,
-            'input_image': user_image_url,
-            'seed': 42,
-            'aspect_ratio': '1:1',  # 记忆照片使用1:1比例
+            'prompt': preset['prompt'],
+            'input_image': user_image,
+            'seed': preset['seed'],
+            'aspect_ratio': preset['aspect_ratio'],
             'output_format': 'jpeg',
             'prompt_upsampling': False,
-            'safety_tolerance': 2
+            'safety_tolerance': 2,
+            # 开启回调时BFL在任务结束后通知我们，不需要频繁轮询
+            **webhook_fields(job_id)
         }
         
         logger.info(f"🎨 调用BFL API风格化记忆照片...")
         logger.info(f"📋 记忆照片索引: {photo_index}")
         
-        response = requests.post(BFL_API_URL, json=payload, headers=headers, timeout=60)
+        response = post_bfl_task(payload, headers)
         logger.info(f"📡 BFL API响应: {response.status_code}")
         
         if response.status_code == 200:
@@ -442,10 +747,10 @@ Requirements:
             logger.info(f"✅ 记忆照片风格化任务提交成功")
             
             if 'id' in result:
-                # 轮询结果
+                # 由任务队列继续轮询结果
                 polling_url = result.get('polling_url')
                 if polling_url:
-                    poll_memory_photo_result(image_id, polling_url, photo_index)
+                    return result['id'], polling_url
                 else:
                     logger.error(f"❌ 未获得轮询URL")
                     update_image_status(image_id, 'failed')
@@ -456,76 +761,35 @@ Requirements:
             logger.error(f"❌ BFL API调用失败: {response.status_code}")
             update_image_status(image_id, 'failed')
             
+    except (ProviderBusyError, ProviderOverloadedError):
+        # BFL不健康，任务留在队列里稍后重试，不把图片标记为失败
+        raise
     except Exception as e:
         logger.error(f"❌ 记忆照片风格化异常: {e}")
         update_image_status(image_id, 'failed')
+    return None
 
-def poll_memory_photo_result(image_id, polling_url, photo_index):
-    """轮询记忆照片处理结果"""
-    max_attempts = 60
-    attempts = 0
-    
-    while attempts < max_attempts:
-        attempts += 1
-        
-        try:
-            response = requests.get(polling_url, timeout=10)
-            
-            if response.status_code == 200:
-                result = response.json()
-                status = result.get('status', 'unknown')
-                
-                logger.info(f"📊 记忆照片 {photo_index} 状态检查 {attempts}: {status}")
-                
-                if status == 'Ready' and 'sample' in result:
-                    generated_image_url = result['sample']
-                    logger.info(f"✅ 记忆照片 {photo_index} 风格化完成: {generated_image_url}")
-                    
-                    # 下载并保存风格化后的图片
-                    img_response = requests.get(generated_image_url)
-                    if img_response.status_code == 200:
-                        conn = get_db_connection()
-                        if conn:
-                            cursor = conn.cursor()
-                            cursor.execute(
-                                "UPDATE images SET generated_image = %s, status = %s WHERE id = %s",
-                                (img_response.content, 'completed', image_id)
-                            )
-                            conn.commit()
-                            cursor.close()
-                            conn.close()
-                            logger.info(f"✅ 记忆照片 {photo_index} 风格化完成并保存")
-                            return
-                    
-                elif status == 'failed':
-                    logger.error(f"❌ 记忆照片 {photo_index} 风格化失败")
-                    update_image_status(image_id, 'failed')
-                    return
-                    
-            time.sleep(5)
-            
-        except Exception as e:
-            logger.error(f"❌ 轮询记忆照片 {photo_index} 失败: {e}")
-            time.sleep(5)
-    
-    # 超时
-    logger.error(f"⏰ 记忆照片 {photo_index} 风格化超时")
-    update_image_status(image_id, 'failed')
-
-def generate_new_image(image_id):
-    """使用Black Forest Lab生成新图片"""
+def generate_new_image(image_id, job_id=None):
+    """
+    使用Black Forest Lab生成新图片（提交BFL任务），job_id用于完成回调地址
+    返回 (task_id, polling_url) 表示需要继续轮询，返回None表示任务已结束
+    """
     try:
         logger.info(f"🔍 开始处理图片 {image_id}")
         
-        # 构建用户上传图片的公开URL
-        base_url = os.getenv('PUBLIC_URL', 'https://petecho.zeabur.app')
-        user_image_url = f"{base_url}/image/{image_id}?type=original"
-        
-        # 构建照相馆背景图片的公开URL
-        studio_background_url = f"{base_url}/studio-background"
+        # 按BFL_INPUT_DELIVERY把两张图片直接放进请求（或使用签名地址），BFL不需要回头请求我们的服务
+        user_image = original_input_reference(image_id)
+        background = active_studio_background()
+        if background is None:
+            logger.error(f"❌ 照相馆背景图片不存在，无法生成图片 {image_id}")
+            update_image_status(image_id, 'failed')
+            return None
+        studio_background = input_image_reference(
+            'bfl', background.blob_key, background.data, public_path='/studio-background'
+        )
         
-        logger.info(f"✅ 构建用户图片URL: {user_image_url}")
-        logger.info(f"✅ 构建照相馆背景URL: {studio_background_url}")
+        logger.info(f"✅ 用户图片输入: {describe_reference(user_image)}")
+        logger.info(f"✅ 照相馆背景输入: {describe_reference(studio_background)}")
         logger.info(f"🎨 将在payload中同时传递两张图片")
         
         # 调用BFL API
@@ -534,64 +798,30 @@ def generate_new_image(image_id):
             'Content-Type': 'application/json'
         }
         
-        # 强调沿用照相馆风格的提示词
-        prompt = """Create an anime-style pet memorial photo by combining the pet from the first image with the studio setting from the second image.
-        
-        Task: Place the anime-stylized pet sitting on the wooden chair in the exact same studio environment as shown in the background image.
-        
-        Requirements:
-        - Keep the EXACT same studio layout, lighting, and atmosphere from the background image
-        - Transform the pet into cute anime/cartoon style while maintaining its original characteristics  
-        - The pet should sit calmly on the wooden chair, looking towards the camera
-        - Preserve the warm golden lighting and cozy photography studio atmosphere
-        - Maintain the camera, tripod, and all studio elements in their original positions
-        - Style: Anime illustration with soft colors and heartwarming mood
-        - Output format: 9:20 aspect ratio for mobile app background
-        
-        请将第一张图片中的宠物与第二张图片中的照相馆场景结合，创造温馨的动漫风格纪念照。
-        保持照相馆的原有风格和布局，让动漫化的宠物自然地坐在椅子上等待拍照。
-        沿用照相馆的温暖色调、灯光效果和整体氛围。"""
-        
+        preset = GENERATION_PRESETS[JOB_KIND_STUDIO]
+        prompt = preset['prompt']
         payload = {
             'prompt': prompt,
-            'input_image': user_image_url,  # 用户的宠物照片
-            'background_image': studio_background_url,  # 照相馆背景图片
-            'reference_image': studio_background_url,  # 尝试不同的字段名
-            'studio_image': studio_background_url,  # 再尝试一个字段名
-            'second_image': studio_background_url,  # 第二张图片
-            'seed': 42,
-            'aspect_ratio': '9:20',  # 接近402*874的比例，适合iPhone16Pro
+            'input_image': user_image,  # 用户的宠物照片
+            # 照相馆背景只放一次：Kontext的第二张参考图字段，内嵌base64时重复字段会让请求体成倍增大
+            'input_image_2': studio_background,
+            'seed': preset['seed'],
+            'aspect_ratio': preset['aspect_ratio'],
             'output_format': 'jpeg',
             'prompt_upsampling': False,
-            'safety_tolerance': 2
+            'safety_tolerance': 2,
+            # 开启回调时BFL在任务结束后通知我们，不需要频繁轮询
+            **webhook_fields(job_id)
         }
         
         logger.info(f"🔄 调用BFL API...")
         logger.info(f"🌐 API URL: {BFL_API_URL}")
         logger.info(f"🔑 API Key: {BFL_API_KEY[:10]}...")
-        logger.info(f"🎯 尝试多图片输入:")
-        logger.info(f"   - 宠物图片: {user_image_url}")
-        logger.info(f"   - 照相馆背景: {studio_background_url}")
         logger.info(f"📋 Payload字段: {list(payload.keys())}")
         logger.info(f"📝 提示词长度: {len(prompt)} 字符")
         
-        # 首先测试我们的图片URL是否可以访问
-        try:
-            test_response = requests.head(user_image_url, timeout=10)
-            logger.info(f"🔍 用户图片URL测试: {test_response.status_code}, Content-Type: {test_response.headers.get('content-type', 'unknown')}")
-            
-            studio_test_response = requests.head(studio_background_url, timeout=10)
-            logger.info(f"🔍 照相馆背景URL测试: {studio_test_response.status_code}, Content-Type: {studio_test_response.headers.get('content-type', 'unknown')}")
-        except Exception as e:
-            logger.warning(f"⚠️ 图片URL测试失败: {e}")
-        
         # 使用BFL API格式
-        response = requests.post(
-            BFL_API_URL, 
-            json=payload, 
-            headers=headers,
-            timeout=60
-        )
+        response = post_bfl_task(payload, headers)
         
         logger.info(f"📡 API响应状态码: {response.status_code}")
         logger.info(f"📡 API响应内容: {response.text[:500]}...")
@@ -608,34 +838,16 @@ def generate_new_image(image_id):
                 logger.info(f"✅ 获得任务ID: {task_id}")
                 logger.info(f"✅ 轮询URL: {polling_url}")
                 
-                # 开始轮询结果
-                threading.Thread(target=poll_bfl_result, args=(image_id, task_id, polling_url)).start()
+                # 由任务队列继续轮询结果
                 logger.info(f"🔄 开始轮询任务结果，ID: {task_id}")
+                return task_id, polling_url
                 
             elif 'url' in result:
                 # 如果直接返回图片URL
                 generated_image_url = result['url']
                 logger.info(f"✅ 获得生成图片URL: {generated_image_url}")
                 
-                # 下载生成的图片
-                img_response = requests.get(generated_image_url)
-                if img_response.status_code == 200:
-                    # 保存生成的图片到数据库
-                    conn = get_db_connection()
-                    if conn:
-                        cursor = conn.cursor()
-                        cursor.execute(
-                            "UPDATE images SET generated_image = %s, status = %s WHERE id = %s",
-                            (img_response.content, 'completed', image_id)
-                        )
-                        conn.commit()
-                        cursor.close()
-                        conn.close()
-                        logger.info(f"✅ 图片 {image_id} 生成成功")
-                    else:
-                        logger.error(f"❌ 数据库连接失败，无法保存生成的图片")
-                else:
-                    logger.error(f"❌ 下载生成图片失败: {img_response.status_code}")
+                if not save_generated_image(image_id, generated_image_url):
                     update_image_status(image_id, 'failed')
             else:
                 logger.error(f"❌ API响应格式未知: {result}")
@@ -644,157 +856,199 @@ def generate_new_image(image_id):
             logger.error(f"❌ BFL API调用失败: {response.status_code}, 响应: {response.text}")
             update_image_status(image_id, 'failed')
             
+    except (ProviderBusyError, ProviderOverloadedError):
+        # BFL不健康，任务留在队列里稍后重试，不把图片标记为失败
+        raise
     except Exception as e:
         logger.error(f"❌ 生成图片异常: {e}")
         update_image_status(image_id, 'failed')
+    return None
 
-def poll_bfl_result(image_id, task_id, polling_url):
-    """轮询BFL API结果"""
+def save_generated_image(image_id, generated_image_url):
+    """下载生成的图片并保存到数据库，返回是否成功"""
+    # 边下载边写临时文件并计算哈希，整张图片不进入内存
     try:
-        logger.info(f"🔄 开始轮询任务 {task_id} 的结果...")
-        
-        max_attempts = 60  # 最多轮询5分钟（60次 * 5秒）
-        attempt = 0
-        
-        while attempt < max_attempts:
-            attempt += 1
-            logger.info(f"🔄 轮询第 {attempt} 次...")
-            
-            try:
-                # 使用轮询URL获取结果
-                headers = {
-                    'x-key': BFL_API_KEY,
-                    'Content-Type': 'application/json'
-                }
-                
-                response = requests.get(polling_url, headers=headers, timeout=30)
-                logger.info(f"📡 轮询响应状态码: {response.status_code}")
-                
-                if response.status_code == 200:
-                    result = response.json()
-                    
-                    # 显示完整的BFL图片URL（如果存在）
-                    if 'result' in result and 'sample' in result['result']:
-                        bfl_image_url = result['result']['sample']
-                        logger.info(f"🖼️ BFL完整图片URL: {bfl_image_url}")
-                    
-                    logger.info(f"📡 轮询响应摘要: 状态={result.get('status', 'unknown')}, 包含结果={bool(result.get('result'))}")
-                    
-                    # 检查任务状态
-                    if 'status' in result:
-                        status = result['status']
-                        logger.info(f"📊 任务状态: {status}")
-                        
-                        if status == 'completed' or status == 'Ready':
-                            # 任务完成，获取结果
-                            if 'result' in result and 'sample' in result['result']:
-                                generated_image_url = result['result']['sample']
-                                logger.info(f"✅ 获得生成图片URL: {generated_image_url}")
-                                
-                                # 下载生成的图片
-                                img_response = requests.get(generated_image_url)
-                                if img_response.status_code == 200:
-                                    # 保存生成的图片到数据库
-                                    conn = get_db_connection()
-                                    if conn:
-                                        cursor = conn.cursor()
-                                        cursor.execute(
-                                            "UPDATE images SET generated_image = %s, status = %s WHERE id = %s",
-                                            (img_response.content, 'completed', image_id)
-                                        )
-                                        conn.commit()
-                                        cursor.close()
-                                        conn.close()
-                                        
-                                        # 显示我们的简短URL
-                                        base_url = os.getenv('PUBLIC_URL', 'https://petecho.zeabur.app')
-                                        our_image_url = f"{base_url}/image/{image_id}?type=generated"
-                                        logger.info(f"✅ 图片 {image_id} 生成成功")
-                                        logger.info(f"🔗 简短访问URL: {our_image_url}")
-                                        logger.info(f"📱 iOS应用将使用此URL显示生成的图片")
-                                        return  # 成功完成，退出轮询
-                                    else:
-                                        logger.error(f"❌ 数据库连接失败，无法保存生成的图片")
-                                        update_image_status(image_id, 'failed')
-                                        return
-                                else:
-                                    logger.error(f"❌ 下载生成图片失败: {img_response.status_code}")
-                                    update_image_status(image_id, 'failed')
-                                    return
-                            else:
-                                logger.error(f"❌ 任务完成但未找到结果URL: {result}")
-                                update_image_status(image_id, 'failed')
-                                return
-                                
-                        elif status == 'failed':
-                            logger.error(f"❌ BFL任务失败: {result}")
-                            update_image_status(image_id, 'failed')
-                            return
-                        elif status in ['pending', 'running', 'processing']:
-                            logger.info(f"⏳ 任务进行中: {status}")
-                            # 继续轮询
-                        else:
-                            logger.warning(f"⚠️ 未知任务状态: {status}，继续轮询...")
-                    else:
-                        # 旧格式响应，检查是否直接包含结果
-                        if 'url' in result:
-                            generated_image_url = result['url']
-                            logger.info(f"✅ 获得生成图片URL: {generated_image_url}")
-                            
-                            # 下载生成的图片
-                            img_response = requests.get(generated_image_url)
-                            if img_response.status_code == 200:
-                                # 保存生成的图片到数据库
-                                conn = get_db_connection()
-                                if conn:
-                                    cursor = conn.cursor()
-                                    cursor.execute(
-                                        "UPDATE images SET generated_image = %s, status = %s WHERE id = %s",
-                                        (img_response.content, 'completed', image_id)
-                                    )
-                                    conn.commit()
-                                    cursor.close()
-                                    conn.close()
-                                    
-                                    # 显示我们的简短URL
-                                    base_url = os.getenv('PUBLIC_URL', 'https://petecho.zeabur.app')
-                                    our_image_url = f"{base_url}/image/{image_id}?type=generated"
-                                    logger.info(f"✅ 图片 {image_id} 生成成功")
-                                    logger.info(f"🔗 简短访问URL: {our_image_url}")
-                                    logger.info(f"📱 iOS应用将使用此URL显示生成的图片")
-                                    return  # 成功完成，退出轮询
-                                else:
-                                    logger.error(f"❌ 数据库连接失败，无法保存生成的图片")
-                                    update_image_status(image_id, 'failed')
-                                    return
-                            else:
-                                logger.error(f"❌ 下载生成图片失败: {img_response.status_code}")
-                                update_image_status(image_id, 'failed')
-                                return
-                        else:
-                            logger.info(f"⏳ 任务仍在处理中，等待下次轮询...")
-                            
-                elif response.status_code == 404:
-                    logger.warning(f"⚠️ 任务未找到，可能已过期: {task_id}")
-                    update_image_status(image_id, 'failed')
-                    return
-                else:
-                    logger.warning(f"⚠️ 轮询响应异常: {response.status_code}")
-                    logger.info(f"📡 错误响应内容: {response.text[:200]}...")
-                    
-            except Exception as e:
-                logger.warning(f"⚠️ 轮询请求异常: {e}")
-            
-            # 等待5秒后继续轮询
-            time.sleep(5)
-        
-        # 轮询超时
-        logger.error(f"❌ 轮询超时，任务 {task_id} 未完成")
-        update_image_status(image_id, 'failed')
+        sample = download_sample(generated_image_url, endpoint='bfl.sample')
+    except (SampleDownloadError, OSError) as e:
+        logger.error(f"❌ 下载生成图片失败: {e}")
+        return False
+    
+    with sample:
+        # 生成的图片写入blob存储，数据库只记录key
+        blob = get_blob_store().put_hashed_file(sample.path, sample.sha256, sample.size, sample.content_type)
         
-    except Exception as e:
-        logger.error(f"❌ 轮询异常: {e}")
-        update_image_status(image_id, 'failed')
+        # 一次性生成缩略图和WebP / AVIF版本，失败时只影响预览，不影响生成结果
+        renditions = []
+        try:
+            renditions = create_renditions(sample.path)
+        except Exception as e:
+            logger.warning(f"⚠️ 图片 {image_id} 生成缩略图失败: {e}")
+    
+    conn = get_db_connection()
+    if not conn:
+        logger.error(f"❌ 数据库连接失败，无法保存生成的图片")
+        return False
+    cursor = conn.cursor()
+    record_blob(cursor, blob)
+    record_renditions(cursor, image_id, renditions)
+    cursor.execute(
+        "UPDATE images SET generated_key = %s, has_generated = true, status = %s WHERE id = %s",
+        (blob.key, 'completed', image_id)
+    )
+    notify_status(cursor, image_id, 'completed')
+    conn.commit()
+    cursor.close()
+    conn.close()
+    status_broker.publish(image_id, 'completed')
+    
+    # 显示我们的简短URL
+    base_url = os.getenv('PUBLIC_URL', 'https://petecho.zeabur.app')
+    our_image_url = f"{base_url}/image/{image_id}?type=generated"
+    logger.info(f"✅ 图片 {image_id} 生成成功")
+    logger.info(f"🔗 简短访问URL: {our_image_url}")
+    logger.info(f"📱 iOS应用将使用此URL显示生成的图片")
+    return True
+
+def finish_bfl_task(job, outcome, detail):
+    """
+    轮询到BFL任务结束（由轮询调度器在完成线程中调用）
+    完成回调可能已经先到达，领取到结果处理后才下载保存
+    """
+    if not generation_jobs.claim_completion(job['id'], job['bfl_task_id']):
+        logger.info(f"ℹ️ 生成任务 {job['id']} 的结果已由完成回调处理")
+        return
+    complete_bfl_task(job, outcome, detail)
+
+def complete_bfl_task(job, outcome, detail):
+    """
+    BFL任务结束后的处理（轮询或完成回调，调用方已领取结果处理）
+    READY时下载并保存生成图片，其余情况标记为失败
+    """
+    image_id = job['image_id']
+    is_memory_photo = job['kind'] == JOB_KIND_MEMORY_PHOTO
+    label = f"记忆照片 {job['photo_index']}" if is_memory_photo else f"图片 {image_id}"
+    error = None
+    try:
+        if outcome == POLL_READY:
+            logger.info(f"✅ {label} 生成完成: {detail}")
+            if not save_generated_image(image_id, detail):
+                update_image_status(image_id, 'failed')
+                error = 'save failed'
+        elif outcome == POLL_TIMEOUT:
+            logger.error(f"⏰ {label} 轮询超时，任务 {job['bfl_task_id']} 未完成")
+            update_image_status(image_id, 'failed')
+            error = 'timeout'
+        else:
+            logger.error(f"❌ {label} BFL任务失败: {detail}")
+            update_image_status(image_id, 'failed')
+            error = detail
+    finally:
+        generation_jobs.finish(job['id'], error=error)
+
+def track_bfl_task(job):
+    """把已提交的任务交给轮询调度器，开启完成回调时只按慢速间隔兜底丢失的回调"""
+    # 剩余时间按提交时记录的截止时间计算，进程重启或任务被重新领取不会重新开始计时
+    remaining = generation_jobs.remaining_poll_seconds(job)
+    interval = generation_jobs.poll_interval
+    min_interval = max_interval = None
+    if webhooks_enabled():
+        interval = min_interval = max_interval = WEBHOOK_CONFIG['safety_poll_interval']
+    bfl_poller.track(PollTask(
+        key=job['id'],
+        polling_url=job['polling_url'],
+        context=job,
+        on_done=finish_bfl_task,
+        headers={'x-key': BFL_API_KEY},
+        timeout=remaining,
+        interval=interval,
+        min_interval=min_interval,
+        max_interval=max_interval
+    ))
+
+def run_generation_job(job):
+    """执行生成任务：未提交的先提交给BFL，已提交的交给轮询调度器"""
+    image_id = job['image_id']
+    
+    if not job['polling_url']:
+        # BFL熔断时不读取输入、不等待令牌，任务直接留在队列里
+        if bfl_breaker.is_open():
+            defer_generation_job(job, bfl_breaker.retry_after())
+            return
+        # 所有工作线程共享向BFL提交的速率，批量上传时不会同时打满BFL
+        bfl_submit_limiter.acquire()
+        try:
+            if job['kind'] == JOB_KIND_MEMORY_PHOTO:
+                submitted = stylize_memory_photo(image_id, job['photo_index'], job_id=job['id'])
+            else:
+                submitted = generate_new_image(image_id, job_id=job['id'])
+        except ProviderBusyError as e:
+            defer_generation_job(job, e.retry_after)
+            return
+        # ProviderOverloadedError交给调度器计入错误次数，稍后重试，多次失败后放弃
+        if not submitted:
+            generation_jobs.finish(job['id'])
+            return
+        task_id, polling_url = submitted
+        if not generation_jobs.mark_submitted(job['id'], task_id, polling_url, keep_lease=True):
+            # 回调比提交返回得还快，结果已由回调处理，不再轮询
+            logger.info(f"📨 生成任务 {job['id']} 的结果已由回调领取，不再轮询")
+            return
+        job = dict(job, bfl_task_id=task_id, polling_url=polling_url)
+    
+    track_bfl_task(job)
+
+@api.route('/webhooks/bfl/<int:job_id>', methods=['POST'])
+def bfl_webhook(job_id):
+    """
+    BFL任务完成回调：校验签名后下载保存生成图片
+    重复的回调和已被轮询处理的任务直接返回200，BFL不会重发
+    """
+    body = request.get_data(cache=False)
+    if not verify_signature(body, request.headers.get(WEBHOOK_CONFIG['signature_header'])):
+        count_webhook('rejected')
+        logger.warning(f"⚠️ 生成任务 {job_id} 的回调签名无效")
+        return jsonify({'error': '签名无效'}), 401
+    count_webhook('received')
+    
+    try:
+        payload = json.loads(body)
+    except ValueError:
+        return jsonify({'error': '回调内容不是JSON'}), 400
+    task_id, outcome, detail = parse_completion(payload)
+    if outcome not in (POLL_READY, POLL_FAILED):
+        # 进度通知，等待结束时的回调
+        count_webhook('ignored')
+        return jsonify({'status': 'ignored', 'detail': detail}), 202
+    
+    try:
+        job = generation_jobs.claim_completion(job_id, task_id)
+    except RuntimeError as e:
+        # 返回5xx让BFL重发，兜底轮询也会继续
+        return jsonify({'error': str(e)}), 503
+    if job is None:
+        count_webhook('duplicates')
+        return jsonify({'status': 'duplicate'})
+    if task_id and job['bfl_task_id'] != task_id:
+        # 不属于这个任务的回调，放回给轮询处理
+        generation_jobs.reschedule(job_id)
+        logger.warning(f"⚠️ 生成任务 {job_id} 收到其他BFL任务 {task_id} 的回调")
+        return jsonify({'error': '任务ID不匹配'}), 409
+    
+    # 本进程不再需要轮询这个任务
+    bfl_poller.untrack(job_id)
+    logger.info(f"📨 收到生成任务 {job_id} 的完成回调: {outcome}")
+    complete_bfl_task(job, outcome, detail)
+    count_webhook('completed')
+    return jsonify({'status': outcome})
+
+def defer_generation_job(job, delay):
+    """BFL暂不可用，任务没有提交，延后再试（不计入错误次数）"""
+    logger.info(f"⏸️ BFL暂不可用，生成任务 {job['id']} {delay:.0f}秒后再提交")
+    generation_jobs.defer(job['id'], delay)
+
+def give_up_generation_job(job):
+    """任务多次异常后放弃"""
+    update_image_status(job['image_id'], 'failed')
 
 def update_image_status(image_id, status):
     """更新图片状态"""
@@ -803,45 +1057,139 @@ def update_image_status(image_id, status):
         if conn:
             cursor = conn.cursor()
             cursor.execute("UPDATE images SET status = %s WHERE id = %s", (status, image_id))
+            notify_status(cursor, image_id, status)
             conn.commit()
             cursor.close()
             conn.close()
+            status_broker.publish(image_id, status)
     except Exception as e:
         logger.error(f"❌ 更新状态失败: {e}")
 
-@app.route('/studio-background', methods=['GET'])
-def get_studio_background():
-    """获取照相馆背景图片（图片2）"""
+def apply_cache_headers(response, etag, last_modified=None, immutable=True):
+    """设置ETag、Last-Modified和Cache-Control"""
+    response.set_etag(etag)
+    if last_modified:
+        response.last_modified = last_modified
+    response.headers['Cache-Control'] = cache_control(immutable)
+    return response
+
+def send_stored_image(blob_key, legacy_data=None, last_modified=None, immutable=True, content_type=None):
+    """
+    发送blob存储中的图片，尚未迁移的旧数据直接发送BYTEA内容
+    强ETag取内容哈希，支持If-None-Match（304）和Range（206）；
+    本地存储的图片通过sendfile / X-Accel-Redirect发送，不经过Python读取；
+    S3中的图片重定向到签名地址（BLOB_REDIRECT_TTL）或按块流式转发，不整个读进内存
+    """
+    etag = content_etag(blob_key, legacy_data)
+    
+    # 客户端缓存仍然有效时不需要打开文件
+    if request.if_none_match.contains(etag):
+        return apply_cache_headers(current_app.response_class(status=304), etag, last_modified, immutable)
+    
+    store = get_blob_store()
+    path = store.local_path(blob_key) if blob_key else None
+    
+    if path and BLOB_CONFIG['accel_redirect_prefix']:
+        # 由nginx的internal location发送文件（nginx自己处理Range）
+        response = current_app.response_class(mimetype=content_type or 'image/jpeg')
+        response.headers['X-Accel-Redirect'] = BLOB_CONFIG['accel_redirect_prefix'] + store.relative_path(blob_key)
+        return apply_cache_headers(response, etag, last_modified, immutable)
+    
+    download_url = store.download_url(blob_key) if blob_key and not path else None
+    if download_url:
+        # 签名地址会过期，重定向本身只短时间缓存
+        response = redirect(download_url, 302)
+        response.cache_control.private = True
+        response.cache_control.max_age = BLOB_CONFIG['redirect_ttl'] // 2
+        return response
+    
+    if path:
+        source = path
+    elif blob_key:
+        # 长度未知，不处理Range，按块读取并发送完整内容
+        source = store.open(blob_key)
+    else:
+        source = io.BytesIO(legacy_data)
+    
+    response = send_file(
+        source,
+        mimetype=content_type or 'image/jpeg',
+        conditional=False,
+        etag=False
+    )
+    apply_cache_headers(response, etag, last_modified, immutable)
+    # 处理If-Modified-Since、Range和If-Range
+    return response.make_conditional(request, accept_ranges=True, complete_length=response.content_length)
+
+def send_cached_image(image, immutable=True):
+    """发送进程内缓存的图片，ETag已预先计算"""
+    if request.if_none_match.contains(image.etag):
+        return apply_cache_headers(current_app.response_class(status=304), image.etag, image.last_modified, immutable)
+    
+    response = send_file(
+        io.BytesIO(image.data),
+        mimetype=image.content_type,
+        conditional=False,
+        etag=False
+    )
+    apply_cache_headers(response, image.etag, image.last_modified, immutable)
+    return response.make_conditional(request, accept_ranges=True, complete_length=image.size)
+
+def load_studio_background():
+    """从数据库和存储读取当前照相馆背景（缓存未命中时调用）"""
+    conn = get_db_connection()
+    if not conn:
+        raise RuntimeError('数据库连接失败')
     try:
-        conn = get_db_connection()
-        if not conn:
-            return jsonify({'error': '数据库连接失败'}), 500
-        
         cursor = conn.cursor()
-        # 从数据库获取照相馆背景图片
-        cursor.execute("SELECT image_data FROM studio_backgrounds WHERE is_active = true LIMIT 1")
+        cursor.execute(ACTIVE_STUDIO_BACKGROUND_SQL)
         result = cursor.fetchone()
         cursor.close()
+    finally:
         conn.close()
+    return studio_background_entry(result, get_blob_store().get)
+
+def active_studio_background(width=None):
+    """从缓存读取当前照相馆背景（跨进程的缓存失效依赖数据库通知）"""
+    pg_listener.start()
+    return studio_background_cache.get(width)
+
+@api.route('/studio-background', methods=['GET'])
+def get_studio_background():
+    """获取照相馆背景图片（图片2），可用width参数获取缩小版本"""
+    try:
+        width = request.args.get('width', type=int)
+        if width is not None and width not in studio_background_cache.widths:
+            return jsonify({
+                'error': f'不支持的宽度，可选: {sorted(studio_background_cache.widths)}'
+            }), 400
         
-        if not result or not result[0]:
+        image = active_studio_background(width)
+        if image is None:
             # 如果数据库中没有背景图片，返回错误
             return jsonify({'error': '照相馆背景图片不存在，请先上传'}), 404
         
-        return send_file(
-            io.BytesIO(result[0]),
-            mimetype='image/jpeg'
-        )
+        # 背景图片可能被替换，不能标记为immutable
+        return send_cached_image(image, immutable=False)
         
     except Exception as e:
         logger.error(f"❌ 获取照相馆背景失败: {e}")
         return jsonify({'error': f'获取照相馆背景失败: {str(e)}'}), 500
 
-@app.route('/image/<int:image_id>', methods=['GET'])
+@api.route('/image/<int:image_id>', methods=['GET'])
 def get_image(image_id):
-    """获取图片"""
+    """获取图片，生成图片可以用 ?size=thumb|medium|full 和 ?format=webp|avif|jpeg 选择版本"""
     try:
         image_type = request.args.get('type', 'generated')
+        size = request.args.get('size', 'full')
+        if size not in RENDITION_SIZES:
+            return jsonify({'error': f'不支持的尺寸，可选: {list(RENDITION_SIZES)}'}), 400
+        
+        # 没有指定format时按Accept头选择，响应需要带 Vary: Accept
+        requested_format = request.args.get('format')
+        output_format = negotiate_format(requested_format, request.accept_mimetypes)
+        if output_format is None:
+            return jsonify({'error': f'不支持的格式，可选: {list(RENDITION_FORMATS)}'}), 400
         
         conn = get_db_connection()
         if not conn:
@@ -849,56 +1197,150 @@ def get_image(image_id):
         
         cursor = conn.cursor()
         
-        if image_type == 'original':
-            cursor.execute("SELECT original_image FROM images WHERE id = %s", (image_id,))
-        else:
-            cursor.execute("SELECT generated_image FROM images WHERE id = %s", (image_id,))
+        if image_type != 'original' and (size != 'full' or output_format != 'jpeg'):
+            rendition = find_rendition(cursor, image_id, size, output_format)
+            if rendition:
+                cursor.close()
+                conn.close()
+                response = send_stored_image(rendition[0], last_modified=rendition[2], content_type=rendition[1])
+                if not requested_format:
+                    response.vary.add('Accept')
+                return response
+            # 旧图片没有生成过版本，返回原图
+        
+        # 只读取key，尚未迁移的旧数据才读取BYTEA
+        cursor.execute(IMAGE_CONTENT_QUERIES['original' if image_type == 'original' else 'generated'], (image_id,))
         
         result = cursor.fetchone()
         cursor.close()
         conn.close()
         
-        if not result or not result[0]:
+        if not result or not (result[0] or result[1]):
             return jsonify({'error': '图片不存在'}), 404
         
-        return send_file(
-            io.BytesIO(result[0]),
-            mimetype='image/jpeg'
-        )
+        # 图片一旦生成就不会再变化，可以长期缓存
+        response = send_stored_image(result[0], result[1], last_modified=result[2], content_type=result[3])
+        if image_type != 'original' and not requested_format:
+            response.vary.add('Accept')
+        return response
         
     except Exception as e:
         logger.error(f"❌ 获取图片失败: {e}")
         return jsonify({'error': f'获取图片失败: {str(e)}'}), 500
 
-@app.route('/status/<int:image_id>', methods=['GET'])
-def get_status(image_id):
-    """获取图片处理状态"""
+@api.route('/blob/<key>', methods=['GET'])
+def get_signed_blob(key):
+    """
+    短期签名的输入图片地址（BFL_INPUT_DELIVERY=signed且使用本地存储时交给生成服务）
+    签名和有效期由 input_delivery.signed_blob_url 生成
+    """
+    if not verify_blob_signature(key, request.args.get('expires'), request.args.get('sig')):
+        return jsonify({'error': '链接无效或已过期'}), 403
     try:
         conn = get_db_connection()
         if not conn:
             return jsonify({'error': '数据库连接失败'}), 500
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT content_type, created_at FROM blobs WHERE key = %s", (key,))
+            row = cursor.fetchone()
+            cursor.close()
+        finally:
+            conn.close()
+        if not row:
+            return jsonify({'error': '图片不存在'}), 404
+        return send_stored_image(key, last_modified=row[1], content_type=row[0])
         
-        cursor = conn.cursor(cursor_factory=RealDictCursor)
-        cursor.execute(
-            "SELECT status, (generated_image IS NOT NULL) as has_generated_image FROM images WHERE id = %s",
-            (image_id,)
-        )
-        
-        result = cursor.fetchone()
+    except Exception as e:
+        logger.error(f"❌ 获取签名图片失败: {e}")
+        return jsonify({'error': f'获取签名图片失败: {str(e)}'}), 500
+
+def load_image_statuses(image_ids):
+    """
+    一次查询读取多张图片的状态，返回 {图片ID: 状态内容}，不存在的图片不在结果中
+    只读取status和是否已生成，不读取图片内容
+    """
+    conn = get_db_connection()
+    if not conn:
+        raise RuntimeError('数据库连接失败')
+    try:
+        cursor = conn.cursor()
+        cursor.execute(STATUS_QUERY, (list(image_ids),))
+        rows = cursor.fetchall()
         cursor.close()
+    finally:
         conn.close()
+    
+    return status_rows_data(rows)
+
+def load_image_status(image_id):
+    """读取图片状态，图片不存在时返回None"""
+    return load_image_statuses([image_id]).get(image_id)
+
+@api.route('/status', methods=['GET'])
+@api.route('/status/batch', methods=['POST'])
+def get_status_batch():
+    """
+    批量查询状态：GET /status?ids=1,2,3 或 POST /status/batch {"ids": [1, 2, 3]}
+    记忆照片等多张图片的流程一次请求、一次查询拿到所有状态
+    """
+    try:
+        if request.method == 'POST':
+            body = request.get_json(silent=True) or {}
+            raw_ids = body.get('ids', [])
+        else:
+            raw_ids = request.args.get('ids', '')
+        try:
+            image_ids = parse_image_ids(raw_ids)
+        except (TypeError, ValueError) as e:
+            return jsonify({'error': f'参数错误: {e}'}), 400
+        if not image_ids:
+            return jsonify({'error': '缺少ids参数'}), 400
         
-        if not result:
-            return jsonify({'error': '图片不存在'}), 404
-        
-        response_data = {
-            'status': result['status'],
-            'has_generated_image': result['has_generated_image']
-        }
+        statuses = load_image_statuses(image_ids)
+        return jsonify({
+            'statuses': {str(image_id): statuses[image_id] for image_id in image_ids if image_id in statuses},
+            'missing': [image_id for image_id in image_ids if image_id not in statuses]
+        })
         
-        if result['status'] == 'completed' and result['has_generated_image']:
-            base_url = os.getenv('PUBLIC_URL', 'https://petecho.zeabur.app')
-            response_data['generated_image_url'] = f"{base_url}/image/{image_id}?type=generated"
+    except Exception as e:
+        logger.error(f"❌ 批量获取状态失败: {e}")
+        return jsonify({'error': f'批量获取状态失败: {str(e)}'}), 500
+
+@api.route('/status/<int:image_id>', methods=['GET'])
+def get_status(image_id):
+    """
+    获取图片处理状态
+    带 ?wait=秒数 时为长轮询：状态未完成时等到状态变化或超时再返回
+    """
+    try:
+        wait = min(max(request.args.get('wait', 0, type=float), 0), STATUS_STREAM_CONFIG['long_poll_max'])
+        if not wait:
+            response_data = load_image_status(image_id)
+            if response_data is None:
+                return jsonify({'error': '图片不存在'}), 404
+            return jsonify(response_data)
+        
+        # 先订阅再读取，读取之后发生的变化会进入队列
+        pg_listener.start()
+        with status_broker.subscription(image_id) as events:
+            response_data = load_image_status(image_id)
+            if response_data is None:
+                return jsonify({'error': '图片不存在'}), 404
+            
+            deadline = time.monotonic() + wait
+            initial_status = response_data['status']
+            while initial_status not in TERMINAL_STATUSES:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    events.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                response_data = load_image_status(image_id) or response_data
+                if response_data['status'] != initial_status:
+                    break
         
         return jsonify(response_data)
         
@@ -906,13 +1348,115 @@ def get_status(image_id):
         logger.error(f"❌ 获取状态失败: {e}")
         return jsonify({'error': f'获取状态失败: {str(e)}'}), 500
 
-# 初始化数据库
-if init_database():
-    logger.info("✅ 应用初始化成功")
-else:
-    logger.warning("⚠️ 数据库初始化失败，但应用继续启动")
+@api.route('/status/<int:image_id>/events', methods=['GET'])
+def stream_status(image_id):
+    """
+    以Server-Sent Events推送图片状态
+    连接后先发送当前状态，之后每次状态变化推送一次，完成或失败后关闭连接
+    """
+    # 先订阅再读取当前状态，读取期间发生的变化不会丢失
+    pg_listener.start()
+    events = status_broker.subscribe(image_id)
+    try:
+        current = load_image_status(image_id)
+    except Exception as e:
+        status_broker.unsubscribe(image_id, events)
+        logger.error(f"❌ 获取状态失败: {e}")
+        return jsonify({'error': f'获取状态失败: {str(e)}'}), 500
+    if current is None:
+        status_broker.unsubscribe(image_id, events)
+        return jsonify({'error': '图片不存在'}), 404
+    
+    def generate():
+        try:
+            last = current
+            yield f"retry: {STATUS_STREAM_CONFIG['retry_ms']}\n\n"
+            yield sse_event('status', last)
+            deadline = time.monotonic() + STATUS_STREAM_CONFIG['max_duration']
+            while last['status'] not in TERMINAL_STATUSES and time.monotonic() < deadline:
+                try:
+                    events.get(timeout=STATUS_STREAM_CONFIG['heartbeat_interval'])
+                except queue.Empty:
+                    # 注释行作为心跳，防止代理断开空闲连接
+                    yield ": keep-alive\n\n"
+                    continue
+                latest = load_image_status(image_id)
+                if latest and latest != last:
+                    last = latest
+                    yield sse_event('status', last)
+        finally:
+            status_broker.unsubscribe(image_id, events)
+    
+    return Response(generate(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
+# 照相馆背景缓存，背景被替换时通过数据库通知在所有进程中失效
+image_cache = ByteLRUCache(IMAGE_CACHE_CONFIG['max_bytes'])
+studio_background_cache = StudioBackgroundCache(
+    image_cache, load_studio_background,
+    ttl=IMAGE_CACHE_CONFIG['studio_ttl'], widths=IMAGE_CACHE_CONFIG['studio_widths']
+)
+pg_listener = PgListener(DB_CONFIG)
+pg_listener.subscribe(STUDIO_BACKGROUND_CHANNEL, studio_background_cache.invalidate)
+# 断线期间可能错过通知，重新连上后全部失效
+pg_listener.on_reconnect(studio_background_cache.invalidate)
+# 其他进程写入的状态变化推送给本进程的SSE连接
+pg_listener.subscribe(IMAGE_STATUS_CHANNEL, status_broker.on_notification)
+
+# 生成任务队列
+generation_jobs = JobQueue(get_db_connection, **JOB_QUEUE_CONFIG)
+job_dispatcher = JobDispatcher(
+    generation_jobs, generation_executor, run_generation_job,
+    on_give_up=give_up_generation_job, interval=DISPATCH_INTERVAL
+)
+
+# 轮询调度器定期为仍在轮询的任务续租，退出时释放给其他进程
+bfl_poller.heartbeat = lambda jobs: generation_jobs.extend_leases([job['id'] for job in jobs])
+bfl_poller.on_shutdown = lambda jobs: generation_jobs.release([job['id'] for job in jobs])
+
+def ensure_background_services():
+    """
+    在第一个请求时启动任务调度（继续处理重启前未完成的任务）
+    start()会检查进程号，预加载后fork出的worker进程各自启动调度线程
+    """
+    job_dispatcher.start()
+
+def stop_background_services():
+    """进程退出前停止调度和轮询，轮询中的任务释放给其他进程，排队的任务等租约到期后被接手"""
+    job_dispatcher.stop()
+    bfl_poller.stop()
+    generation_executor.shutdown()
+
+def create_app():
+    """
+    应用工厂：只注册路由和配置，不连接数据库、不发起HTTP请求
+    连接池、规范化进程池、通知监听和任务调度都在第一次使用时创建，
+    数据库不可达时进程也能在毫秒级启动；表结构由 python migrations.py 在部署时创建和升级
+    """
+    flask_app = Flask(__name__)
+    flask_app.request_class = IngestRequest
+    CORS(flask_app)
+    
+    # 上传请求大小上限，超出时在读取请求体之前直接拒绝
+    flask_app.config['MAX_CONTENT_LENGTH'] = UPLOAD_CONFIG['max_request_bytes']
+    flask_app.config['USE_X_SENDFILE'] = USE_X_SENDFILE
+    
+    flask_app.register_blueprint(api)
+    if JOB_DISPATCHER_ENABLED:
+        flask_app.before_request(ensure_background_services)
+        # gunicorn配置在worker启动和退出时调用（见gunicorn.conf.py）
+        flask_app.extensions['background_services'] = (ensure_background_services, stop_background_services)
+    
+    logger.info(f"🚀 Petechoes应用已创建（数据库 {DB_CONFIG['host']}:{DB_CONFIG['port']}，"
+                f"BFL API Key {'已设置' if BFL_API_KEY else '未设置'}）")
+    return flask_app
+
+app = create_app()
 
 if __name__ == '__main__':
+    # 开发服务器，生产环境使用 gunicorn -c gunicorn.conf.py app:app
     port = int(os.getenv('PORT', 8080))
     logger.info(f"🚀 启动完整服务器在端口 {port}")
     app.run(host='0.0.0.0', port=port, debug=False) 
\ No newline at end of file
@@ -0,0 +1,652 @@
+#!/usr/bin/env python3
+"""
+Petechoes异步应用（aiohttp + asyncpg）
+和app.py提供相同的上传、状态和图片接口，请求、响应格式不变，iOS客户端不需要修改；
+等待数据库和存储时不占用线程，一个进程可以同时保持数千个状态查询、长轮询和图片下载连接：
+    python async_app.py
+    gunicorn -c gunicorn.conf.py -k aiohttp.GunicornWebWorker async_app:app
+
+上传只负责保存图片并写入generation_jobs，生成由 worker.py（或开启任务调度的app.py进程）领取执行；
+背景上传、批量上传和测试接口仍由app.py提供
+"""
+
+import os
+import asyncio
+import logging
+
+from aiohttp import web
+from werkzeug.datastructures import MIMEAccept
+from werkzeug.exceptions import RequestEntityTooLarge
+from werkzeug.http import parse_accept_header
+
+from config import DB_CONFIG
+from async_db import AsyncDatabase, AsyncPgListener, ASYNC_POOL_CONFIG, asyncpg_query
+from blob_store import (
+    get_blob_store, content_etag, cache_control, BLOB_CONFIG, CHUNK_SIZE, RECORD_BLOB_SQL
+)
+from generation_executor import EXECUTOR_CONFIG
+from generation_presets import preset_dedup_key
+from job_queue import JOB_KIND_STUDIO, JOB_KIND_MEMORY_PHOTO
+from image_cache import (
+    ByteLRUCache, AsyncStudioBackgroundCache, studio_background_entry,
+    IMAGE_CACHE_CONFIG, STUDIO_BACKGROUND_CHANNEL, ACTIVE_STUDIO_BACKGROUND_SQL
+)
+from image_processing import image_normalizer, InvalidImageError
+from upload_ingest import IngestSpool, UPLOAD_CONFIG, UPLOAD_REJECTIONS, upload_rejection_message
+from status_events import (
+    AsyncStatusBroker, status_rows_data, parse_image_ids, sse_event,
+    IMAGE_STATUS_CHANNEL, STATUS_STREAM_CONFIG, TERMINAL_STATUSES
+)
+from images_schema import STATUS_QUERY, INSERT_IMAGE_SQL, IMAGE_CONTENT_QUERIES
+from dedup import (
+    DEDUP_ENABLED, DEDUP_LOCK_SQL, FIND_DUPLICATE_SQL, duplicate_generation, duplicate_generation_data
+)
+from renditions import negotiate_format, FIND_RENDITION_SQL, RENDITION_SIZES, RENDITION_FORMATS
+from migrations import describe_schema
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# 就绪检查等待连接池的最长时间（秒）
+READINESS_TIMEOUT = float(os.getenv('READINESS_TIMEOUT', '3'))
+
+# 尚未提交给BFL的任务超过这个数量时拒绝新的生成（429），由worker进程消化积压
+GENERATION_MAX_BACKLOG = int(os.getenv('GENERATION_MAX_BACKLOG', '64'))
+
+db = AsyncDatabase(DB_CONFIG, **ASYNC_POOL_CONFIG)
+status_broker = AsyncStatusBroker()
+
+
+class GenerationBusyError(Exception):
+    """积压的生成任务过多"""
+
+
+def json_error(message, status):
+    return web.json_response({'error': message}, status=status)
+
+
+def generation_busy_response(retry_after):
+    """生成任务积压时返回429和重试提示"""
+    return web.json_response(
+        {'error': '生成任务繁忙，请稍后重试', 'retry_after': retry_after},
+        status=429, headers={'Retry-After': str(retry_after)}
+    )
+
+
+async def run_blocking(fn, *args):
+    """在线程池中执行阻塞调用（图片规范化、blob存储读写）"""
+    return await asyncio.get_running_loop().run_in_executor(None, fn, *args)
+
+
+async def record_blob(conn, blob):
+    """在调用方的事务中登记blob元数据（同blob_store.record_blob）"""
+    await conn.execute(asyncpg_query(RECORD_BLOB_SQL), blob.key, blob.size, blob.content_type)
+
+
+async def find_duplicate_generation(conn, dedup_key):
+    """同dedup.find_duplicate_generation：持有去重键的事务级advisory锁，返回 (image_id, status) 或None"""
+    if not DEDUP_ENABLED:
+        return None
+    await conn.execute(asyncpg_query(DEDUP_LOCK_SQL), dedup_key)
+    return duplicate_generation(await conn.fetchrow(asyncpg_query(FIND_DUPLICATE_SQL), dedup_key))
+
+
+async def load_studio_background():
+    """从数据库和存储读取当前照相馆背景（缓存未命中时调用）"""
+    async with db.connection() as conn:
+        row = await conn.fetchrow(asyncpg_query(ACTIVE_STUDIO_BACKGROUND_SQL))
+    # 读取存储会阻塞，整个转换放到线程池中
+    return await run_blocking(studio_background_entry, row, get_blob_store().get)
+
+
+# 照相馆背景缓存，背景被替换时通过数据库通知失效
+image_cache = ByteLRUCache(IMAGE_CACHE_CONFIG['max_bytes'])
+studio_background_cache = AsyncStudioBackgroundCache(
+    image_cache, load_studio_background,
+    ttl=IMAGE_CACHE_CONFIG['studio_ttl'], widths=IMAGE_CACHE_CONFIG['studio_widths']
+)
+pg_listener = AsyncPgListener(DB_CONFIG)
+pg_listener.subscribe(STUDIO_BACKGROUND_CHANNEL, studio_background_cache.invalidate)
+pg_listener.on_reconnect(studio_background_cache.invalidate)
+pg_listener.subscribe(IMAGE_STATUS_CHANNEL, status_broker.on_notification)
+
+
+async def active_studio_background(width=None):
+    pg_listener.start()
+    return await studio_background_cache.get(width)
+
+
+async def generation_dedup_key_for(kind, input_key):
+    """按当前提示词和参数计算去重键，照相馆照片还取决于当前背景"""
+    background_key = None
+    if kind == JOB_KIND_STUDIO:
+        background = await active_studio_background()
+        background_key = background.etag if background else None
+    return preset_dedup_key(kind, input_key, background_key)
+
+
+async def read_upload(request):
+    """
+    流式读取multipart请求：第一个image文件分块写入IngestSpool（校验文件头和大小），其余字段按文本读取
+    返回 (spool, 表单字段, 是否有文件名为空的image字段)；被拒绝时抛出UPLOAD_REJECTIONS中的异常
+    """
+    if request.content_length and request.content_length > UPLOAD_CONFIG['max_request_bytes']:
+        raise RequestEntityTooLarge()
+    if not request.content_type.startswith('multipart/'):
+        return None, {}, False
+
+    spool, fields, empty, received = None, {}, False, 0
+    reader = await request.multipart()
+    try:
+        async for part in reader:
+            if part.filename is None:
+                fields.setdefault(part.name, await part.text())
+                continue
+            if part.name != 'image' or spool is not None or not part.filename:
+                empty = empty or (part.name == 'image' and not part.filename)
+                await part.release()
+                continue
+            spool = IngestSpool(UPLOAD_CONFIG['max_file_bytes'], UPLOAD_CONFIG['tmp_dir'])
+            while True:
+                chunk = await part.read_chunk(CHUNK_SIZE)
+                if not chunk:
+                    break
+                received += len(chunk)
+                if received > UPLOAD_CONFIG['max_request_bytes']:
+                    raise RequestEntityTooLarge()
+                spool.write(chunk)
+            # 不足HEADER_SIZE字节的文件在这里校验文件头
+            spool.seek(0)
+    except BaseException:
+        if spool is not None:
+            spool.close()
+        raise
+    if spool is not None:
+        spool.flush()
+    return spool, fields, empty
+
+
+async def save_generation_upload(normalized, kind, photo_index=None):
+    """
+    写入blob存储并在一个事务中登记图片和生成任务，返回 (image_id, 复用的生成)
+    任务不带租约，由各进程的任务调度领取
+    """
+    blob = await run_blocking(get_blob_store().put, normalized.data, normalized.content_type)
+    dedup_key = await generation_dedup_key_for(kind, blob.key)
+
+    async with db.connection() as conn:
+        async with conn.transaction():
+            await record_blob(conn, blob)
+            # 相同的生成已完成或正在进行时直接复用，不再调用BFL
+            duplicate = await find_duplicate_generation(conn, dedup_key)
+            if duplicate:
+                return None, duplicate
+
+            backlog = await conn.fetchval("SELECT count(*) FROM generation_jobs WHERE state = 'queued'")
+            if backlog >= GENERATION_MAX_BACKLOG:
+                raise GenerationBusyError()
+
+            image_id = await conn.fetchval(
+                asyncpg_query(INSERT_IMAGE_SQL), blob.key, 'processing', dedup_key
+            )
+            await conn.execute(
+                "INSERT INTO generation_jobs (image_id, kind, photo_index) VALUES ($1, $2, $3)",
+                image_id, kind, photo_index
+            )
+    return image_id, None
+
+
+async def handle_generation_upload(request, kind, label, success_message):
+    """/upload 和 /upload-memory-photo 的公共流程"""
+    spool = None
+    try:
+        spool, fields, empty = await read_upload(request)
+        if spool is None:
+            return json_error('没有选择文件' if empty else '没有找到图片文件', 400)
+
+        photo_index = None
+        if kind == JOB_KIND_MEMORY_PHOTO:
+            try:
+                photo_index = int(fields.get('photo_index', '0'))
+            except ValueError:
+                return json_error('photo_index必须是整数', 400)
+        logger.info(f"📸 收到{label}上传，大小: {spool.size} bytes，SHA-256: {spool.sha256[:12]}")
+
+        # 校验并规范化图片（EXIF旋转、缩小、去掉元数据、重新编码）
+        normalized = await run_blocking(image_normalizer.normalize, spool.name)
+
+        image_id, duplicate = await save_generation_upload(normalized, kind, photo_index)
+        if duplicate:
+            return web.json_response(duplicate_generation_data(duplicate, normalized))
+
+        logger.info(f"✅ {label}保存成功，ID: {image_id}")
+        return web.json_response({
+            'success': True,
+            'image_id': image_id,
+            'message': success_message,
+            'normalization': normalized.summary()
+        })
+
+    except UPLOAD_REJECTIONS as e:
+        return json_error(upload_rejection_message(e), e.code)
+    except InvalidImageError as e:
+        return json_error(str(e), 400)
+    except GenerationBusyError:
+        return generation_busy_response(EXECUTOR_CONFIG['retry_after'])
+    except Exception as e:
+        logger.error(f"❌ {label}上传失败: {e}")
+        return json_error(f'{label}上传失败: {str(e)}', 500)
+    finally:
+        if spool is not None:
+            spool.close()
+
+
+async def upload_image(request):
+    """上传图片并触发AI生成"""
+    return await handle_generation_upload(request, JOB_KIND_STUDIO, '图片', '图片上传成功，正在生成新图片...')
+
+
+async def upload_memory_photo(request):
+    """上传记忆照片并进行AI风格化处理"""
+    return await handle_generation_upload(
+        request, JOB_KIND_MEMORY_PHOTO, '记忆照片', '记忆照片上传成功，正在进行风格化处理...'
+    )
+
+
+async def health_check(request):
+    """健康检查接口"""
+    return web.json_response({
+        'status': 'healthy',
+        'message': 'Petechoes后端服务器运行正常',
+        'version': '2.0.0'
+    })
+
+
+async def readiness_check(request):
+    """就绪检查：数据库可以连接且表结构已迁移到最新版本时返回200，否则返回503"""
+    async def applied_versions():
+        async with db.connection(timeout=READINESS_TIMEOUT) as conn:
+            if not await conn.fetchval("SELECT to_regclass('schema_migrations') IS NOT NULL"):
+                return set()
+            return {row['version'] for row in await conn.fetch("SELECT version FROM schema_migrations")}
+
+    try:
+        done = await asyncio.wait_for(applied_versions(), READINESS_TIMEOUT)
+    except Exception as e:
+        return web.json_response({'status': 'unavailable', 'reason': f'数据库连接失败: {e!r}'}, status=503)
+    ready, details = describe_schema(done)
+    if not ready:
+        return web.json_response(dict(details, status='unavailable', reason='数据库表结构需要迁移'), status=503)
+    return web.json_response(dict(details, status='ready'))
+
+
+async def metrics(request):
+    """运行指标"""
+    return web.json_response({
+        'db_pool': db.stats(),
+        'image_cache': image_cache.stats(),
+        'pg_listener': pg_listener.stats(),
+        'image_normalizer': image_normalizer.stats(),
+        'status_stream': status_broker.stats()
+    })
+
+
+def apply_cache_headers(response, etag, last_modified=None, immutable=True):
+    """设置ETag、Last-Modified和Cache-Control"""
+    response.etag = etag
+    if last_modified:
+        response.last_modified = last_modified
+    response.headers['Cache-Control'] = cache_control(immutable)
+    return response
+
+
+def not_modified(request, etag):
+    """客户端缓存的版本仍然有效（If-None-Match）"""
+    return any(tag.value in (etag, '*') for tag in request.if_none_match or ())
+
+
+class StoredFileResponse(web.FileResponse):
+    """
+    本地blob文件的响应：FileResponse用sendfile发送并处理Range / If-Modified-Since，
+    ETag和Last-Modified保持调用方的值（内容哈希、blob创建时间，和app.py一致），不使用文件的mtime和大小
+    """
+
+    def __init__(self, path, etag, last_modified=None, **kwargs):
+        self._content_etag = etag
+        self._content_last_modified = last_modified
+        super().__init__(path, chunk_size=CHUNK_SIZE, **kwargs)
+
+    @property
+    def etag(self):
+        return web.StreamResponse.etag.fget(self)
+
+    @etag.setter
+    def etag(self, value):
+        web.StreamResponse.etag.fset(self, self._content_etag)
+
+    @property
+    def last_modified(self):
+        return web.StreamResponse.last_modified.fget(self)
+
+    @last_modified.setter
+    def last_modified(self, value):
+        web.StreamResponse.last_modified.fset(self, self._content_last_modified or value)
+
+
+def bytes_response(request, data, content_type, etag):
+    """发送内存中的图片内容，支持单个Range（206）和If-Range"""
+    if_range = request.headers.get('If-Range')
+    if if_range is None or if_range.strip('"') == etag:
+        try:
+            requested = request.http_range
+        except ValueError:
+            # 无法解析的Range按规范忽略，返回完整内容
+            requested = slice(None)
+        if requested.start is not None or requested.stop is not None:
+            start, stop, _ = requested.indices(len(data))
+            if start >= stop:
+                return web.Response(status=416, headers={'Content-Range': f'bytes */{len(data)}'})
+            return web.Response(
+                status=206, body=data[start:stop], content_type=content_type,
+                headers={'Accept-Ranges': 'bytes', 'Content-Range': f'bytes {start}-{stop - 1}/{len(data)}'}
+            )
+    return web.Response(body=data, content_type=content_type, headers={'Accept-Ranges': 'bytes'})
+
+
+async def send_stored_image(request, blob_key, legacy_data=None, last_modified=None, immutable=True,
+                            content_type=None, headers=None):
+    """
+    发送blob存储中的图片，尚未迁移的旧数据直接发送BYTEA内容
+    强ETag取内容哈希；本地存储的图片用sendfile发送（支持Range），配置了X-Accel-Redirect时交给nginx发送；
+    S3开启BLOB_REDIRECT_TTL时重定向到签名地址，否则按块流式转发，不把整个对象读进内存
+    S3流式转发时响应在这里就已发出，额外的响应头（例如Vary）通过headers传入
+    """
+    etag = content_etag(blob_key, legacy_data)
+    content_type = content_type or 'image/jpeg'
+
+    headers = dict(headers or {})
+
+    if not_modified(request, etag):
+        return apply_cache_headers(web.Response(status=304, headers=headers), etag, last_modified, immutable)
+
+    if not blob_key:
+        response = bytes_response(request, bytes(legacy_data), content_type, etag)
+        response.headers.update(headers)
+        return apply_cache_headers(response, etag, last_modified, immutable)
+
+    store = get_blob_store()
+    path = store.local_path(blob_key)
+    if path and BLOB_CONFIG['accel_redirect_prefix']:
+        response = web.Response(content_type=content_type, headers=headers)
+        response.headers['X-Accel-Redirect'] = BLOB_CONFIG['accel_redirect_prefix'] + store.relative_path(blob_key)
+        return apply_cache_headers(response, etag, last_modified, immutable)
+    if path:
+        response = StoredFileResponse(path, etag, last_modified, headers=dict(headers, **{'Content-Type': content_type}))
+        return apply_cache_headers(response, etag, last_modified, immutable)
+
+    download_url = store.download_url(blob_key)
+    if download_url:
+        # 签名地址会过期，重定向本身只短时间缓存
+        return web.HTTPFound(download_url, headers=dict(
+            headers, **{'Cache-Control': f"private, max-age={BLOB_CONFIG['redirect_ttl'] // 2}"}
+        ))
+
+    # 长度未知，不处理Range，按块读取并发送完整内容
+    body = await run_blocking(store.open, blob_key)
+    try:
+        response = web.StreamResponse(headers=dict(headers, **{'Content-Type': content_type}))
+        apply_cache_headers(response, etag, last_modified, immutable)
+        await response.prepare(request)
+        while True:
+            chunk = await run_blocking(body.read, CHUNK_SIZE)
+            if not chunk:
+                break
+            await response.write(chunk)
+        await response.write_eof()
+    finally:
+        body.close()
+    return response
+
+
+def send_cached_image(request, image, immutable=True):
+    """发送进程内缓存的图片，ETag已预先计算"""
+    if not_modified(request, image.etag):
+        return apply_cache_headers(web.Response(status=304), image.etag, image.last_modified, immutable)
+    response = bytes_response(request, image.data, image.content_type, image.etag)
+    return apply_cache_headers(response, image.etag, image.last_modified, immutable)
+
+
+def query_number(request, name, convert, default=None):
+    """同Flask的 request.args.get(name, type=...)：缺少或无法转换时返回默认值"""
+    try:
+        return convert(request.query[name])
+    except (KeyError, ValueError):
+        return default
+
+
+async def get_studio_background(request):
+    """获取照相馆背景图片（图片2），可用width参数获取缩小版本"""
+    try:
+        width = query_number(request, 'width', int)
+        if width is not None and width not in studio_background_cache.widths:
+            return json_error(f'不支持的宽度，可选: {sorted(studio_background_cache.widths)}', 400)
+
+        image = await active_studio_background(width)
+        if image is None:
+            return json_error('照相馆背景图片不存在，请先上传', 404)
+
+        # 背景图片可能被替换，不能标记为immutable
+        return send_cached_image(request, image, immutable=False)
+
+    except Exception as e:
+        logger.error(f"❌ 获取照相馆背景失败: {e}")
+        return json_error(f'获取照相馆背景失败: {str(e)}', 500)
+
+
+async def get_image(request):
+    """获取图片，生成图片可以用 ?size=thumb|medium|full 和 ?format=webp|avif|jpeg 选择版本"""
+    try:
+        image_id = int(request.match_info['image_id'])
+        image_type = request.query.get('type', 'generated')
+        size = request.query.get('size', 'full')
+        if size not in RENDITION_SIZES:
+            return json_error(f'不支持的尺寸，可选: {list(RENDITION_SIZES)}', 400)
+
+        # 没有指定format时按Accept头选择，响应需要带 Vary: Accept
+        requested_format = request.query.get('format')
+        accept = parse_accept_header(request.headers.get('Accept'), MIMEAccept)
+        output_format = negotiate_format(requested_format, accept)
+        if output_format is None:
+            return json_error(f'不支持的格式，可选: {list(RENDITION_FORMATS)}', 400)
+
+        async with db.connection() as conn:
+            rendition = None
+            if image_type != 'original' and (size != 'full' or output_format != 'jpeg'):
+                rendition = await conn.fetchrow(asyncpg_query(FIND_RENDITION_SQL), image_id, size, output_format)
+            # 只读取key，尚未迁移的旧数据才读取BYTEA；旧图片没有生成过版本时返回原图
+            if rendition is None:
+                query = IMAGE_CONTENT_QUERIES['original' if image_type == 'original' else 'generated']
+                row = await conn.fetchrow(asyncpg_query(query), image_id)
+
+        headers = {'Vary': 'Accept'} if image_type != 'original' and not requested_format else None
+        if rendition is not None:
+            return await send_stored_image(
+                request, rendition[0], last_modified=rendition[2], content_type=rendition[1], headers=headers
+            )
+        if not row or not (row[0] or row[1]):
+            return json_error('图片不存在', 404)
+        # 图片一旦生成就不会再变化，可以长期缓存
+        return await send_stored_image(
+            request, row[0], row[1], last_modified=row[2], content_type=row[3], headers=headers
+        )
+
+    except Exception as e:
+        logger.error(f"❌ 获取图片失败: {e}")
+        return json_error(f'获取图片失败: {str(e)}', 500)
+
+
+async def load_image_statuses(image_ids):
+    """一次查询读取多张图片的状态，返回 {图片ID: 状态内容}，不存在的图片不在结果中"""
+    async with db.connection() as conn:
+        rows = await conn.fetch(asyncpg_query(STATUS_QUERY), list(image_ids))
+    return status_rows_data(rows)
+
+
+async def load_image_status(image_id):
+    """读取图片状态，图片不存在时返回None"""
+    return (await load_image_statuses([image_id])).get(image_id)
+
+
+async def get_status_batch(request):
+    """批量查询状态：GET /status?ids=1,2,3 或 POST /status/batch {"ids": [1, 2, 3]}"""
+    try:
+        if request.method == 'POST':
+            try:
+                body = await request.json()
+            except ValueError:
+                body = None
+            raw_ids = body.get('ids', []) if isinstance(body, dict) else []
+        else:
+            raw_ids = request.query.get('ids', '')
+        try:
+            image_ids = parse_image_ids(raw_ids)
+        except (TypeError, ValueError) as e:
+            return json_error(f'参数错误: {e}', 400)
+        if not image_ids:
+            return json_error('缺少ids参数', 400)
+
+        statuses = await load_image_statuses(image_ids)
+        return web.json_response({
+            'statuses': {str(image_id): statuses[image_id] for image_id in image_ids if image_id in statuses},
+            'missing': [image_id for image_id in image_ids if image_id not in statuses]
+        })
+
+    except Exception as e:
+        logger.error(f"❌ 批量获取状态失败: {e}")
+        return json_error(f'批量获取状态失败: {str(e)}', 500)
+
+
+async def get_status(request):
+    """
+    获取图片处理状态
+    带 ?wait=秒数 时为长轮询：等待期间只占用一个协程，不占用线程和数据库连接
+    """
+    try:
+        image_id = int(request.match_info['image_id'])
+        wait = min(max(query_number(request, 'wait', float, 0), 0), STATUS_STREAM_CONFIG['long_poll_max'])
+        if not wait:
+            response_data = await load_image_status(image_id)
+            if response_data is None:
+                return json_error('图片不存在', 404)
+            return web.json_response(response_data)
+
+        # 先订阅再读取，读取之后发生的变化会进入队列
+        pg_listener.start()
+        with status_broker.subscription(image_id) as events:
+            response_data = await load_image_status(image_id)
+            if response_data is None:
+                return json_error('图片不存在', 404)
+
+            loop = asyncio.get_running_loop()
+            deadline = loop.time() + wait
+            initial_status = response_data['status']
+            while initial_status not in TERMINAL_STATUSES:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    await asyncio.wait_for(events.get(), remaining)
+                except asyncio.TimeoutError:
+                    break
+                response_data = await load_image_status(image_id) or response_data
+                if response_data['status'] != initial_status:
+                    break
+
+        return web.json_response(response_data)
+
+    except Exception as e:
+        logger.error(f"❌ 获取状态失败: {e}")
+        return json_error(f'获取状态失败: {str(e)}', 500)
+
+
+async def stream_status(request):
+    """以Server-Sent Events推送图片状态，完成或失败后关闭连接"""
+    image_id = int(request.match_info['image_id'])
+    pg_listener.start()
+    with status_broker.subscription(image_id) as events:
+        try:
+            last = await load_image_status(image_id)
+        except Exception as e:
+            logger.error(f"❌ 获取状态失败: {e}")
+            return json_error(f'获取状态失败: {str(e)}', 500)
+        if last is None:
+            return json_error('图片不存在', 404)
+
+        response = web.StreamResponse(headers={
+            'Content-Type': 'text/event-stream; charset=utf-8',
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no'
+        })
+        await response.prepare(request)
+        await response.write(f"retry: {STATUS_STREAM_CONFIG['retry_ms']}\n\n".encode())
+        await response.write(sse_event('status', last).encode())
+
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + STATUS_STREAM_CONFIG['max_duration']
+        while last['status'] not in TERMINAL_STATUSES and loop.time() < deadline:
+            try:
+                await asyncio.wait_for(events.get(), STATUS_STREAM_CONFIG['heartbeat_interval'])
+            except asyncio.TimeoutError:
+                # 注释行作为心跳，防止代理断开空闲连接
+                await response.write(b": keep-alive\n\n")
+                continue
+            latest = await load_image_status(image_id)
+            if latest and latest != last:
+                last = latest
+                await response.write(sse_event('status', last).encode())
+        return response
+
+
+async def add_cors_header(request, response):
+    """和Flask-CORS的默认配置一致：带Origin的请求允许任意来源"""
+    if 'Origin' in request.headers:
+        response.headers['Access-Control-Allow-Origin'] = '*'
+
+
+async def close_connections(application):
+    await pg_listener.stop()
+    await db.close()
+
+
+def create_async_app():
+    """
+    应用工厂：只注册路由，不连接数据库
+    连接池和通知监听在事件循环中第一次使用时创建，表结构由 python migrations.py 在部署时升级
+    """
+    application = web.Application(client_max_size=UPLOAD_CONFIG['max_request_bytes'])
+    application.add_routes([
+        web.get('/health', health_check),
+        web.get('/ready', readiness_check),
+        web.get('/metrics', metrics),
+        web.post('/upload', upload_image),
+        web.post('/upload-memory-photo', upload_memory_photo),
+        web.get('/studio-background', get_studio_background),
+        web.get(r'/image/{image_id:\d+}', get_image),
+        web.get('/status', get_status_batch),
+        web.post('/status/batch', get_status_batch),
+        web.get(r'/status/{image_id:\d+}', get_status),
+        web.get(r'/status/{image_id:\d+}/events', stream_status),
+    ])
+    application.on_response_prepare.append(add_cors_header)
+    application.on_cleanup.append(close_connections)
+
+    logger.info(f"🚀 Petechoes异步应用已创建（数据库 {DB_CONFIG['host']}:{DB_CONFIG['port']}）")
+    return application
+
+
+app = create_async_app()
+
+if __name__ == '__main__':
+    port = int(os.getenv('PORT', 8080))
+    logger.info(f"🚀 启动异步服务器在端口 {port}")
+    web.run_app(app, host='0.0.0.0', port=port)
@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+"""
+asyncio版本的PostgreSQL访问（async_app.py使用）
+asyncpg连接池和LISTEN/NOTIFY监听，对应同步应用的db_pool.py和pg_listener.py；
+导入时不连接数据库，连接池在事件循环中第一次使用时创建
+"""
+
+import os
+import asyncio
+import logging
+import itertools
+import functools
+from contextlib import asynccontextmanager
+
+logger = logging.getLogger(__name__)
+
+# 异步连接池配置（一个连接可以轮流服务很多个协程，上限不需要随并发请求数增加）
+ASYNC_POOL_CONFIG = {
+    'min_size': int(os.getenv('ASYNC_DB_POOL_MIN', '1')),
+    'max_size': int(os.getenv('ASYNC_DB_POOL_MAX', '20')),
+    'acquire_timeout': float(os.getenv('ASYNC_DB_POOL_TIMEOUT', '10')),
+    'max_inactive_lifetime': float(os.getenv('ASYNC_DB_POOL_MAX_IDLE', '300')),
+}
+
+
+def asyncpg_params(db_config):
+    """把psycopg2风格的DB_CONFIG转换为asyncpg的连接参数"""
+    return {
+        'host': db_config['host'],
+        'port': db_config['port'],
+        'database': db_config['database'],
+        'user': db_config['user'],
+        'password': db_config['password'],
+        'timeout': db_config.get('connect_timeout', 60),
+    }
+
+
+@functools.lru_cache(maxsize=None)
+def asyncpg_query(query):
+    """
+    把共享模块中psycopg2风格的SQL（%s占位符）转换为asyncpg的 $1, $2 ...
+    同步和异步应用使用同一份SQL（共享的SQL中不使用其他%字符）
+    """
+    counter = itertools.count(1)
+    return ''.join(
+        part if index == 0 else f"${next(counter)}{part}" for index, part in enumerate(query.split('%s'))
+    )
+
+
+class AsyncDatabase:
+    """延迟创建的asyncpg连接池，创建失败时下一次使用会重试"""
+
+    def __init__(self, db_config, min_size=1, max_size=20, acquire_timeout=10, max_inactive_lifetime=300):
+        self.db_config = dict(db_config)
+        self.min_size = min_size
+        self.max_size = max_size
+        self.acquire_timeout = acquire_timeout
+        self.max_inactive_lifetime = max_inactive_lifetime
+        self._pool = None
+        self._lock = asyncio.Lock()
+        self._stats = {'acquired': 0, 'timeouts': 0}
+
+    async def pool(self):
+        if self._pool is not None:
+            return self._pool
+        async with self._lock:
+            if self._pool is None:
+                import asyncpg
+
+                self._pool = await asyncpg.create_pool(
+                    min_size=self.min_size,
+                    max_size=self.max_size,
+                    max_inactive_connection_lifetime=self.max_inactive_lifetime,
+                    **asyncpg_params(self.db_config)
+                )
+                logger.info(f"🗄️ 异步连接池已创建（{self.min_size}-{self.max_size} 个连接）")
+        return self._pool
+
+    @asynccontextmanager
+    async def connection(self, timeout=None):
+        """借出一个连接，退出时归还"""
+        pool = await self.pool()
+        try:
+            conn = await pool.acquire(timeout=timeout or self.acquire_timeout)
+        except asyncio.TimeoutError:
+            self._stats['timeouts'] += 1
+            raise
+        self._stats['acquired'] += 1
+        try:
+            yield conn
+        finally:
+            await pool.release(conn)
+
+    async def close(self):
+        if self._pool is not None:
+            await self._pool.close()
+            self._pool = None
+
+    def stats(self):
+        data = dict(self._stats, max_size=self.max_size, host=self.db_config.get('host'))
+        if self._pool is not None:
+            data['size'] = self._pool.get_size()
+            data['idle'] = self._pool.get_idle_size()
+        return data
+
+
+class AsyncPgListener:
+    """
+    事件循环中的数据库通知监听：一个专用asyncpg连接，按频道分发通知
+    回调在事件循环中调用，应尽快返回；断线后自动重连并调用on_reconnect的回调
+    """
+
+    def __init__(self, db_config, reconnect_delay=5, ping_interval=30):
+        self.db_config = dict(db_config)
+        self.reconnect_delay = reconnect_delay
+        self.ping_interval = ping_interval
+        self._callbacks = {}
+        self._reconnect_callbacks = []
+        self._task = None
+        self._stats = {'notifications': 0, 'reconnects': 0, 'connected': False}
+
+    def subscribe(self, channel, callback):
+        """订阅频道，需要在start()之前调用"""
+        self._callbacks.setdefault(channel, []).append(callback)
+
+    def on_reconnect(self, callback):
+        """连接（重新）建立时调用，断线期间可能错过通知，订阅方应在这里做全量失效"""
+        self._reconnect_callbacks.append(callback)
+
+    def start(self):
+        """在当前事件循环中启动监听（已启动时不做任何事）"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self):
+        return dict(self._stats, channels=sorted(self._callbacks))
+
+    async def _run(self):
+        import asyncpg
+
+        while True:
+            conn = None
+            try:
+                conn = await asyncpg.connect(**asyncpg_params(self.db_config))
+                lost = asyncio.get_running_loop().create_future()
+                conn.add_termination_listener(lambda _: lost.done() or lost.set_result(None))
+                for channel in self._callbacks:
+                    await conn.add_listener(channel, self._dispatch)
+                self._stats['connected'] = True
+                logger.info(f"👂 已监听数据库通知: {sorted(self._callbacks)}")
+                for callback in self._reconnect_callbacks:
+                    self._safe_call(callback)
+
+                # 定期发一条查询，网络静默断开时也能发现
+                while not lost.done():
+                    try:
+                        await asyncio.wait_for(asyncio.shield(lost), self.ping_interval)
+                    except asyncio.TimeoutError:
+                        await conn.execute('SELECT 1')
+                logger.warning(f"⚠️ 数据库通知连接已断开，{self.reconnect_delay}秒后重连")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"⚠️ 数据库通知监听中断，{self.reconnect_delay}秒后重连: {e}")
+            finally:
+                self._stats['connected'] = False
+                if conn is not None and not conn.is_closed():
+                    conn.terminate()
+            self._stats['reconnects'] += 1
+            await asyncio.sleep(self.reconnect_delay)
+
+    def _dispatch(self, conn, pid, channel, payload):
+        self._stats['notifications'] += 1
+        for callback in self._callbacks.get(channel, ()):
+            self._safe_call(callback, payload)
+
+    @staticmethod
+    def _safe_call(fn, *args):
+        try:
+            fn(*args)
+        except Exception as e:
+            logger.error(f"❌ 通知回调 {getattr(fn, '__name__', fn)} 异常: {e}")
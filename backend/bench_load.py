@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+开发服务器、gunicorn和异步应用的压测对比
+分别启动Flask开发服务器（app.run）、gunicorn（gunicorn.conf.py）和aiohttp worker运行的async_app.py，
+用同样的并发请求同一个路径，输出每秒请求数和p50 / p99延迟：
+    python bench_load.py --concurrency 32 --duration 10
+    python bench_load.py --path /status/1 --modes gunicorn aiohttp
+"""
+
+import os
+import sys
+import time
+import socket
+import argparse
+import threading
+import subprocess
+
+import requests
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# 各模式的启动命令，{port}为监听端口
+MODES = {
+    'dev': [sys.executable, '-c', "from app import app; app.run(host='127.0.0.1', port={port}, threaded=True)"],
+    'gunicorn': [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py',
+                 '--bind', '127.0.0.1:{port}', 'app:app'],
+    'aiohttp': [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', '-k', 'aiohttp.GunicornWebWorker',
+                '--bind', '127.0.0.1:{port}', 'async_app:app'],
+}
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def start_server(mode, port, env):
+    command = [part.format(port=port) for part in MODES[mode]]
+    process = subprocess.Popen(command, cwd=BACKEND_DIR, env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f'{mode} 启动失败，退出码 {process.returncode}')
+        try:
+            requests.get(f'http://127.0.0.1:{port}/health', timeout=1)
+            return process
+        except requests.RequestException:
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError(f'{mode} 启动超时')
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+def run_load(url, concurrency, duration):
+    """concurrency个线程各自用保持连接的Session请求duration秒"""
+    samples = []
+    errors = [0]
+    lock = threading.Lock()
+    deadline = time.monotonic() + duration
+
+    def client():
+        session = requests.Session()
+        local = []
+        failed = 0
+        while time.monotonic() < deadline:
+            start = time.perf_counter()
+            try:
+                if session.get(url, timeout=30).status_code >= 500:
+                    failed += 1
+            except requests.RequestException:
+                failed += 1
+            local.append((time.perf_counter() - start) * 1000)
+        with lock:
+            samples.extend(local)
+            errors[0] += failed
+
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return samples, errors[0]
+
+def main():
+    """主函数"""
+    parser = argparse.ArgumentParser(description='开发服务器、gunicorn和异步应用压测对比')
+    parser.add_argument('--path', default='/health', help='请求路径')
+    parser.add_argument('--concurrency', type=int, default=32, help='并发连接数')
+    parser.add_argument('--duration', type=float, default=10, help='每个模式的压测秒数')
+    parser.add_argument('--modes', nargs='+', choices=sorted(MODES), default=['dev', 'gunicorn'])
+    args = parser.parse_args()
+
+    # 只比较请求处理能力，不启动任务调度和访问日志
+    env = dict(os.environ, JOB_DISPATCHER_ENABLED='false', GUNICORN_ACCESS_LOG='')
+
+    print(f"🚀 压测 {args.path}，并发 {args.concurrency}，每个模式 {args.duration:.0f} 秒")
+    print("=" * 40)
+
+    for mode in args.modes:
+        port = free_port()
+        process = start_server(mode, port, env)
+        try:
+            samples, errors = run_load(f'http://127.0.0.1:{port}{args.path}', args.concurrency, args.duration)
+        finally:
+            process.terminate()
+            process.wait(timeout=30)
+        print(f"✅ {mode:8s} {len(samples) / args.duration:8.0f} req/s | p50 {percentile(samples, 50):6.1f} ms | "
+              f"p99 {percentile(samples, 99):6.1f} ms | 错误 {errors}")
+
+if __name__ == '__main__':
+    main()
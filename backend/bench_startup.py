@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+进程启动时间的压测脚本
+在新的Python进程中导入应用并完成第一个 /health 请求，重复多次后输出中位数和最大值；
+默认把数据库指向不可达的地址，验证数据库不可达时worker仍能在毫秒级启动：
+    python bench_startup.py --runs 10
+    python bench_startup.py --target root --db-host 127.0.0.1
+"""
+
+import os
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BACKEND_DIR)
+
+# 在子进程中执行：导入应用、请求 /health，输出各阶段的毫秒数
+CHILD_CODE = '''
+import json, sys, time
+start = time.perf_counter()
+sys.path.insert(0, {path!r})
+import {module} as module
+app = module.app
+imported = time.perf_counter()
+client = app.test_client()
+status = client.get('/health').status_code
+served = time.perf_counter()
+print(json.dumps({{
+    'import_ms': (imported - start) * 1000,
+    'first_health_ms': (served - imported) * 1000,
+    'health_status': status,
+}}))
+'''
+
+# (目录, 模块)
+TARGETS = {
+    'backend': (BACKEND_DIR, 'app'),
+    'root': (ROOT_DIR, 'app'),
+}
+
+def run_once(target, env):
+    path, module = TARGETS[target]
+    code = CHILD_CODE.format(path=path, module=module)
+    result = subprocess.run(
+        [sys.executable, '-c', code], cwd=path, env=env,
+        capture_output=True, text=True, timeout=120
+    )
+    lines = [line for line in result.stdout.splitlines() if line.startswith('{')]
+    if result.returncode != 0 or not lines:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1] if result.stderr else '子进程没有输出')
+    return json.loads(lines[-1])
+
+def main():
+    """主函数"""
+    parser = argparse.ArgumentParser(description='应用启动时间压测')
+    parser.add_argument('--runs', type=int, default=5, help='重复次数')
+    parser.add_argument('--target', choices=sorted(TARGETS), default='backend', help='backend/app.py 或根目录 app.py')
+    parser.add_argument('--db-host', default='10.255.255.1', help='数据库地址（默认不可达）')
+    args = parser.parse_args()
+
+    env = dict(os.environ, POSTGRES_HOST=args.db_host, JOB_DISPATCHER_ENABLED='false')
+
+    print(f"🚀 启动时间压测: {args.target}，数据库 {args.db_host}，{args.runs} 次")
+    print("=" * 40)
+
+    samples = []
+    for i in range(args.runs):
+        sample = run_once(args.target, env)
+        samples.append(sample)
+        print(f"  #{i + 1} 导入 {sample['import_ms']:.0f} ms，首个 /health {sample['first_health_ms']:.1f} ms"
+              f"（{sample['health_status']}）")
+
+    for key, label in (('import_ms', '导入'), ('first_health_ms', '首个 /health')):
+        values = [sample[key] for sample in samples]
+        print(f"✅ {label}: 中位数 {statistics.median(values):.1f} ms，最大 {max(values):.1f} ms")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+"""
+/status 查询延迟的压测脚本
+可以先向images写入指定数量的模拟行（默认100万），然后随机查询 /status/<id>，
+输出p50 / p95 / p99延迟，并打印状态查询的执行计划（应为Index Only Scan）
+
+请只对测试数据库使用 --seed：
+    python bench_status.py --seed 1000000 --requests 5000
+    python bench_status.py --url http://localhost:5001 --requests 5000
+    python bench_status.py --cleanup
+"""
+
+import sys
+import time
+import random
+import argparse
+import psycopg2
+from config import DB_CONFIG
+from images_schema import STATUS_QUERY
+from migrations import migrate
+
+# 模拟行没有任何图片内容，清理时按这个条件删除
+SEED_MARKER = "original_key IS NULL AND original_image IS NULL"
+
+# 模拟行的状态分布：少量进行中和失败，其余已完成
+SEED_SQL = '''
+    INSERT INTO images (status, created_at)
+    SELECT CASE WHEN g %% 50 = 0 THEN 'processing' WHEN g %% 97 = 0 THEN 'failed' ELSE 'completed' END,
+           CURRENT_TIMESTAMP - g * INTERVAL '1 second'
+    FROM generate_series(1, %s) AS g
+'''
+
+def seed_rows(conn, count, batch_size):
+    """分批写入模拟行"""
+    cursor = conn.cursor()
+    done = 0
+    while done < count:
+        size = min(batch_size, count - done)
+        cursor.execute(SEED_SQL, (size,))
+        conn.commit()
+        done += size
+        print(f"  📦 已写入 {done}/{count} 行")
+    cursor.execute("ANALYZE images")
+    # 更新可见性映射，index-only scan才不需要回表
+    conn.autocommit = True
+    cursor.execute("VACUUM images")
+    conn.autocommit = False
+    cursor.close()
+
+def id_range(conn):
+    cursor = conn.cursor()
+    cursor.execute("SELECT MIN(id), MAX(id), COUNT(*) FROM images")
+    result = cursor.fetchone()
+    cursor.close()
+    return result
+
+def explain_status(conn, image_id):
+    """打印状态查询的执行计划"""
+    cursor = conn.cursor()
+    cursor.execute(
+        f"EXPLAIN (ANALYZE, BUFFERS) {STATUS_QUERY}",
+        ([image_id],)
+    )
+    for (line,) in cursor.fetchall():
+        print(f"  {line}")
+    cursor.close()
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+def run_requests(url, min_id, max_id, count):
+    """随机查询 /status/<id>，返回每次请求的毫秒数"""
+    if url:
+        import requests
+        session = requests.Session()
+        fetch = lambda image_id: session.get(f"{url.rstrip('/')}/status/{image_id}", timeout=10).status_code
+    else:
+        # 没有指定URL时在进程内用Flask测试客户端请求，不包含网络开销
+        from app import app
+        client = app.test_client()
+        fetch = lambda image_id: client.get(f"/status/{image_id}").status_code
+
+    samples = []
+    errors = 0
+    for _ in range(count):
+        image_id = random.randint(min_id, max_id)
+        start = time.perf_counter()
+        status_code = fetch(image_id)
+        samples.append((time.perf_counter() - start) * 1000)
+        if status_code >= 500:
+            errors += 1
+    return samples, errors
+
+def main():
+    """主函数"""
+    parser = argparse.ArgumentParser(description='/status 查询延迟压测')
+    parser.add_argument('--seed', type=int, default=0, help='先写入的模拟行数（只用于测试数据库）')
+    parser.add_argument('--batch-size', type=int, default=100000, help='每批写入的模拟行数')
+    parser.add_argument('--requests', type=int, default=2000, help='请求次数')
+    parser.add_argument('--url', help='服务地址，不指定时在进程内请求')
+    parser.add_argument('--cleanup', action='store_true', help='删除模拟行后退出')
+    args = parser.parse_args()
+
+    print("🚀 /status 压测工具")
+    print("=" * 40)
+
+    try:
+        conn = psycopg2.connect(**DB_CONFIG)
+    except Exception as e:
+        print(f"❌ 数据库连接失败: {e}")
+        sys.exit(1)
+
+    # 确保has_generated列和状态索引已存在
+    migrate(conn)
+
+    cursor = conn.cursor()
+    if args.cleanup:
+        cursor.execute(f"DELETE FROM images WHERE {SEED_MARKER}")
+        print(f"🧹 已删除 {cursor.rowcount} 行模拟数据")
+        conn.commit()
+        conn.close()
+        return
+    cursor.close()
+
+    if args.seed:
+        print(f"\n📦 写入 {args.seed} 行模拟数据")
+        seed_rows(conn, args.seed, args.batch_size)
+
+    min_id, max_id, total = id_range(conn)
+    if not total:
+        print("❌ images表为空，请先使用 --seed")
+        sys.exit(1)
+    print(f"\n📊 images表共 {total} 行")
+
+    print("\n🔍 状态查询执行计划:")
+    explain_status(conn, random.randint(min_id, max_id))
+    conn.close()
+
+    print(f"\n⏱️ 发送 {args.requests} 次请求 ({args.url or '进程内'})")
+    samples, errors = run_requests(args.url, min_id, max_id, args.requests)
+
+    print(f"\n✅ p50 {percentile(samples, 50):.2f} ms | p95 {percentile(samples, 95):.2f} ms | "
+          f"p99 {percentile(samples, 99):.2f} ms | max {max(samples):.2f} ms | 错误 {errors}")
+
+if __name__ == "__main__":
+    main()
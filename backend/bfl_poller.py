@@ -0,0 +1,367 @@
+#!/usr/bin/env python3
+"""
+BFL任务轮询调度器
+一个asyncio事件循环线程按下次检查时间（小顶堆）并发轮询所有未完成任务，
+共享同一个HTTP连接池，取代每个任务一个阻塞的 while + time.sleep 循环
+"""
+
+import os
+import time
+import heapq
+import atexit
+import random
+import asyncio
+import logging
+import itertools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from http_client import http_client, HTTP_CLIENT_CONFIG, RETRY_STATUSES
+from provider_guard import bfl_breaker, bfl_poll_concurrency
+
+logger = logging.getLogger(__name__)
+
+# 轮询配置
+POLLER_CONFIG = {
+    'max_connections': int(os.getenv('BFL_POLL_MAX_CONNECTIONS', '20')),
+    'request_timeout': float(os.getenv('BFL_POLL_TIMEOUT', '30')),
+    'min_interval': float(os.getenv('BFL_POLL_MIN_INTERVAL', '1')),
+    'max_interval': float(os.getenv('BFL_POLL_MAX_INTERVAL', '15')),
+    'completion_workers': int(os.getenv('BFL_POLL_COMPLETION_WORKERS', '4')),
+    'heartbeat_interval': float(os.getenv('BFL_POLL_HEARTBEAT_INTERVAL', '60')),
+}
+
+# 轮询结果分类
+POLL_PENDING = 'pending'
+POLL_RETRY = 'retry'
+POLL_READY = 'ready'
+POLL_FAILED = 'failed'
+POLL_TIMEOUT = 'timeout'
+
+# BFL明确表示任务不会再完成的状态
+BFL_FAILED_STATUSES = {'failed', 'Error', 'Failed', 'Task not found', 'Request Moderated', 'Content Moderated'}
+# 已经开始生成、很快会完成的状态
+BFL_RUNNING_STATUSES = {'running', 'processing', 'Processing'}
+
+
+def classify_poll_response(status_code, result):
+    """
+    把一次BFL轮询响应归类
+    返回 (分类, 详情)：READY时详情为生成图片URL，其余为状态说明
+    """
+    if status_code == 404:
+        return POLL_FAILED, 'task not found'
+    if status_code != 200 or not isinstance(result, dict):
+        return POLL_RETRY, f'HTTP {status_code}'
+
+    status = result.get('status')
+    sample = None
+    if isinstance(result.get('result'), dict):
+        sample = result['result'].get('sample')
+    sample = sample or result.get('sample')
+
+    if status is None:
+        # 旧格式响应，直接包含结果URL
+        if 'url' in result:
+            return POLL_READY, result['url']
+        return POLL_PENDING, 'unknown'
+    if status in ('completed', 'Ready'):
+        if sample:
+            return POLL_READY, sample
+        return POLL_FAILED, 'completed without sample'
+    if status in BFL_FAILED_STATUSES:
+        return POLL_FAILED, status
+    return POLL_PENDING, status
+
+
+class PollTask:
+    """一个被跟踪的BFL任务"""
+
+    def __init__(self, key, polling_url, context, on_done, headers=None,
+                 timeout=300, interval=5, min_interval=None, max_interval=None):
+        self.key = key
+        self.polling_url = polling_url
+        self.context = context
+        self.on_done = on_done
+        self.headers = headers or {}
+        self.deadline = time.monotonic() + timeout
+        self.interval = interval
+        # 单个任务的间隔范围，不设置时使用调度器的配置（有完成回调的任务只需要慢速兜底）
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.attempts = 0
+        self.last_status = None
+
+
+class BflPoller:
+    """单线程asyncio轮询器"""
+
+    def __init__(self, max_connections=20, request_timeout=30, min_interval=1,
+                 max_interval=15, completion_workers=4, heartbeat_interval=60,
+                 heartbeat=None, on_shutdown=None):
+        self.max_connections = max_connections
+        self.request_timeout = request_timeout
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.completion_workers = completion_workers
+        self.heartbeat_interval = heartbeat_interval
+        self.heartbeat = heartbeat
+        self.on_shutdown = on_shutdown
+
+        self._lock = threading.Lock()
+        self._tasks = {}
+        self._heap = []
+        self._seq = itertools.count()
+        self._loop = None
+        self._wakeup = None
+        self._thread = None
+        self._completions = None
+        self._pid = None
+        self._stopping = False
+        self._stats = {
+            'tracked_total': 0,
+            'polls': 0,
+            'poll_errors': 0,
+            'ready': 0,
+            'failed': 0,
+            'timeouts': 0,
+            'shed': 0,
+            'poll_latency_ms_total': 0.0,
+        }
+        self._in_flight = 0
+        # 正在执行的轮询协程，事件循环只保留弱引用，这里持有强引用避免执行中被回收
+        self._pending = set()
+
+    # ---- 线程安全的外部接口 ----
+
+    def start(self):
+        """启动事件循环线程（fork后的子进程会重新启动）"""
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._tasks = {}
+            self._heap = []
+            self._in_flight = 0
+            self._pending = set()
+            self._stopping = False
+            self._completions = ThreadPoolExecutor(
+                max_workers=self.completion_workers, thread_name_prefix='bfl-complete'
+            )
+            ready = threading.Event()
+            self._thread = threading.Thread(
+                target=self._run_loop, args=(ready,), name='bfl-poller', daemon=True
+            )
+            self._thread.start()
+            ready.wait()
+            self._pid = os.getpid()
+            logger.info(f"📡 BFL轮询调度器已启动，连接池上限 {self.max_connections}")
+
+    def track(self, task):
+        """开始跟踪一个任务，同一个key重复提交会被忽略"""
+        self.start()
+        with self._lock:
+            if task.key in self._tasks:
+                return False
+            self._tasks[task.key] = task
+            self._stats['tracked_total'] += 1
+        self._loop.call_soon_threadsafe(self._schedule, task, task.interval)
+        return True
+
+    def untrack(self, key):
+        """停止跟踪（结果已由完成回调处理），返回是否正在跟踪"""
+        with self._lock:
+            return self._tasks.pop(key, None) is not None
+
+    def is_tracking(self, key):
+        with self._lock:
+            return key in self._tasks
+
+    def stop(self):
+        """停止轮询，未完成的任务交给on_shutdown释放"""
+        if self._pid != os.getpid() or self._stopping:
+            return
+        self._stopping = True
+        with self._lock:
+            contexts = [task.context for task in self._tasks.values()]
+            self._tasks.clear()
+        self._loop.call_soon_threadsafe(self._wakeup.set)
+        self._thread.join(timeout=5)
+        self._completions.shutdown(wait=True)
+        if self.on_shutdown and contexts:
+            try:
+                self.on_shutdown(contexts)
+            except Exception as e:
+                logger.warning(f"⚠️ 释放未完成轮询任务失败: {e}")
+
+    def stats(self):
+        """轮询器指标"""
+        with self._lock:
+            data = dict(self._stats)
+            data.update({
+                'tracked': len(self._tasks) if self._pid == os.getpid() else 0,
+                'in_flight': self._in_flight if self._pid == os.getpid() else 0,
+                'max_connections': self.max_connections,
+            })
+        polls = data['polls']
+        data['poll_latency_ms_avg'] = round(data.pop('poll_latency_ms_total') / polls, 1) if polls else 0
+        return data
+
+    # ---- 事件循环内部 ----
+
+    def _run_loop(self, ready):
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        self._wakeup = asyncio.Event()
+        ready.set()
+        try:
+            self._loop.run_until_complete(self._main())
+        finally:
+            self._loop.close()
+
+    def _schedule(self, task, delay):
+        heapq.heappush(self._heap, (time.monotonic() + delay, next(self._seq), task))
+        self._wakeup.set()
+
+    async def _main(self):
+        # aiohttp导入较慢（约0.2秒），在轮询线程启动时才导入，不拖慢进程启动
+        import aiohttp
+
+        connector = aiohttp.TCPConnector(limit=self.max_connections, keepalive_timeout=30)
+        # 和同步客户端使用相同的连接超时，单次轮询的总时间不超过request_timeout
+        timeout = aiohttp.ClientTimeout(
+            total=self.request_timeout, sock_connect=HTTP_CLIENT_CONFIG['connect_timeout']
+        )
+        next_heartbeat = time.monotonic() + self.heartbeat_interval
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+            while not self._stopping:
+                now = time.monotonic()
+                while self._heap and self._heap[0][0] <= now:
+                    _, _, task = heapq.heappop(self._heap)
+                    with self._lock:
+                        if self._tasks.get(task.key) is not task:
+                            continue
+                        self._in_flight += 1
+                    future = asyncio.ensure_future(self._poll(session, task))
+                    self._pending.add(future)
+                    future.add_done_callback(self._pending.discard)
+
+                if self.heartbeat and now >= next_heartbeat:
+                    next_heartbeat = now + self.heartbeat_interval
+                    self._dispatch_heartbeat()
+
+                wait = next_heartbeat - now
+                if self._heap:
+                    wait = min(wait, self._heap[0][0] - now)
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=max(wait, 0))
+                except asyncio.TimeoutError:
+                    pass
+
+    def _dispatch_heartbeat(self):
+        with self._lock:
+            contexts = [task.context for task in self._tasks.values()]
+        if contexts:
+            self._completions.submit(self._safe_call, self.heartbeat, contexts)
+
+    def _shed_delay(self):
+        """BFL熔断或轮询并发已满时返回推迟的秒数，否则占用名额并返回0"""
+        if bfl_breaker.is_open():
+            return bfl_breaker.retry_after()
+        if not bfl_poll_concurrency.try_acquire():
+            return self.min_interval
+        if not bfl_breaker.allow():
+            bfl_poll_concurrency.cancel()
+            return bfl_breaker.retry_after()
+        return 0
+
+    async def _poll(self, session, task):
+        delay = self._shed_delay()
+        if delay:
+            # 主动推迟的时间不计入任务超时，也不算一次检查
+            task.deadline += delay
+            with self._lock:
+                self._in_flight -= 1
+                self._stats['shed'] += 1
+            self._schedule(task, delay)
+            return
+
+        task.attempts += 1
+        started = time.monotonic()
+        status_code = None
+        try:
+            async with session.get(task.polling_url, headers=task.headers) as response:
+                status_code = response.status
+                result = None
+                if status_code == 200:
+                    result = await response.json(content_type=None)
+                else:
+                    await response.read()
+            outcome, detail = classify_poll_response(status_code, result)
+        except Exception as e:
+            outcome, detail = POLL_RETRY, str(e) or type(e).__name__
+        elapsed = (time.monotonic() - started) * 1000
+        # 网络错误和429 / 5xx说明BFL过载，收紧并发上限并计入熔断器
+        overloaded = outcome == POLL_RETRY and (status_code is None or status_code in RETRY_STATUSES)
+        bfl_poll_concurrency.release(elapsed, overloaded=overloaded)
+        bfl_breaker.record(not overloaded)
+        # 和其他出站请求一起按接口统计延迟（见 /metrics 的 http_client）
+        http_client.endpoint_stats.record(
+            'bfl.poll', elapsed, ok=outcome != POLL_RETRY, status=status_code
+        )
+
+        with self._lock:
+            self._in_flight -= 1
+            self._stats['polls'] += 1
+            self._stats['poll_latency_ms_total'] += elapsed
+            if outcome == POLL_RETRY:
+                self._stats['poll_errors'] += 1
+
+        if outcome in (POLL_READY, POLL_FAILED):
+            self._finish(task, outcome, detail)
+            return
+        interval = self._next_interval(task, outcome, detail)
+        if time.monotonic() + interval > task.deadline:
+            self._finish(task, POLL_TIMEOUT, detail)
+            return
+
+        if detail != task.last_status:
+            logger.info(f"📊 BFL任务 {task.key} 状态: {detail}（第 {task.attempts} 次检查）")
+        task.last_status = detail
+        self._schedule(task, interval)
+
+    def _next_interval(self, task, outcome, detail):
+        """自适应退避：排队中逐渐放慢，生成中加快，出错时指数退避"""
+        if outcome == POLL_RETRY:
+            interval = task.interval * 2
+        elif detail in BFL_RUNNING_STATUSES:
+            interval = task.interval / 2
+        else:
+            interval = task.interval * 1.5
+        min_interval = task.min_interval or self.min_interval
+        max_interval = task.max_interval or self.max_interval
+        interval = min(max(interval, min_interval), max_interval)
+        task.interval = interval * random.uniform(0.9, 1.1)
+        return task.interval
+
+    def _finish(self, task, outcome, detail):
+        with self._lock:
+            if self._tasks.get(task.key) is not task:
+                return
+            del self._tasks[task.key]
+            self._stats[{POLL_READY: 'ready', POLL_FAILED: 'failed', POLL_TIMEOUT: 'timeouts'}[outcome]] += 1
+        self._completions.submit(self._safe_call, task.on_done, task.context, outcome, detail)
+
+    @staticmethod
+    def _safe_call(fn, *args):
+        try:
+            fn(*args)
+        except Exception as e:
+            logger.error(f"❌ 轮询回调 {getattr(fn, '__name__', fn)} 异常: {e}")
+
+
+bfl_poller = BflPoller(**POLLER_CONFIG)
+
+atexit.register(bfl_poller.stop)
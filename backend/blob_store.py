@@ -0,0 +1,333 @@
+#!/usr/bin/env python3
+"""
+图片二进制存储
+按SHA-256内容哈希寻址，数据库里只保存key和元数据；
+支持本地文件系统和S3兼容存储（AWS S3、MinIO等）两种后端
+"""
+
+import io
+import os
+import shutil
+import hashlib
+import logging
+import tempfile
+import threading
+
+logger = logging.getLogger(__name__)
+
+# 存储配置
+BLOB_CONFIG = {
+    'backend': os.getenv('BLOB_STORE', 'local'),
+    'local_dir': os.getenv('BLOB_LOCAL_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'blob_data')),
+    's3_bucket': os.getenv('BLOB_S3_BUCKET'),
+    's3_prefix': os.getenv('BLOB_S3_PREFIX', 'blobs/'),
+    's3_endpoint_url': os.getenv('BLOB_S3_ENDPOINT_URL'),
+    's3_region': os.getenv('BLOB_S3_REGION'),
+    's3_access_key': os.getenv('BLOB_S3_ACCESS_KEY'),
+    's3_secret_key': os.getenv('BLOB_S3_SECRET_KEY'),
+    # 设置后本地图片通过 X-Accel-Redirect 交给nginx发送，例如 /protected-blobs/
+    'accel_redirect_prefix': os.getenv('BLOB_ACCEL_REDIRECT_PREFIX'),
+    # 大于0时S3中的图片302重定向到签名地址（秒），由存储服务直接发送；为0时由应用流式转发
+    'redirect_ttl': int(os.getenv('BLOB_REDIRECT_TTL', '0')),
+}
+
+CHUNK_SIZE = 64 * 1024
+
+# 已完成图片内容不会再变化，可以长期缓存
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+
+# 登记blob元数据（app.py和async_app.py共用，异步应用经async_db.asyncpg_query转换占位符）
+RECORD_BLOB_SQL = "INSERT INTO blobs (key, size, content_type) VALUES (%s, %s, %s) ON CONFLICT (key) DO NOTHING"
+
+
+class BlobNotFoundError(KeyError):
+    """key对应的内容不存在"""
+
+
+class BlobInfo:
+    """一次写入的结果"""
+
+    def __init__(self, key, size, content_type='image/jpeg'):
+        self.key = key
+        self.size = size
+        self.content_type = content_type
+
+    def __repr__(self):
+        return f"BlobInfo({self.key[:12]}..., {self.size} bytes)"
+
+
+def _spool(fileobj):
+    """把输入流写入临时文件，同时计算哈希和大小"""
+    digest = hashlib.sha256()
+    size = 0
+    spool = tempfile.SpooledTemporaryFile(max_size=8 * 1024 * 1024)
+    while True:
+        chunk = fileobj.read(CHUNK_SIZE)
+        if not chunk:
+            break
+        digest.update(chunk)
+        size += len(chunk)
+        spool.write(chunk)
+    spool.seek(0)
+    return spool, digest.hexdigest(), size
+
+
+class BlobStore:
+    """存储后端的公共接口"""
+
+    def put(self, data, content_type='image/jpeg'):
+        """写入字节内容，返回BlobInfo"""
+        return self.put_file(io.BytesIO(data), content_type)
+
+    def put_file(self, fileobj, content_type='image/jpeg'):
+        """以流的方式写入文件对象，返回BlobInfo"""
+        raise NotImplementedError
+
+    def put_hashed_file(self, path, key, size, content_type='image/jpeg'):
+        """
+        写入已经计算过哈希的本地文件（流式下载时边下载边计算），不再重新读取计算
+        调用方保证key是文件内容的SHA-256
+        """
+        with open(path, 'rb') as f:
+            return self.put_file(f, content_type)
+
+    def open(self, key):
+        """打开内容用于读取，返回文件对象"""
+        raise NotImplementedError
+
+    def get(self, key):
+        """读取全部内容"""
+        with self.open(key) as f:
+            return f.read()
+
+    def exists(self, key):
+        raise NotImplementedError
+
+    def delete(self, key):
+        raise NotImplementedError
+
+    def local_path(self, key):
+        """内容在本地磁盘上的路径，非本地后端返回None"""
+        return None
+
+    def presigned_url(self, key, expires_in):
+        """存储服务直接提供的限时下载地址，不支持的后端返回None"""
+        return None
+
+    def download_url(self, key):
+        """发送图片时重定向的地址，没有开启BLOB_REDIRECT_TTL或后端不支持时返回None"""
+        if BLOB_CONFIG['redirect_ttl'] <= 0:
+            return None
+        return self.presigned_url(key, BLOB_CONFIG['redirect_ttl'])
+
+
+class LocalBlobStore(BlobStore):
+    """本地文件系统后端，按 ab/cd/abcd... 分目录存放"""
+
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(self.root, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.root, key[:2], key[2:4], key)
+
+    def put_file(self, fileobj, content_type='image/jpeg'):
+        digest = hashlib.sha256()
+        size = 0
+        fd, tmp_path = tempfile.mkstemp(dir=self.root, prefix='.upload-')
+        try:
+            with os.fdopen(fd, 'wb') as tmp:
+                while True:
+                    chunk = fileobj.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    digest.update(chunk)
+                    size += len(chunk)
+                    tmp.write(chunk)
+            key = digest.hexdigest()
+            path = self._path(key)
+            if os.path.exists(path):
+                os.unlink(tmp_path)
+            else:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                os.replace(tmp_path, path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+        return BlobInfo(key, size, content_type)
+
+    def put_hashed_file(self, path, key, size, content_type='image/jpeg'):
+        target = self._path(key)
+        if not os.path.exists(target):
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=self.root, prefix='.upload-')
+            os.close(fd)
+            try:
+                # 同一文件系统上用硬链接，不复制内容
+                try:
+                    os.unlink(tmp_path)
+                    os.link(path, tmp_path)
+                except OSError:
+                    shutil.copyfile(path, tmp_path)
+                os.replace(tmp_path, target)
+            except Exception:
+                if os.path.exists(tmp_path):
+                    os.unlink(tmp_path)
+                raise
+        return BlobInfo(key, size, content_type)
+
+    def open(self, key):
+        try:
+            return open(self._path(key), 'rb')
+        except FileNotFoundError:
+            raise BlobNotFoundError(key)
+
+    def exists(self, key):
+        return os.path.exists(self._path(key))
+
+    def delete(self, key):
+        try:
+            os.unlink(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def local_path(self, key):
+        path = self._path(key)
+        return path if os.path.exists(path) else None
+
+    def relative_path(self, key):
+        """相对存储根目录的路径（用于X-Accel-Redirect）"""
+        return f"{key[:2]}/{key[2:4]}/{key}"
+
+
+class S3BlobStore(BlobStore):
+    """S3兼容后端（需要安装boto3），endpoint_url可指向MinIO等本地替身"""
+
+    def __init__(self, bucket, prefix='blobs/', endpoint_url=None, region=None,
+                 access_key=None, secret_key=None):
+        try:
+            import boto3
+        except ImportError:
+            raise RuntimeError('使用S3存储需要安装boto3: pip install boto3')
+        if not bucket:
+            raise RuntimeError('使用S3存储需要设置BLOB_S3_BUCKET')
+        self.bucket = bucket
+        self.prefix = prefix
+        self.client = boto3.client(
+            's3',
+            endpoint_url=endpoint_url,
+            region_name=region,
+            aws_access_key_id=access_key,
+            aws_secret_access_key=secret_key,
+        )
+
+    def _object_key(self, key):
+        return f"{self.prefix}{key}"
+
+    def put_file(self, fileobj, content_type='image/jpeg'):
+        spool, key, size = _spool(fileobj)
+        try:
+            if not self.exists(key):
+                self.client.upload_fileobj(
+                    spool, self.bucket, self._object_key(key),
+                    ExtraArgs={'ContentType': content_type}
+                )
+        finally:
+            spool.close()
+        return BlobInfo(key, size, content_type)
+
+    def put_hashed_file(self, path, key, size, content_type='image/jpeg'):
+        if not self.exists(key):
+            self.client.upload_file(
+                path, self.bucket, self._object_key(key), ExtraArgs={'ContentType': content_type}
+            )
+        return BlobInfo(key, size, content_type)
+
+    def open(self, key):
+        try:
+            response = self.client.get_object(Bucket=self.bucket, Key=self._object_key(key))
+        except self.client.exceptions.NoSuchKey:
+            raise BlobNotFoundError(key)
+        return response['Body']
+
+    def exists(self, key):
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=self._object_key(key))
+            return True
+        except Exception:
+            return False
+
+    def delete(self, key):
+        self.client.delete_object(Bucket=self.bucket, Key=self._object_key(key))
+
+    def presigned_url(self, key, expires_in):
+        return self.client.generate_presigned_url(
+            'get_object', Params={'Bucket': self.bucket, 'Key': self._object_key(key)}, ExpiresIn=expires_in
+        )
+
+
+def create_blob_store(config=None):
+    """按配置创建存储后端"""
+    config = config or BLOB_CONFIG
+    if config['backend'] == 's3':
+        return S3BlobStore(
+            config['s3_bucket'],
+            prefix=config['s3_prefix'],
+            endpoint_url=config['s3_endpoint_url'],
+            region=config['s3_region'],
+            access_key=config['s3_access_key'],
+            secret_key=config['s3_secret_key'],
+        )
+    if config['backend'] == 'local':
+        return LocalBlobStore(config['local_dir'])
+    raise ValueError(f"未知的BLOB_STORE后端: {config['backend']}")
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_blob_store():
+    """进程内共享的存储后端"""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = create_blob_store()
+                logger.info(f"🗄️ 图片存储后端: {BLOB_CONFIG['backend']}")
+    return _store
+
+
+def init_blob_schema(cursor):
+    """创建blobs元数据表，并为images / studio_backgrounds增加key列（在迁移中调用）"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS blobs (
+            key VARCHAR(64) PRIMARY KEY,
+            size BIGINT NOT NULL,
+            content_type VARCHAR(100) NOT NULL DEFAULT 'image/jpeg',
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    cursor.execute("ALTER TABLE images ALTER COLUMN original_image DROP NOT NULL")
+    cursor.execute("ALTER TABLE images ADD COLUMN IF NOT EXISTS original_key VARCHAR(64) REFERENCES blobs(key)")
+    cursor.execute("ALTER TABLE images ADD COLUMN IF NOT EXISTS generated_key VARCHAR(64) REFERENCES blobs(key)")
+    cursor.execute("ALTER TABLE IF EXISTS studio_backgrounds ALTER COLUMN image_data DROP NOT NULL")
+    cursor.execute("ALTER TABLE IF EXISTS studio_backgrounds ADD COLUMN IF NOT EXISTS blob_key VARCHAR(64) REFERENCES blobs(key)")
+
+
+def record_blob(cursor, blob):
+    """在调用方的事务中登记blob元数据"""
+    cursor.execute(RECORD_BLOB_SQL, (blob.key, blob.size, blob.content_type))
+
+
+def content_etag(blob_key, legacy_data=None):
+    """图片的强ETag：blob的key就是内容哈希，尚未迁移的旧BYTEA数据现算哈希"""
+    return blob_key or hashlib.sha256(legacy_data).hexdigest()
+
+
+def cache_control(immutable=True):
+    """图片响应的Cache-Control：生成后不再变化的图片长期缓存，可能被替换的每次用ETag重新验证"""
+    if immutable:
+        return f'public, max-age={IMMUTABLE_MAX_AGE}, immutable'
+    return 'no-cache'
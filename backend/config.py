@@ -1,9 +1,9 @@
 import os
-import time
 import psycopg2
 from dotenv import load_dotenv
+import db_pool
 
-# 加载环境变量
+# 加载环境变量（导入时只读取配置，不连接数据库、不打印，连接在第一次使用时建立）
 load_dotenv()
 
 # PostgreSQL数据库配置
@@ -13,7 +13,9 @@ DB_CONFIG = {
     'port': int(os.getenv('POSTGRES_PORT', '30177')),  # 更新为新端口
     'database': os.getenv('POSTGRES_DATABASE', os.getenv('POSTGRES_DB', 'zeabur')),
     'user': os.getenv('POSTGRES_USERNAME', os.getenv('POSTGRES_USER', 'root')),
-    'password': os.getenv('POSTGRES_PASSWORD', os.getenv('PASSWORD', 'laKs69d7AVXmTJ5H1wLGBrIqv0h43k28'))
+    'password': os.getenv('POSTGRES_PASSWORD', os.getenv('PASSWORD', 'laKs69d7AVXmTJ5H1wLGBrIqv0h43k28')),
+    # 数据库不可达时尽快失败
+    'connect_timeout': int(os.getenv('POSTGRES_CONNECT_TIMEOUT', '5'))
 }
 
 # ModelScope API配置
@@ -24,50 +26,15 @@ BFL_API_KEY = os.getenv('BFL_API_KEY')
 
 def get_db_connection_with_retry(max_retries=5, retry_delay=2):
     """
-    带重试逻辑的数据库连接
+    从共享连接池借出数据库连接
+    需要新建物理连接时带重试逻辑，用完调用 conn.close() 归还连接池
     """
-    for attempt in range(max_retries):
-        try:
-            print(f"🔄 尝试连接数据库 (第{attempt + 1}次/共{max_retries}次)...")
-            print(f"   Host: {DB_CONFIG['host']}:{DB_CONFIG['port']}")
-            print(f"   Database: {DB_CONFIG['database']}")
-            print(f"   User: {DB_CONFIG['user']}")
-            
-            conn = psycopg2.connect(**DB_CONFIG)
-            print("✅ 数据库连接成功！")
-            return conn
-            
-        except psycopg2.OperationalError as e:
-            print(f"❌ 数据库连接失败 (第{attempt + 1}次): {e}")
-            if attempt < max_retries - 1:
-                print(f"⏰ {retry_delay}秒后重试...")
-                time.sleep(retry_delay)
-            else:
-                print("🚫 已达到最大重试次数，连接失败")
-                raise e
-        except Exception as e:
-            print(f"❌ 其他数据库错误: {e}")
-            raise e
-    
-    return None
-
-# 打印配置信息（用于调试，生产环境中应该移除密码打印）
-print("🔧 数据库配置:")
-print(f"  Host: {DB_CONFIG['host']}")
-print(f"  Port: {DB_CONFIG['port']}")
-print(f"  Database: {DB_CONFIG['database']}")
-print(f"  User: {DB_CONFIG['user']}")
-print(f"  Password: {'***已设置***' if DB_CONFIG['password'] else '❌未设置'}")
-print(f"🔑 ModelScope API Key: {'✅已设置' if MODELSCOPE_API_KEY else '❌未设置'}")
-print(f"🔑 BFL API Key: {'✅已设置' if BFL_API_KEY else '❌未设置'}")
-
-# 启动时测试数据库连接
-print("\n🚀 启动时测试数据库连接...")
-try:
-    test_conn = get_db_connection_with_retry(max_retries=3, retry_delay=1)
-    if test_conn:
-        test_conn.close()
-        print("✅ 数据库启动连接测试成功")
-except Exception as e:
-    print(f"⚠️ 数据库启动连接测试失败: {e}")
-    print("📝 应用将继续启动，但数据库功能可能不可用") 
\ No newline at end of file
+    try:
+        conn = db_pool.get_connection(DB_CONFIG, retries=max_retries, retry_delay=retry_delay)
+        return conn
+    except psycopg2.OperationalError as e:
+        print(f"🚫 数据库连接失败 (已重试{max_retries}次): {e}")
+        raise e
+    except Exception as e:
+        print(f"❌ 其他数据库错误: {e}")
+        raise e
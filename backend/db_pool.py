@@ -0,0 +1,331 @@
+#!/usr/bin/env python3
+"""
+PostgreSQL连接池
+所有路由和后台线程共享的有界、线程安全连接池
+"""
+
+import os
+import time
+import atexit
+import logging
+import threading
+from collections import deque
+
+import psycopg2
+from psycopg2.pool import PoolError
+
+logger = logging.getLogger(__name__)
+
+# 连接池配置
+POOL_CONFIG = {
+    'minconn': int(os.getenv('DB_POOL_MIN', '1')),
+    'maxconn': int(os.getenv('DB_POOL_MAX', '10')),
+    'acquire_timeout': float(os.getenv('DB_POOL_TIMEOUT', '10')),
+    'max_lifetime': float(os.getenv('DB_POOL_MAX_LIFETIME', '1800')),
+    'health_check_interval': float(os.getenv('DB_POOL_HEALTH_CHECK_INTERVAL', '30')),
+    'connect_retries': int(os.getenv('DB_POOL_CONNECT_RETRIES', '3')),
+    'connect_retry_delay': float(os.getenv('DB_POOL_CONNECT_RETRY_DELAY', '1')),
+}
+
+
+class PoolExhaustedError(PoolError):
+    """连接池在超时时间内没有可用连接"""
+
+
+class PooledConnection:
+    """
+    借出的连接
+    除close()外其余属性都代理到psycopg2连接，close()会把连接归还连接池，
+    因此原有的 conn.close() 写法无需修改
+    """
+
+    def __init__(self, pool, raw, created_at):
+        self._pool = pool
+        self._raw = raw
+        self._created_at = created_at
+        self._returned = False
+
+    def __getattr__(self, name):
+        raw = self.__dict__.get('_raw')
+        if raw is None:
+            raise AttributeError(name)
+        return getattr(raw, name)
+
+    def __enter__(self):
+        self._raw.__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return self._raw.__exit__(exc_type, exc_value, traceback)
+
+    def close(self):
+        """归还连接"""
+        if self._returned:
+            return
+        self._returned = True
+        self._pool.putconn(self._raw, self._created_at)
+
+    def discard(self):
+        """连接已损坏，关闭而不归还"""
+        if self._returned:
+            return
+        self._returned = True
+        self._pool.putconn(self._raw, self._created_at, discard=True)
+
+    def __del__(self):
+        # 兜底：调用方忘记close()时也把名额还给连接池
+        if '_raw' not in self.__dict__:
+            return
+        try:
+            self.close()
+        except Exception:
+            pass
+
+
+class ConnectionPool:
+    """有界连接池，带健康检查、最大存活时间回收和耗尽统计"""
+
+    def __init__(self, db_config, minconn=1, maxconn=10, acquire_timeout=10,
+                 max_lifetime=1800, health_check_interval=30,
+                 connect_retries=3, connect_retry_delay=1):
+        if maxconn < 1 or minconn > maxconn:
+            raise ValueError('连接池大小配置无效')
+        self.db_config = dict(db_config)
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.acquire_timeout = acquire_timeout
+        self.max_lifetime = max_lifetime
+        self.health_check_interval = health_check_interval
+        self.connect_retries = connect_retries
+        self.connect_retry_delay = connect_retry_delay
+
+        self._cond = threading.Condition()
+        self._idle = deque()  # (raw, created_at, last_used)
+        self._in_use = 0
+        self._closed = False
+        self._pid = os.getpid()
+        self._stats = {
+            'connections_created': 0,
+            'connections_closed': 0,
+            'checkouts': 0,
+            'reused': 0,
+            'recycled_max_lifetime': 0,
+            'health_check_failures': 0,
+            'waits': 0,
+            'exhausted': 0,
+            'max_in_use': 0,
+        }
+
+    # ---- 内部方法 ----
+
+    def _connect(self, retries=None, retry_delay=None):
+        """新建物理连接（沿用原有的重试逻辑）"""
+        retries = self.connect_retries if retries is None else retries
+        retry_delay = self.connect_retry_delay if retry_delay is None else retry_delay
+        for attempt in range(retries):
+            try:
+                raw = psycopg2.connect(**self.db_config)
+                with self._cond:
+                    self._stats['connections_created'] += 1
+                return raw, time.monotonic()
+            except psycopg2.OperationalError as e:
+                logger.warning(f"数据库连接失败 (第{attempt + 1}次): {e}")
+                if attempt < retries - 1:
+                    time.sleep(retry_delay)
+                else:
+                    raise
+
+    def _close_raw(self, raw):
+        try:
+            raw.close()
+        except Exception:
+            pass
+        with self._cond:
+            self._stats['connections_closed'] += 1
+
+    def _check_fork(self):
+        """fork后子进程不能复用父进程的socket，直接丢弃继承来的连接"""
+        if self._pid != os.getpid():
+            with self._cond:
+                if self._pid != os.getpid():
+                    self._idle.clear()
+                    self._in_use = 0
+                    self._closed = False
+                    self._pid = os.getpid()
+
+    def _is_healthy(self, raw, created_at, last_used):
+        now = time.monotonic()
+        if raw.closed:
+            return False
+        if self.max_lifetime and now - created_at > self.max_lifetime:
+            with self._cond:
+                self._stats['recycled_max_lifetime'] += 1
+            return False
+        if self.health_check_interval and now - last_used > self.health_check_interval:
+            try:
+                cursor = raw.cursor()
+                cursor.execute('SELECT 1')
+                cursor.close()
+                raw.rollback()
+            except Exception as e:
+                logger.warning(f"⚠️ 连接健康检查失败，丢弃连接: {e}")
+                with self._cond:
+                    self._stats['health_check_failures'] += 1
+                return False
+        return True
+
+    # ---- 公共接口 ----
+
+    def getconn(self, timeout=None, retries=None, retry_delay=None):
+        """借出一个连接，超时抛出PoolExhaustedError"""
+        self._check_fork()
+        timeout = self.acquire_timeout if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+
+        with self._cond:
+            if self._closed:
+                raise PoolError('连接池已关闭')
+            waited = False
+            while not self._idle and self._in_use >= self.maxconn:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._stats['exhausted'] += 1
+                    logger.error(f"❌ 连接池耗尽 ({self._in_use}/{self.maxconn} 使用中)")
+                    raise PoolExhaustedError('数据库连接池已耗尽')
+                if not waited:
+                    self._stats['waits'] += 1
+                    waited = True
+                self._cond.wait(remaining)
+                if self._closed:
+                    raise PoolError('连接池已关闭')
+
+            self._in_use += 1
+            self._stats['checkouts'] += 1
+            self._stats['max_in_use'] = max(self._stats['max_in_use'], self._in_use)
+            entry = self._idle.pop() if self._idle else None
+
+        try:
+            if entry is not None:
+                raw, created_at, last_used = entry
+                if self._is_healthy(raw, created_at, last_used):
+                    with self._cond:
+                        self._stats['reused'] += 1
+                    return PooledConnection(self, raw, created_at)
+                self._close_raw(raw)
+                # 名额保留，重新建立连接
+            raw, created_at = self._connect(retries, retry_delay)
+            return PooledConnection(self, raw, created_at)
+        except Exception:
+            with self._cond:
+                self._in_use -= 1
+                self._cond.notify()
+            raise
+
+    def putconn(self, raw, created_at, discard=False):
+        """归还连接，未提交的事务会被回滚"""
+        if self._pid != os.getpid():
+            return
+        keep = not discard and not raw.closed
+        if keep:
+            try:
+                if raw.status != psycopg2.extensions.STATUS_READY:
+                    raw.rollback()
+            except Exception:
+                keep = False
+        if keep and self.max_lifetime and time.monotonic() - created_at > self.max_lifetime:
+            keep = False
+            with self._cond:
+                self._stats['recycled_max_lifetime'] += 1
+
+        with self._cond:
+            self._in_use = max(0, self._in_use - 1)
+            if keep and not self._closed:
+                self._idle.append((raw, created_at, time.monotonic()))
+                raw = None
+            self._cond.notify()
+        if raw is not None:
+            self._close_raw(raw)
+
+    def prefill(self):
+        """预先建立minconn个连接"""
+        self._check_fork()
+        while True:
+            with self._cond:
+                if len(self._idle) + self._in_use >= self.minconn:
+                    return
+            raw, created_at = self._connect()
+            with self._cond:
+                self._idle.append((raw, created_at, time.monotonic()))
+
+    def closeall(self):
+        """关闭连接池（进程退出时调用）"""
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            idle = list(self._idle)
+            self._idle.clear()
+            self._cond.notify_all()
+        if self._pid != os.getpid():
+            return
+        for raw, _, _ in idle:
+            self._close_raw(raw)
+        logger.info(f"🔌 数据库连接池已关闭，释放 {len(idle)} 个空闲连接")
+
+    def stats(self):
+        """连接池指标"""
+        with self._cond:
+            data = dict(self._stats)
+            data.update({
+                'in_use': self._in_use,
+                'idle': len(self._idle),
+                'maxconn': self.maxconn,
+                'minconn': self.minconn,
+                'closed': self._closed,
+            })
+        return data
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def _pool_key(db_config):
+    return tuple(sorted((k, str(v)) for k, v in db_config.items()))
+
+
+def get_pool(db_config):
+    """按数据库配置获取（或创建）进程内共享的连接池"""
+    key = _pool_key(db_config)
+    pool = _pools.get(key)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(key)
+            if pool is None:
+                pool = ConnectionPool(db_config, **POOL_CONFIG)
+                _pools[key] = pool
+    return pool
+
+
+def get_connection(db_config, timeout=None, retries=None, retry_delay=None):
+    """从共享连接池借出连接，用完调用 conn.close() 归还"""
+    return get_pool(db_config).getconn(timeout=timeout, retries=retries, retry_delay=retry_delay)
+
+
+def pool_stats():
+    """所有连接池的指标"""
+    with _pools_lock:
+        pools = list(_pools.values())
+    return [dict(pool.stats(), host=pool.db_config.get('host'),
+                 database=pool.db_config.get('database')) for pool in pools]
+
+
+def close_all_pools():
+    """关闭所有连接池"""
+    with _pools_lock:
+        pools = list(_pools.values())
+    for pool in pools:
+        pool.closeall()
+
+
+atexit.register(close_all_pools)
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+生成任务去重
+同一张（规范化后的）图片用同样的提示词、seed、比例和背景生成，结果是一样的；
+用户超时后重新上传时直接复用已完成的结果，或者挂到正在进行的生成上，不再重复调用BFL
+"""
+
+import os
+import hashlib
+import logging
+
+logger = logging.getLogger(__name__)
+
+DEDUP_ENABLED = os.getenv('GENERATION_DEDUP_ENABLED', 'true').lower() == 'true'
+
+# 去重键的索引 (索引名, 定义)，由迁移用CREATE INDEX CONCURRENTLY创建
+DEDUP_INDEXES = [
+    ('idx_images_dedup_key', 'ON images (dedup_key) WHERE dedup_key IS NOT NULL'),
+]
+
+
+# 去重查询（app.py和async_app.py共用，异步应用经async_db.asyncpg_query转换占位符）
+DEDUP_LOCK_SQL = "SELECT pg_advisory_xact_lock(hashtext(%s))"
+FIND_DUPLICATE_SQL = '''
+    SELECT id, status FROM images
+    WHERE dedup_key = %s AND status IN ('completed', 'processing')
+    ORDER BY status = 'completed' DESC, id DESC
+    LIMIT 1
+'''
+
+
+def init_dedup_schema(cursor):
+    """为images增加去重键（在迁移中调用）"""
+    cursor.execute("ALTER TABLE images ADD COLUMN IF NOT EXISTS dedup_key VARCHAR(64)")
+
+
+def generation_dedup_key(kind, input_key, prompt, seed, aspect_ratio, background_key=None):
+    """
+    去重键：输入图片的内容哈希 + 提示词模板 + seed + 比例（照相馆照片还包括当前背景）
+    """
+    digest = hashlib.sha256()
+    for part in (kind, input_key, hashlib.sha256(prompt.encode('utf-8')).hexdigest(),
+                 str(seed), aspect_ratio, background_key or ''):
+        digest.update(part.encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+def find_duplicate_generation(cursor, dedup_key):
+    """
+    在调用方的事务中查找相同的生成，优先返回已完成的，其次是进行中的
+    返回 (image_id, status)，没有时返回None；
+    会持有该去重键的事务级advisory锁直到提交，同时到达的相同上传只会有一个创建新任务
+    """
+    if not DEDUP_ENABLED:
+        return None
+    cursor.execute(DEDUP_LOCK_SQL, (dedup_key,))
+    cursor.execute(FIND_DUPLICATE_SQL, (dedup_key,))
+    return duplicate_generation(cursor.fetchone())
+
+
+def duplicate_generation(row):
+    """FIND_DUPLICATE_SQL的结果转换为 (image_id, status)，没有时返回None"""
+    if not row:
+        return None
+    logger.info(f"♻️ 命中相同的生成任务: 图片 {row[0]}（{row[1]}）")
+    return row[0], row[1]
+
+
+def duplicate_generation_data(duplicate, normalized):
+    """复用已有生成时的上传响应内容，客户端按返回的image_id继续查询状态"""
+    image_id, status = duplicate
+    if status == 'completed':
+        message = '相同的图片已经生成过，直接返回已有结果'
+    else:
+        message = '相同的图片正在生成中，已关联到进行中的任务'
+    return {
+        'success': True,
+        'image_id': image_id,
+        'message': message,
+        'deduplicated': True,
+        'status': status,
+        'normalization': normalized.summary()
+    }
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""
+本地模拟的BFL服务，用于不消耗额度地测试提交、轮询、完成回调和下载
+提交后 --delay 秒任务完成，请求中带webhook_url时按BFL_WEBHOOK_SECRET签名后POST回调，
+/stats 统计每个任务收到的请求数（开启回调时应只有提交和下载，没有或只有一次兜底轮询）：
+    python fake_bfl.py --port 9100 --delay 3
+    BFL_API_URL=http://127.0.0.1:9100/v1/flux-kontext-max BFL_WEBHOOK_SECRET=dev \\
+        WEBHOOK_PUBLIC_URL=http://127.0.0.1:5001 python start_server.py
+    python fake_bfl.py --drop-webhooks 0.5   # 随机丢弃一半回调，测试兜底轮询
+"""
+
+import io
+import json
+import time
+import uuid
+import random
+import argparse
+import threading
+
+import requests
+from flask import Flask, request, jsonify, send_file
+from PIL import Image
+
+from webhooks import sign_payload, WEBHOOK_CONFIG
+
+app = Flask(__name__)
+
+# 运行参数，main()按命令行覆盖
+SETTINGS = {'delay': 3.0, 'drop_webhooks': 0.0, 'fail_rate': 0.0, 'base_url': 'http://127.0.0.1:9100'}
+
+_lock = threading.Lock()
+_tasks = {}
+
+def task_view(task):
+    """轮询响应和回调内容，和BFL的格式相同"""
+    if task['status'] == 'Ready':
+        return {'id': task['id'], 'task_id': task['id'], 'status': 'Ready',
+                'result': {'sample': f"{SETTINGS['base_url']}/samples/{task['id']}.jpg"}}
+    return {'id': task['id'], 'task_id': task['id'], 'status': task['status']}
+
+def complete_task(task_id):
+    """到期后结束任务，需要时发送回调"""
+    with _lock:
+        task = _tasks[task_id]
+        task['status'] = 'Error' if random.random() < SETTINGS['fail_rate'] else 'Ready'
+        webhook_url, secret = task['webhook_url'], task['webhook_secret']
+    if not webhook_url:
+        return
+    if random.random() < SETTINGS['drop_webhooks']:
+        print(f"🗑️ 丢弃任务 {task_id} 的回调")
+        return
+    body = json.dumps(task_view(task)).encode('utf-8')
+    try:
+        response = requests.post(webhook_url, data=body, timeout=30, headers={
+            'Content-Type': 'application/json',
+            WEBHOOK_CONFIG['signature_header']: sign_payload(body, secret),
+        })
+        print(f"📨 任务 {task_id} 回调 {webhook_url}: {response.status_code}")
+    except requests.RequestException as e:
+        print(f"❌ 任务 {task_id} 回调失败: {e}")
+    with _lock:
+        task['webhooks'] += 1
+
+@app.route('/v1/<model>', methods=['POST'])
+def submit(model):
+    payload = request.get_json(silent=True) or {}
+    if not payload.get('prompt'):
+        return jsonify({'detail': 'prompt is required'}), 422
+    task_id = uuid.uuid4().hex
+    with _lock:
+        _tasks[task_id] = {
+            'id': task_id, 'model': model, 'status': 'Pending', 'submitted_at': time.time(),
+            'webhook_url': payload.get('webhook_url'), 'webhook_secret': payload.get('webhook_secret'),
+            'polls': 0, 'downloads': 0, 'webhooks': 0,
+        }
+    threading.Timer(SETTINGS['delay'], complete_task, args=(task_id,)).start()
+    return jsonify({'id': task_id, 'polling_url': f"{SETTINGS['base_url']}/v1/get_result?id={task_id}"})
+
+@app.route('/v1/get_result', methods=['GET'])
+def get_result():
+    with _lock:
+        task = _tasks.get(request.args.get('id'))
+        if task is None:
+            return jsonify({'status': 'Task not found'}), 404
+        task['polls'] += 1
+        return jsonify(task_view(task))
+
+@app.route('/samples/<task_id>.jpg', methods=['GET'])
+def sample(task_id):
+    with _lock:
+        task = _tasks.get(task_id)
+        if task is None or task['status'] != 'Ready':
+            return jsonify({'detail': 'not found'}), 404
+        task['downloads'] += 1
+    # 每个任务一张不同颜色的图片
+    color = tuple(int(task_id[i:i + 2], 16) for i in (0, 2, 4))
+    buffer = io.BytesIO()
+    Image.new('RGB', (1024, 768), color).save(buffer, format='JPEG', quality=90)
+    buffer.seek(0)
+    return send_file(buffer, mimetype='image/jpeg')
+
+@app.route('/stats', methods=['GET'])
+def stats():
+    with _lock:
+        tasks = [dict(task, webhook_secret=None) for task in _tasks.values()]
+    return jsonify({
+        'tasks': len(tasks),
+        'polls': sum(task['polls'] for task in tasks),
+        'downloads': sum(task['downloads'] for task in tasks),
+        'webhooks': sum(task['webhooks'] for task in tasks),
+        'by_task': tasks,
+    })
+
+def main():
+    """主函数"""
+    parser = argparse.ArgumentParser(description='本地模拟的BFL服务')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=9100)
+    parser.add_argument('--delay', type=float, default=3, help='任务完成需要的秒数')
+    parser.add_argument('--drop-webhooks', type=float, default=0, help='丢弃回调的比例（0-1）')
+    parser.add_argument('--fail-rate', type=float, default=0, help='任务失败的比例（0-1）')
+    args = parser.parse_args()
+
+    SETTINGS.update(delay=args.delay, drop_webhooks=args.drop_webhooks, fail_rate=args.fail_rate,
+                    base_url=f'http://{args.host}:{args.port}')
+    print(f"🧪 模拟BFL服务: {SETTINGS['base_url']}/v1/flux-kontext-max（任务 {args.delay:.0f} 秒后完成）")
+    app.run(host=args.host, port=args.port, threaded=True)
+
+if __name__ == '__main__':
+    main()
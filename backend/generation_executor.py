@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+"""
+AI生成任务执行器
+固定数量的工作线程 + 有界队列，取代每次上传新建一个线程
+"""
+
+import os
+import time
+import queue
+import atexit
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+# 执行器配置
+EXECUTOR_CONFIG = {
+    'max_workers': int(os.getenv('GENERATION_WORKERS', '4')),
+    'max_queue_size': int(os.getenv('GENERATION_QUEUE_SIZE', '32')),
+    'retry_after': int(os.getenv('GENERATION_RETRY_AFTER', '30')),
+}
+
+# 向BFL提交新任务的速率限制（所有生成任务共享）
+SUBMIT_RATE_CONFIG = {
+    'rate': float(os.getenv('BFL_SUBMIT_RATE', '2')),
+    'burst': int(os.getenv('BFL_SUBMIT_BURST', '4')),
+}
+
+_STOP = object()
+
+
+class QueueFullError(Exception):
+    """生成队列已满"""
+
+    def __init__(self, retry_after):
+        super().__init__('生成队列已满，请稍后重试')
+        self.retry_after = retry_after
+
+
+class GenerationExecutor:
+    """有界的后台生成任务执行器"""
+
+    def __init__(self, max_workers=4, max_queue_size=32, retry_after=30, name='generation'):
+        if max_workers < 1 or max_queue_size < 1:
+            raise ValueError('执行器配置无效')
+        self.max_workers = max_workers
+        self.max_queue_size = max_queue_size
+        self.retry_after = retry_after
+        self.name = name
+
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        self._lock = threading.Lock()
+        self._threads = []
+        self._pid = None
+        self._shutdown = False
+        self._in_flight = 0
+        self._stats = {
+            'submitted': 0,
+            'completed': 0,
+            'errors': 0,
+            'rejected': 0,
+        }
+
+    def _ensure_workers(self):
+        """首次提交时才启动工作线程（fork后的子进程会重新启动）"""
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._queue = queue.Queue(maxsize=self.max_queue_size)
+            self._in_flight = 0
+            self._threads = []
+            for i in range(self.max_workers):
+                thread = threading.Thread(
+                    target=self._worker, name=f'{self.name}-worker-{i}', daemon=True
+                )
+                thread.start()
+                self._threads.append(thread)
+            self._pid = os.getpid()
+            logger.info(f"🧵 {self.name}执行器已启动: {self.max_workers}个工作线程，队列上限{self.max_queue_size}")
+
+    def _worker(self):
+        work_queue = self._queue
+        while True:
+            item = work_queue.get()
+            if item is _STOP:
+                work_queue.task_done()
+                return
+            fn, args, kwargs = item
+            with self._lock:
+                self._in_flight += 1
+            try:
+                fn(*args, **kwargs)
+                with self._lock:
+                    self._stats['completed'] += 1
+            except Exception as e:
+                logger.error(f"❌ 后台任务 {getattr(fn, '__name__', fn)} 异常: {e}")
+                with self._lock:
+                    self._stats['errors'] += 1
+            finally:
+                with self._lock:
+                    self._in_flight -= 1
+                work_queue.task_done()
+
+    def submit(self, fn, *args, **kwargs):
+        """提交任务，队列已满时抛出QueueFullError"""
+        if self._shutdown:
+            raise RuntimeError('执行器已关闭')
+        self._ensure_workers()
+        try:
+            self._queue.put_nowait((fn, args, kwargs))
+        except queue.Full:
+            with self._lock:
+                self._stats['rejected'] += 1
+            logger.warning(f"⚠️ {self.name}队列已满 ({self.max_queue_size})，拒绝新任务")
+            raise QueueFullError(self.retry_after)
+        with self._lock:
+            self._stats['submitted'] += 1
+
+    def has_capacity(self, count=1):
+        """队列是否还能放下count个任务（仅作提示，提交时仍可能被拒绝）"""
+        return self._queue.qsize() + count <= self.max_queue_size
+
+    def available_slots(self):
+        """空闲工作线程数（扣除已排队的任务）"""
+        if self._pid != os.getpid():
+            return self.max_workers
+        with self._lock:
+            return max(0, self.max_workers - self._in_flight - self._queue.qsize())
+
+    def shutdown(self, wait=False):
+        """停止接收新任务并通知工作线程退出"""
+        if self._shutdown:
+            return
+        self._shutdown = True
+        if self._pid != os.getpid():
+            return
+        for _ in self._threads:
+            try:
+                self._queue.put_nowait(_STOP)
+            except queue.Full:
+                break
+        if wait:
+            for thread in self._threads:
+                thread.join()
+
+    def stats(self):
+        """执行器指标"""
+        with self._lock:
+            data = dict(self._stats)
+            data.update({
+                'queue_depth': self._queue.qsize() if self._pid == os.getpid() else 0,
+                'in_flight': self._in_flight if self._pid == os.getpid() else 0,
+                'max_workers': self.max_workers,
+                'max_queue_size': self.max_queue_size,
+            })
+        return data
+
+
+class RateLimiter:
+    """令牌桶：平均每秒rate次，最多连续burst次"""
+
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+        self._stats = {'acquired': 0, 'waited_ms_total': 0.0}
+
+    def acquire(self):
+        """取得一个令牌，必要时阻塞等待，返回等待的秒数"""
+        if self.rate <= 0:
+            return 0
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    self._stats['acquired'] += 1
+                    self._stats['waited_ms_total'] += waited * 1000
+                    return waited
+                delay = (1 - self._tokens) / self.rate
+            time.sleep(delay)
+            waited += delay
+
+    def stats(self):
+        with self._lock:
+            data = dict(self._stats, rate=self.rate, burst=self.burst)
+        data['waited_ms_total'] = round(data['waited_ms_total'], 1)
+        return data
+
+
+generation_executor = GenerationExecutor(**EXECUTOR_CONFIG)
+bfl_submit_limiter = RateLimiter(**SUBMIT_RATE_CONFIG)
+
+atexit.register(generation_executor.shutdown)
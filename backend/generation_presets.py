@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+"""
+各类生成的提示词和参数
+同步应用（app.py）和异步应用（async_app.py）共用，参数变化后去重键也随之变化
+"""
+
+from job_queue import JOB_KIND_STUDIO, JOB_KIND_MEMORY_PHOTO
+from dedup import generation_dedup_key
+
+# 强调沿用照相馆风格的提示词
+STUDIO_PROMPT = """Create an anime-style pet memorial photo by combining the pet from the first image with the studio setting from the second image.
+        
+        Task: Place the anime-stylized pet sitting on the wooden chair in the exact same studio environment as shown in the background image.
+        
+        Requirements:
+        - Keep the EXACT same studio layout, lighting, and atmosphere from the background image
+        - Transform the pet into cute anime/cartoon style while maintaining its original characteristics  
+        - The pet should sit calmly on the wooden chair, looking towards the camera
+        - Preserve the warm golden lighting and cozy photography studio atmosphere
+        - Maintain the camera, tripod, and all studio elements in their original positions
+        - Style: Anime illustration with soft colors and heartwarming mood
+        - Output format: 9:20 aspect ratio for mobile app background
+        
+        请将第一张图片中的宠物与第二张图片中的照相馆场景结合，创造温馨的动漫风格纪念照。
+        保持照相馆的原有风格和布局，让动漫化的宠物自然地坐在椅子上等待拍照。
+        沿用照相馆的温暖色调、灯光效果和整体氛围。"""
+
+# 记忆照片风格化提示词
+MEMORY_PHOTO_PROMPT = """Transform this photo into a warm, anime-style illustration with the same cozy atmosphere as a pet photography studio.
+
+Requirements:
+- Convert to soft anime/cartoon art style
+- Maintain warm golden lighting and gentle atmosphere
+- Keep all objects and details recognizable but stylized
+- Use soft pastels and warm colors
+- Create a heartwarming, memorial-like mood
+- Style should match pet photography studio ambiance
+- Output format: suitable for mobile app display
+
+将这张照片转换成温馨的动漫风格插画，保持与宠物照相馆相同的舒适氛围。
+使用柔和的动漫风格，温暖的色调，营造治愈系的纪念氛围。"""
+
+# 各类生成的提示词和参数
+GENERATION_PRESETS = {
+    JOB_KIND_STUDIO: {
+        'prompt': STUDIO_PROMPT,
+        'seed': 42,
+        'aspect_ratio': '9:20',  # 接近402*874的比例，适合iPhone16Pro
+    },
+    JOB_KIND_MEMORY_PHOTO: {
+        'prompt': MEMORY_PHOTO_PROMPT,
+        'seed': 42,
+        'aspect_ratio': '1:1',  # 记忆照片使用1:1比例
+    },
+}
+
+
+def preset_dedup_key(kind, input_key, background_key=None):
+    """按当前提示词和参数计算去重键，照相馆照片还需要传入当前背景的key"""
+    preset = GENERATION_PRESETS[kind]
+    return generation_dedup_key(
+        kind, input_key, preset['prompt'], preset['seed'], preset['aspect_ratio'], background_key
+    )
@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+"""
+gunicorn配置（生产环境启动方式，替代Flask开发服务器的app.run）
+    cd backend && gunicorn -c gunicorn.conf.py app:app
+    gunicorn -c backend/gunicorn.conf.py app:app        # 根目录入口
+
+服务主要在等待PostgreSQL和BFL，默认使用gthread（每个进程多个线程），进程数按CPU核数计算；
+preload_app在主进程中导入一次应用再fork，导入时不连接数据库（见create_app），
+连接池、规范化进程池、通知监听和执行器线程都按进程号延迟创建，每个worker进程各自重建
+"""
+
+import os
+import multiprocessing
+
+_cpus = multiprocessing.cpu_count()
+
+bind = os.getenv('GUNICORN_BIND', f"0.0.0.0:{os.getenv('PORT', '8080')}")
+
+# SSE和长轮询会占用线程，线程数决定每个进程能同时保持的连接数
+worker_class = os.getenv('GUNICORN_WORKER_CLASS', 'gthread')
+workers = int(os.getenv('WEB_CONCURRENCY', str(min(_cpus * 2 + 1, 8))))
+threads = int(os.getenv('GUNICORN_THREADS', '8'))
+
+preload_app = os.getenv('GUNICORN_PRELOAD', 'true').lower() == 'true'
+
+# 前面有负载均衡时保持连接，减少握手
+keepalive = int(os.getenv('GUNICORN_KEEPALIVE', '5'))
+
+# 处理一定数量的请求后平滑重启worker（加随机量避免同时重启），回收泄漏的内存
+max_requests = int(os.getenv('GUNICORN_MAX_REQUESTS', '2000'))
+max_requests_jitter = int(os.getenv('GUNICORN_MAX_REQUESTS_JITTER', '200'))
+graceful_timeout = int(os.getenv('GUNICORN_GRACEFUL_TIMEOUT', '30'))
+timeout = int(os.getenv('GUNICORN_TIMEOUT', '120'))
+
+# 设为空字符串时关闭访问日志
+accesslog = os.getenv('GUNICORN_ACCESS_LOG', '-') or None
+errorlog = '-'
+
+
+def _background_services(worker):
+    """应用通过 app.extensions['background_services'] 提供的 (启动, 停止) 函数"""
+    application = getattr(worker, 'wsgi', None)
+    return getattr(application, 'extensions', {}).get('background_services')
+
+
+def post_worker_init(worker):
+    """worker进程启动后立即启动任务调度，不等第一个请求"""
+    services = _background_services(worker)
+    if services:
+        services[0]()
+
+
+def worker_exit(server, worker):
+    """worker退出（包括max_requests回收）时停止调度和轮询，未完成的任务释放给其他进程"""
+    services = _background_services(worker)
+    if services:
+        services[1]()
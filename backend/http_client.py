@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+"""
+共享的出站HTTP客户端
+所有对BFL / ModelScope的提交和生成图片的下载都经过这里：
+每个进程一个保持连接的Session（按主机复用连接池），明确的连接 / 读取超时，
+幂等请求在网络错误和429 / 5xx时带随机抖动的指数退避重试，并按接口记录延迟
+"""
+
+import os
+import time
+import atexit
+import random
+import logging
+import threading
+from collections import deque
+from urllib.parse import urlsplit
+from email.utils import parsedate_to_datetime
+
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+# 客户端配置
+HTTP_CLIENT_CONFIG = {
+    'connect_timeout': float(os.getenv('HTTP_CONNECT_TIMEOUT', '5')),
+    'read_timeout': float(os.getenv('HTTP_READ_TIMEOUT', '60')),
+    'max_retries': int(os.getenv('HTTP_MAX_RETRIES', '3')),
+    'backoff_base': float(os.getenv('HTTP_RETRY_BACKOFF', '0.5')),
+    'backoff_max': float(os.getenv('HTTP_RETRY_BACKOFF_MAX', '10')),
+    # 每个主机保持的连接数（同一时刻访问同一主机的线程数超过时会新建连接，用完不保留）
+    'pool_maxsize': int(os.getenv('HTTP_POOL_MAXSIZE', '10')),
+    'pool_hosts': int(os.getenv('HTTP_POOL_HOSTS', '10')),
+}
+
+# 重发不会产生副作用的方法
+IDEMPOTENT_METHODS = frozenset({'GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'})
+
+# 值得重试的响应状态
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+
+# 每个接口保留的最近延迟样本数（用于计算分位数）
+LATENCY_SAMPLES = 256
+
+
+class EndpointStats:
+    """按接口名统计的请求数、错误数、重试数和延迟（线程安全）"""
+
+    def __init__(self, samples=LATENCY_SAMPLES):
+        self.samples = samples
+        self._lock = threading.Lock()
+        self._endpoints = {}
+
+    def record(self, endpoint, elapsed_ms, ok=True, retries=0, status=None):
+        with self._lock:
+            entry = self._endpoints.get(endpoint)
+            if entry is None:
+                entry = self._endpoints[endpoint] = {
+                    'requests': 0, 'errors': 0, 'retries': 0, 'last_status': None,
+                    'latency_ms_total': 0.0, 'latency_ms_max': 0.0, 'recent': deque(maxlen=self.samples),
+                }
+            entry['requests'] += 1
+            entry['retries'] += retries
+            if not ok:
+                entry['errors'] += 1
+            entry['last_status'] = status
+            entry['latency_ms_total'] += elapsed_ms
+            entry['latency_ms_max'] = max(entry['latency_ms_max'], elapsed_ms)
+            entry['recent'].append(elapsed_ms)
+
+    def stats(self):
+        with self._lock:
+            endpoints = {name: dict(entry, recent=sorted(entry['recent'])) for name, entry in self._endpoints.items()}
+        result = {}
+        for name, entry in endpoints.items():
+            recent = entry.pop('recent')
+            total = entry.pop('latency_ms_total')
+            entry['latency_ms_avg'] = round(total / entry['requests'], 1)
+            entry['latency_ms_max'] = round(entry['latency_ms_max'], 1)
+            for pct in (50, 95, 99):
+                entry[f'latency_ms_p{pct}'] = round(recent[min(len(recent) - 1, len(recent) * pct // 100)], 1)
+            result[name] = entry
+        return result
+
+
+def retry_after_seconds(response):
+    """解析Retry-After（秒数或HTTP日期），没有或无法解析时返回None"""
+    value = response.headers.get('Retry-After')
+    if not value:
+        return None
+    try:
+        return max(float(value), 0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0)
+    except (TypeError, ValueError):
+        return None
+
+
+class HttpClient:
+    """保持连接的HTTP客户端，Session按进程号延迟创建，fork后的子进程各自重建"""
+
+    def __init__(self, connect_timeout=5, read_timeout=60, max_retries=3, backoff_base=0.5,
+                 backoff_max=10, pool_maxsize=10, pool_hosts=10, endpoint_stats=None):
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.pool_maxsize = pool_maxsize
+        self.pool_hosts = pool_hosts
+        self.endpoint_stats = endpoint_stats or EndpointStats()
+        self._lock = threading.Lock()
+        self._session = None
+        self._pid = None
+
+    def _get_session(self):
+        if self._pid == os.getpid():
+            return self._session
+        with self._lock:
+            if self._pid != os.getpid():
+                session = requests.Session()
+                # 重试由request()按方法和状态决定，urllib3本身不重试
+                adapter = HTTPAdapter(pool_connections=self.pool_hosts, pool_maxsize=self.pool_maxsize, max_retries=0)
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                self._session = session
+                self._pid = os.getpid()
+        return self._session
+
+    def backoff(self, attempt):
+        """第attempt次重试前的等待时间（full jitter）"""
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    def request(self, method, url, endpoint=None, retry=None, timeout=None, **kwargs):
+        """
+        发送请求，返回requests.Response（不会因为HTTP状态码抛出异常）
+        endpoint为统计用的接口名，默认取主机名；retry默认只对幂等方法开启，
+        连接阶段超时（请求还没有发出）时任何方法都会重试；用完stream=True的响应需要调用close()
+        """
+        method = method.upper()
+        endpoint = endpoint or urlsplit(url).netloc
+        if retry is None:
+            retry = method in IDEMPOTENT_METHODS
+        timeout = timeout or (self.connect_timeout, self.read_timeout)
+        session = self._get_session()
+
+        started = time.monotonic()
+        attempt = 0
+        while True:
+            try:
+                response = session.request(method, url, timeout=timeout, **kwargs)
+            except requests.RequestException as e:
+                can_retry = retry or isinstance(e, requests.ConnectTimeout)
+                if not can_retry or attempt >= self.max_retries:
+                    self.endpoint_stats.record(endpoint, (time.monotonic() - started) * 1000, ok=False, retries=attempt)
+                    raise
+                delay = self.backoff(attempt)
+                logger.warning(f"⚠️ {endpoint} 请求失败，{delay:.1f}秒后重试（第 {attempt + 1} 次）: {e}")
+            else:
+                if not (retry and response.status_code in RETRY_STATUSES and attempt < self.max_retries):
+                    self.endpoint_stats.record(
+                        endpoint, (time.monotonic() - started) * 1000,
+                        ok=response.status_code < 400, retries=attempt, status=response.status_code
+                    )
+                    return response
+                delay = min(retry_after_seconds(response) or self.backoff(attempt), self.backoff_max)
+                logger.warning(f"⚠️ {endpoint} 返回 {response.status_code}，{delay:.1f}秒后重试（第 {attempt + 1} 次）")
+                response.close()
+            time.sleep(delay)
+            attempt += 1
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def head(self, url, **kwargs):
+        return self.request('HEAD', url, **kwargs)
+
+    def close(self):
+        if self._session is not None and self._pid == os.getpid():
+            self._session.close()
+
+    def stats(self):
+        return {
+            'endpoints': self.endpoint_stats.stats(),
+            'connect_timeout': self.connect_timeout,
+            'read_timeout': self.read_timeout,
+            'max_retries': self.max_retries,
+        }
+
+
+http_client = HttpClient(**HTTP_CLIENT_CONFIG)
+
+atexit.register(http_client.close)
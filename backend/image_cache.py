@@ -0,0 +1,273 @@
+#!/usr/bin/env python3
+"""
+进程内图片缓存
+按字节预算淘汰的LRU缓存，用于照相馆背景这类每次生成都会被读取、但很少变化的图片；
+缓存内容附带预先计算好的ETag，命中时不需要访问数据库和存储
+"""
+
+import io
+import os
+import time
+import asyncio
+import logging
+import threading
+from collections import OrderedDict
+
+from PIL import Image
+
+from blob_store import content_etag
+
+logger = logging.getLogger(__name__)
+
+# 缓存配置
+IMAGE_CACHE_CONFIG = {
+    'max_bytes': int(os.getenv('IMAGE_CACHE_MAX_BYTES', str(32 * 1024 * 1024))),
+    # 兜底过期时间：数据库通知丢失时，最多这么久后重新读取
+    'studio_ttl': float(os.getenv('STUDIO_BACKGROUND_CACHE_TTL', '300')),
+    'studio_widths': [
+        int(width) for width in os.getenv('STUDIO_BACKGROUND_WIDTHS', '402,804,1206').split(',') if width.strip()
+    ],
+}
+
+# 照相馆背景变化时发送的数据库通知频道
+STUDIO_BACKGROUND_CHANNEL = 'studio_background_changed'
+
+# 当前照相馆背景（尚未迁移的旧数据直接读取BYTEA），返回 (key, 旧数据, 创建时间, content_type)；
+# app.py和async_app.py共用，异步应用经async_db.asyncpg_query转换
+ACTIVE_STUDIO_BACKGROUND_SQL = (
+    "SELECT s.blob_key, CASE WHEN s.blob_key IS NULL THEN s.image_data END, s.created_at, b.content_type "
+    "FROM studio_backgrounds s LEFT JOIN blobs b ON b.key = s.blob_key "
+    "WHERE s.is_active = true LIMIT 1"
+)
+
+
+class CachedImage:
+    """一张缓存的图片，blob_key为存储中的key（尚未迁移的旧数据为None）"""
+
+    def __init__(self, data, etag, last_modified=None, content_type='image/jpeg', blob_key=None):
+        self.data = data
+        self.etag = etag
+        self.blob_key = blob_key
+        self.last_modified = last_modified
+        self.content_type = content_type
+        self.loaded_at = time.monotonic()
+
+    @property
+    def size(self):
+        return len(self.data)
+
+
+def studio_background_entry(row, read_blob):
+    """
+    按ACTIVE_STUDIO_BACKGROUND_SQL的结果创建缓存条目，没有背景时返回None
+    read_blob(key)读取存储中的内容（会阻塞，异步应用在线程池中调用本函数）
+    """
+    if not row or not (row[0] or row[1]):
+        return None
+    blob_key, legacy_data, created_at, content_type = row
+    data = read_blob(blob_key) if blob_key else bytes(legacy_data)
+    logger.info(f"🖼️ 照相馆背景已载入缓存，大小: {len(data)} bytes")
+    return CachedImage(
+        data, content_etag(blob_key, data), last_modified=created_at,
+        content_type=content_type or 'image/jpeg', blob_key=blob_key
+    )
+
+
+class ByteLRUCache:
+    """线程安全的LRU缓存，按内容总字节数而不是条目数限制大小"""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._stats['misses'] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._stats['hits'] += 1
+            return entry
+
+    def peek(self, key):
+        """读取但不更新LRU顺序和命中统计"""
+        with self._lock:
+            return self._entries.get(key)
+
+    def put(self, key, entry):
+        """写入缓存，单个条目超过预算时不缓存并返回False"""
+        if entry.size > self.max_bytes:
+            return False
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old.size
+            self._entries[key] = entry
+            self._bytes += entry.size
+            while self._bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= evicted.size
+                self._stats['evictions'] += 1
+        return True
+
+    def put_many(self, entries):
+        """在同一次加锁中写入多个条目（读者不会只看到其中一部分），返回写入的数量"""
+        entries = {key: entry for key, entry in entries.items() if entry.size <= self.max_bytes}
+        with self._lock:
+            for key, entry in entries.items():
+                old = self._entries.pop(key, None)
+                if old is not None:
+                    self._bytes -= old.size
+                self._entries[key] = entry
+                self._bytes += entry.size
+            while self._bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= evicted.size
+                self._stats['evictions'] += 1
+        return len(entries)
+
+    def invalidate(self, prefix=''):
+        """删除key以prefix开头的条目，返回删除的数量"""
+        with self._lock:
+            keys = [key for key in self._entries if key.startswith(prefix)]
+            for key in keys:
+                self._bytes -= self._entries.pop(key).size
+            return len(keys)
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, entries=len(self._entries), bytes=self._bytes, max_bytes=self.max_bytes)
+
+
+def resize_widths(data, widths, quality=85):
+    """
+    按宽度等比缩小，重新编码为渐进式JPEG（原图不比目标宽时只重新编码）
+    只解码一次，返回 {宽度: JPEG字节}
+    """
+    source = Image.open(io.BytesIO(data))
+    if source.mode != 'RGB':
+        source = source.convert('RGB')
+    results = {}
+    for width in widths:
+        image = source
+        if source.width > width:
+            height = max(1, round(source.height * width / source.width))
+            image = source.resize((width, height), Image.LANCZOS)
+        output = io.BytesIO()
+        image.save(output, format='JPEG', quality=quality, optimize=True, progressive=True)
+        results[width] = output.getvalue()
+    return results
+
+
+class StudioBackgroundCache:
+    """
+    当前照相馆背景及其缩放版本的缓存
+    loader() 返回当前背景的CachedImage（没有背景时返回None）；回源时一次生成widths中的所有缩放版本，
+    和原图一起写入缓存，请求某个宽度时不会在加载锁内再单独缩放；
+    背景被替换时调用invalidate()，其他进程通过数据库通知得到同样的调用
+    """
+
+    PREFIX = 'studio:'
+
+    def __init__(self, cache, loader, ttl=300, widths=()):
+        self.cache = cache
+        self.loader = loader
+        self.ttl = ttl
+        self.widths = set(widths)
+        self._load_lock = threading.Lock()
+        self._generation = 0
+
+    def _fresh(self, key, peek=False):
+        entry = self.cache.peek(key) if peek else self.cache.get(key)
+        if entry is not None and time.monotonic() - entry.loaded_at < self.ttl:
+            return entry
+        return None
+
+    def _key(self, width=None):
+        return f"{self.PREFIX}{width or 'full'}"
+
+    def _widths_for(self, width):
+        """回源时要生成的宽度（不在配置中的宽度也按需生成）"""
+        return sorted(self.widths | ({width} if width else set()))
+
+    def _variants(self, full, resized):
+        """原图和各宽度版本的缓存条目，和原图一起过期"""
+        entries = {self._key(): full}
+        for width, data in resized.items():
+            entry = CachedImage(data, f"{full.etag}-w{width}", last_modified=full.last_modified)
+            entry.loaded_at = full.loaded_at
+            entries[self._key(width)] = entry
+        return entries
+
+    def _publish(self, generation, entries):
+        # 回源期间背景被替换时不写入旧内容
+        if generation == self._generation:
+            self.cache.put_many(entries)
+
+    def get(self, width=None):
+        """返回原图或指定宽度的缩放版本"""
+        key = self._key(width)
+        entry = self._fresh(key)
+        if entry is not None:
+            return entry
+
+        # 同一时刻只有一个线程回源，其余线程等待后直接命中
+        with self._load_lock:
+            entry = self._fresh(key, peek=True)
+            if entry is not None:
+                return entry
+            generation = self._generation
+
+            # 缩放版本被LRU淘汰而原图还在时，从缓存的原图重新生成
+            full = self._fresh(self._key(), peek=True) or self.loader()
+            if full is None:
+                return None
+            entries = self._variants(full, resize_widths(full.data, self._widths_for(width)))
+            self._publish(generation, entries)
+            return entries[key]
+
+    def invalidate(self, payload=None):
+        """背景已被替换"""
+        self._generation += 1
+        dropped = self.cache.invalidate(self.PREFIX)
+        if dropped:
+            logger.info(f"🧹 照相馆背景缓存已失效（{dropped} 项）")
+
+
+class AsyncStudioBackgroundCache(StudioBackgroundCache):
+    """
+    asyncio版本（async_app.py使用）：loader为协程，缩放在线程池中执行，不阻塞事件循环
+    invalidate()沿用同步版本，在事件循环中由数据库通知调用
+    """
+
+    def __init__(self, cache, loader, ttl=300, widths=()):
+        super().__init__(cache, loader, ttl=ttl, widths=widths)
+        self._load_lock = asyncio.Lock()
+
+    async def get(self, width=None):
+        """返回原图或指定宽度的缩放版本"""
+        key = self._key(width)
+        entry = self._fresh(key)
+        if entry is not None:
+            return entry
+
+        # 同一时刻只有一个协程回源，其余协程等待后直接命中
+        async with self._load_lock:
+            entry = self._fresh(key, peek=True)
+            if entry is not None:
+                return entry
+            generation = self._generation
+
+            full = self._fresh(self._key(), peek=True) or await self.loader()
+            if full is None:
+                return None
+            resized = await asyncio.get_running_loop().run_in_executor(
+                None, resize_widths, full.data, self._widths_for(width)
+            )
+            entries = self._variants(full, resized)
+            self._publish(generation, entries)
+            return entries[key]
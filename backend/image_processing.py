@@ -0,0 +1,268 @@
+#!/usr/bin/env python3
+"""
+上传图片规范化
+校验格式、按EXIF方向旋转、缩小到模型需要的尺寸、去掉元数据并重新编码为渐进式JPEG/WebP；
+解码和编码是CPU密集型操作，放到独立的进程池中执行，不占用请求线程的GIL
+"""
+
+import io
+import os
+import atexit
+import logging
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from PIL import Image, ImageOps, UnidentifiedImageError, features
+
+logger = logging.getLogger(__name__)
+
+# 规范化配置
+NORMALIZE_CONFIG = {
+    # 模型输入用到的1:1和9:20比例，长边1024已经足够
+    'max_edge': int(os.getenv('IMAGE_MAX_EDGE', '1024')),
+    'output_format': os.getenv('IMAGE_OUTPUT_FORMAT', 'jpeg').lower(),
+    'quality': int(os.getenv('IMAGE_QUALITY', '85')),
+    'max_pixels': int(os.getenv('IMAGE_MAX_PIXELS', str(50 * 1000 * 1000))),
+    'workers': int(os.getenv('IMAGE_NORMALIZE_WORKERS', '2')),
+    'timeout': float(os.getenv('IMAGE_NORMALIZE_TIMEOUT', '30')),
+    # 进程池在请求线程里创建，此时进程中已有轮询、调度等线程，fork可能复制到被其他线程持有的锁，
+    # 所以默认用forkserver（不支持时用spawn）；子进程会以__mp_main__重新导入入口脚本，
+    # 入口脚本的启动逻辑要放在 if __name__ == '__main__' 下（app.py / start_server.py / worker.py 都是如此）
+    'start_method': os.getenv('IMAGE_NORMALIZE_START_METHOD', 'forkserver'),
+}
+
+# 接受的输入格式（HEIC需要安装pillow-heif）
+ALLOWED_FORMATS = {'JPEG', 'MPO', 'PNG', 'WEBP', 'HEIF', 'GIF', 'BMP', 'TIFF'}
+
+OUTPUT_FORMATS = {
+    'jpeg': ('JPEG', 'image/jpeg'),
+    'webp': ('WEBP', 'image/webp'),
+}
+# AVIF需要Pillow 11.3+ 且编译了libavif
+if features.check('avif'):
+    OUTPUT_FORMATS['avif'] = ('AVIF', 'image/avif')
+
+try:
+    from pillow_heif import register_heif_opener
+    register_heif_opener()
+except ImportError:
+    pass
+
+
+class InvalidImageError(ValueError):
+    """上传的内容不是支持的图片"""
+
+
+class NormalizedImage:
+    """规范化的结果"""
+
+    def __init__(self, data, width, height, content_type, original_size, original_format):
+        self.data = data
+        self.width = width
+        self.height = height
+        self.content_type = content_type
+        self.original_size = original_size
+        self.original_format = original_format
+
+    @property
+    def size(self):
+        return len(self.data)
+
+    @property
+    def bytes_saved(self):
+        return self.original_size - self.size
+
+    def summary(self):
+        """上传接口返回给客户端的统计"""
+        return {
+            'original_bytes': self.original_size,
+            'stored_bytes': self.size,
+            'bytes_saved': self.bytes_saved,
+            'width': self.width,
+            'height': self.height,
+            'original_format': self.original_format,
+        }
+
+
+def normalize_image(source, max_edge=1024, output_format='jpeg', quality=85, max_pixels=None):
+    """
+    在当前进程中规范化一张图片，source为图片字节或文件路径
+    返回 (编码后的字节, 宽, 高, content_type, 原格式)，内容不是支持的图片时抛出InvalidImageError
+    """
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError(f"不支持的输出格式: {output_format}")
+    content_type = OUTPUT_FORMATS[output_format][1]
+    if max_pixels:
+        Image.MAX_IMAGE_PIXELS = max_pixels
+
+    try:
+        image = Image.open(io.BytesIO(source) if isinstance(source, bytes) else source)
+        source_format = image.format
+        if source_format not in ALLOWED_FORMATS:
+            raise InvalidImageError(f"不支持的图片格式: {source_format}")
+        # 按EXIF方向旋转（手机照片通常横着存、靠Orientation标记显示）
+        image = ImageOps.exif_transpose(image)
+        image.load()
+    except InvalidImageError:
+        raise
+    except UnidentifiedImageError:
+        raise InvalidImageError("无法识别的图片内容")
+    except (Image.DecompressionBombError, OSError, SyntaxError) as e:
+        raise InvalidImageError(f"无法识别的图片: {e}")
+
+    if image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info):
+        # 透明区域铺白底
+        image = image.convert('RGBA')
+        background = Image.new('RGB', image.size, (255, 255, 255))
+        background.paste(image, mask=image.split()[-1])
+        image = background
+    elif image.mode != 'RGB':
+        image = image.convert('RGB')
+
+    image.thumbnail((max_edge, max_edge), Image.LANCZOS)
+
+    # 重新编码时不传exif / icc_profile，元数据（包括GPS）全部丢弃
+    return encode_image(image, output_format, quality), image.width, image.height, content_type, source_format
+
+
+def encode_image(image, output_format, quality=85):
+    """把RGB图片编码为指定格式（JPEG为渐进式）"""
+    pil_format = OUTPUT_FORMATS[output_format][0]
+    output = io.BytesIO()
+    if pil_format == 'JPEG':
+        image.save(output, format='JPEG', quality=quality, optimize=True, progressive=True)
+    elif pil_format == 'WEBP':
+        image.save(output, format='WEBP', quality=quality, method=4)
+    else:
+        image.save(output, format=pil_format, quality=quality)
+    return output.getvalue()
+
+
+def render_renditions(source, sizes, formats, quality=80):
+    """
+    为一张图片（字节或文件路径）生成各尺寸、各格式的版本
+    sizes为 {名称: 最长边}，最长边为None表示原尺寸；原尺寸JPEG就是原图本身，不重复生成
+    返回 [(尺寸名, 格式, 字节, 宽, 高, content_type)]
+    """
+    source = Image.open(io.BytesIO(source) if isinstance(source, bytes) else source)
+    source = ImageOps.exif_transpose(source)
+    if source.mode != 'RGB':
+        source = source.convert('RGB')
+
+    results = []
+    for size_name, max_edge in sizes.items():
+        image = source.copy()
+        if max_edge:
+            image.thumbnail((max_edge, max_edge), Image.LANCZOS)
+        for output_format in formats:
+            if max_edge is None and output_format == 'jpeg':
+                continue
+            results.append((
+                size_name, output_format, encode_image(image, output_format, quality),
+                image.width, image.height, OUTPUT_FORMATS[output_format][1]
+            ))
+    return results
+
+
+class ImageNormalizer:
+    """进程池包装，延迟创建，fork后的子进程会重新创建"""
+
+    def __init__(self, max_edge=1024, output_format='jpeg', quality=85, max_pixels=None,
+                 workers=2, timeout=30, start_method='forkserver'):
+        self.max_edge = max_edge
+        self.output_format = output_format
+        self.quality = quality
+        self.max_pixels = max_pixels
+        self.workers = workers
+        self.timeout = timeout
+        self.start_method = start_method
+        self._lock = threading.Lock()
+        self._pool = None
+        self._pid = None
+        self._stats = {'normalized': 0, 'rejected': 0, 'bytes_in': 0, 'bytes_out': 0}
+
+    def _get_pool(self):
+        if self._pid == os.getpid():
+            return self._pool
+        with self._lock:
+            if self._pid != os.getpid():
+                start_method = self.start_method
+                if start_method not in multiprocessing.get_all_start_methods():
+                    start_method = 'spawn'
+                context = multiprocessing.get_context(start_method)
+                if start_method == 'forkserver':
+                    # 服务进程预先导入PIL和本模块，每个子进程不再重复导入
+                    context.set_forkserver_preload([__name__])
+                self._pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=context)
+                self._pid = os.getpid()
+                logger.info(f"🧮 图片规范化进程池已启动，{self.workers} 个进程")
+        return self._pool
+
+    def _submit(self, source, max_edge=None):
+        return self._get_pool().submit(
+            normalize_image, source, max_edge or self.max_edge,
+            self.output_format, self.quality, self.max_pixels
+        )
+
+    def _collect(self, source, future):
+        original_size = len(source) if isinstance(source, bytes) else os.path.getsize(source)
+        try:
+            encoded, width, height, content_type, source_format = future.result(timeout=self.timeout)
+        except InvalidImageError:
+            with self._lock:
+                self._stats['rejected'] += 1
+            raise
+
+        result = NormalizedImage(encoded, width, height, content_type, original_size, source_format)
+        with self._lock:
+            self._stats['normalized'] += 1
+            self._stats['bytes_in'] += result.original_size
+            self._stats['bytes_out'] += result.size
+        logger.info(
+            f"🪄 图片已规范化: {source_format} {result.original_size} bytes -> "
+            f"{width}x{height} {result.size} bytes（节省 {result.bytes_saved} bytes）"
+        )
+        return result
+
+    def normalize(self, source, max_edge=None):
+        """规范化上传的图片（字节或文件路径），返回NormalizedImage"""
+        return self._collect(source, self._submit(source, max_edge))
+
+    def normalize_many(self, sources, max_edge=None):
+        """
+        并行规范化多张图片，返回的列表顺序和sources一致
+        任意一张无法处理时抛出InvalidImageError（消息中带序号）
+        """
+        futures = [self._submit(source, max_edge) for source in sources]
+        results = []
+        try:
+            for index, (source, future) in enumerate(zip(sources, futures)):
+                try:
+                    results.append(self._collect(source, future))
+                except InvalidImageError as e:
+                    raise InvalidImageError(f"第 {index + 1} 张: {e}") from e
+        finally:
+            for future in futures:
+                future.cancel()
+        return results
+
+    def render(self, source, sizes, formats, quality=80):
+        """在进程池中生成缩略图等版本（字节或文件路径），见render_renditions"""
+        future = self._get_pool().submit(render_renditions, source, sizes, formats, quality)
+        return future.result(timeout=self.timeout)
+
+    def shutdown(self):
+        if self._pool is not None and self._pid == os.getpid():
+            self._pool.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self):
+        with self._lock:
+            data = dict(self._stats)
+        data['bytes_saved'] = data['bytes_in'] - data['bytes_out']
+        return data
+
+
+image_normalizer = ImageNormalizer(**NORMALIZE_CONFIG)
+
+atexit.register(image_normalizer.shutdown)
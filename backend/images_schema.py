@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+images表的状态查询索引
+状态查询只需要status和是否已生成：has_generated在保存生成图片时和generated_key一起写入，
+覆盖索引 (id) INCLUDE (status, has_generated) 让 /status 走index-only scan，不读取行数据，
+也不会碰到旧BYTEA列的TOAST数据；进行中任务的运维查询走部分索引
+"""
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+# 状态查询读取的列（不涉及图片内容）
+STATUS_COLUMNS = "id, status, has_generated"
+
+# 以下SQL由app.py和async_app.py共用，异步应用经async_db.asyncpg_query转换占位符
+# 一次查询多张图片的状态
+STATUS_QUERY = f"SELECT {STATUS_COLUMNS} FROM images WHERE id = ANY(%s::int[])"
+
+INSERT_IMAGE_SQL = "INSERT INTO images (original_key, status, dedup_key) VALUES (%s, %s, %s) RETURNING id"
+
+# /image/<id> 读取图片的key（尚未迁移的旧数据才读取BYTEA），返回 (key, 旧数据, 创建时间, content_type)
+IMAGE_CONTENT_QUERIES = {
+    'original': (
+        "SELECT i.original_key, CASE WHEN i.original_key IS NULL THEN i.original_image END, "
+        "COALESCE(b.created_at, i.created_at), b.content_type "
+        "FROM images i LEFT JOIN blobs b ON b.key = i.original_key WHERE i.id = %s"
+    ),
+    'generated': (
+        "SELECT i.generated_key, CASE WHEN i.generated_key IS NULL THEN i.generated_image END, "
+        "b.created_at, b.content_type "
+        "FROM images i LEFT JOIN blobs b ON b.key = i.generated_key WHERE i.id = %s"
+    ),
+}
+
+# 状态查询的索引 (索引名, 定义)，由迁移用CREATE INDEX CONCURRENTLY创建，不阻塞写入
+STATUS_INDEXES = [
+    # 覆盖索引：按ID查询状态时不需要回表
+    ('idx_images_status_lookup', 'ON images (id) INCLUDE (status, has_generated)'),
+    # "所有进行中的任务"按创建时间排列，只索引进行中的少量行
+    ('idx_images_processing', "ON images (created_at) WHERE status = 'processing'"),
+]
+
+
+def init_images_schema(cursor):
+    """
+    为images增加has_generated列（在迁移中、init_blob_schema之后调用）
+    带常量默认值的普通列只修改元数据（PG11+），不重写表、不长时间持有锁；
+    已有的行由下一个迁移backfill_has_generated分批回填
+    """
+    cursor.execute("ALTER TABLE images ADD COLUMN IF NOT EXISTS has_generated BOOLEAN NOT NULL DEFAULT false")
+
+
+def backfill_has_generated(cursor, batch_size=1000):
+    """
+    按id分批回填已有生成图片的行（online迁移，autocommit下每批单独提交，只短时间锁住一批行）
+    可以重复执行：已回填的行不再更新；返回更新的行数
+    """
+    last_id = 0
+    updated = 0
+    while True:
+        cursor.execute(
+            '''
+            UPDATE images SET has_generated = true
+            WHERE id IN (
+                SELECT id FROM images
+                WHERE id > %s AND NOT has_generated
+                  AND (generated_key IS NOT NULL OR generated_image IS NOT NULL)
+                ORDER BY id LIMIT %s
+            )
+            RETURNING id
+            ''',
+            (last_id, batch_size)
+        )
+        ids = [row[0] for row in cursor.fetchall()]
+        if not ids:
+            break
+        last_id = max(ids)
+        updated += len(ids)
+        logger.info(f"  ✏️ has_generated: 已回填 {updated} 行，最后ID {last_id}")
+    return updated
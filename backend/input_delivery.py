@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+生成服务的输入图片交付方式
+以前总是把 {PUBLIC_URL}/image/<id> 交给BFL，由BFL回头请求我们的服务再读一次存储；
+现在按生成服务分别配置（<PROVIDER>_INPUT_DELIVERY）：
+    inline  已规范化的图片直接以base64放进请求，不需要公网可访问的PUBLIC_URL
+    signed  短期有效的签名地址：S3存储使用预签名URL，本地存储使用 /blob/<key>?expires=&sig=
+    public  原来的公开地址（兼容旧行为）
+"""
+
+import os
+import hmac
+import time
+import base64
+import hashlib
+import logging
+import threading
+
+from blob_store import get_blob_store
+
+logger = logging.getLogger(__name__)
+
+DELIVERY_INLINE = 'inline'
+DELIVERY_SIGNED = 'signed'
+DELIVERY_PUBLIC = 'public'
+DELIVERY_MODES = (DELIVERY_INLINE, DELIVERY_SIGNED, DELIVERY_PUBLIC)
+
+# 交付配置，各生成服务的方式由 <PROVIDER>_INPUT_DELIVERY 指定（例如BFL_INPUT_DELIVERY）
+INPUT_DELIVERY_CONFIG = {
+    'default_mode': os.getenv('INPUT_DELIVERY', DELIVERY_INLINE),
+    'url_ttl': int(os.getenv('INPUT_URL_TTL', '900')),
+    # 本地存储的签名地址需要所有进程使用相同的密钥
+    'url_secret': os.getenv('INPUT_URL_SECRET'),
+    'public_url': os.getenv('PUBLIC_URL', 'https://petecho.zeabur.app'),
+}
+
+_stats_lock = threading.Lock()
+_stats = {mode: 0 for mode in DELIVERY_MODES}
+_stats['inline_bytes'] = 0
+
+
+def delivery_mode(provider):
+    """生成服务使用的交付方式，配置无效时使用inline"""
+    mode = os.getenv(f"{provider.upper()}_INPUT_DELIVERY", INPUT_DELIVERY_CONFIG['default_mode']).lower()
+    if mode not in DELIVERY_MODES:
+        logger.warning(f"⚠️ 未知的输入图片交付方式 {mode}，使用inline")
+        return DELIVERY_INLINE
+    return mode
+
+
+def blob_signature(key, expires):
+    """签名地址的HMAC-SHA256签名"""
+    message = f"{key}:{expires}".encode('ascii')
+    return hmac.new(INPUT_DELIVERY_CONFIG['url_secret'].encode('utf-8'), message, hashlib.sha256).hexdigest()
+
+
+def verify_blob_signature(key, expires, signature):
+    """校验 /blob/<key> 的签名和有效期"""
+    if not INPUT_DELIVERY_CONFIG['url_secret'] or not expires or not signature:
+        return False
+    try:
+        if int(expires) < time.time():
+            return False
+    except ValueError:
+        return False
+    return hmac.compare_digest(blob_signature(key, expires), signature)
+
+
+def signed_blob_url(key, ttl=None):
+    """短期有效的blob地址，没有可用的签名方式时返回None"""
+    ttl = ttl or INPUT_DELIVERY_CONFIG['url_ttl']
+    presigned = get_blob_store().presigned_url(key, ttl)
+    if presigned:
+        return presigned
+    if not INPUT_DELIVERY_CONFIG['url_secret']:
+        return None
+    expires = int(time.time()) + ttl
+    return f"{INPUT_DELIVERY_CONFIG['public_url']}/blob/{key}?expires={expires}&sig={blob_signature(key, expires)}"
+
+
+def _count(mode, size=0):
+    with _stats_lock:
+        _stats[mode] += 1
+        _stats['inline_bytes'] += size
+
+
+def input_image_reference(provider, blob_key=None, data=None, public_path=None):
+    """
+    返回放进生成请求的图片引用（base64字符串或URL）
+    data为已在内存中的内容（例如缓存的照相馆背景），inline时优先使用，否则从存储读取；
+    signed无法签名（旧数据没有blob key、本地存储未设置INPUT_URL_SECRET）时退回公开地址
+    """
+    mode = delivery_mode(provider)
+    if mode == DELIVERY_INLINE and (data is not None or blob_key):
+        if data is None:
+            data = get_blob_store().get(blob_key)
+        _count(DELIVERY_INLINE, len(data))
+        return base64.b64encode(data).decode('ascii')
+    if mode == DELIVERY_SIGNED and blob_key:
+        url = signed_blob_url(blob_key)
+        if url:
+            _count(DELIVERY_SIGNED)
+            return url
+        logger.warning("⚠️ 本地存储未设置INPUT_URL_SECRET，无法生成签名地址，改用公开地址")
+    _count(DELIVERY_PUBLIC)
+    return f"{INPUT_DELIVERY_CONFIG['public_url']}{public_path}"
+
+
+def describe_reference(reference):
+    """日志用的简短描述，不输出base64内容和签名"""
+    if reference.startswith(('http://', 'https://')):
+        return reference.split('?', 1)[0]
+    return f"base64 {len(reference)} 字符"
+
+
+def delivery_stats():
+    with _stats_lock:
+        return dict(_stats)
@@ -0,0 +1,447 @@
+#!/usr/bin/env python3
+"""
+持久化的生成任务队列
+任务记录在PostgreSQL的generation_jobs表中，进程重启后可以继续，
+多个进程通过 SELECT ... FOR UPDATE SKIP LOCKED 领取任务
+"""
+
+import os
+import socket
+import logging
+import threading
+
+from psycopg2.extras import RealDictCursor, execute_values
+
+from generation_executor import QueueFullError
+
+logger = logging.getLogger(__name__)
+
+# 任务类型
+JOB_KIND_STUDIO = 'studio_photo'
+JOB_KIND_MEMORY_PHOTO = 'memory_photo'
+
+# 任务状态
+JOB_QUEUED = 'queued'        # 尚未提交给BFL
+JOB_SUBMITTED = 'submitted'  # 已提交，等待轮询
+JOB_COMPLETING = 'completing'  # 已收到结果（回调或轮询），正在下载保存
+JOB_DONE = 'done'            # 已结束（成功或失败以images.status为准）
+
+# 队列配置
+JOB_QUEUE_CONFIG = {
+    'lease_seconds': int(os.getenv('JOB_LEASE_SECONDS', '300')),
+    'poll_interval': int(os.getenv('JOB_POLL_INTERVAL', '5')),
+    'max_poll_attempts': int(os.getenv('JOB_MAX_POLL_ATTEMPTS', '60')),
+    'max_errors': int(os.getenv('JOB_MAX_ERRORS', '5')),
+}
+DISPATCH_INTERVAL = float(os.getenv('JOB_DISPATCH_INTERVAL', '1'))
+
+
+def worker_id():
+    """当前进程的标识，记录在locked_by中便于排查"""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def init_job_table(cursor):
+    """创建任务表（在迁移中调用）"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS generation_jobs (
+            id SERIAL PRIMARY KEY,
+            image_id INTEGER NOT NULL REFERENCES images(id) ON DELETE CASCADE,
+            kind VARCHAR(32) NOT NULL,
+            photo_index INTEGER,
+            state VARCHAR(16) NOT NULL DEFAULT 'queued',
+            bfl_task_id TEXT,
+            polling_url TEXT,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            errors INTEGER NOT NULL DEFAULT 0,
+            last_error TEXT,
+            next_poll_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            locked_by TEXT,
+            locked_until TIMESTAMP,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_generation_jobs_due
+        ON generation_jobs (next_poll_at) WHERE state <> 'done'
+    ''')
+
+
+def init_job_poll_deadline(cursor):
+    """
+    记录任务的轮询截止时间（在迁移中调用）
+    提交时写入，之后进程重启或任务被重新领取都按同一个截止时间计算剩余的轮询时间
+    """
+    cursor.execute("ALTER TABLE generation_jobs ADD COLUMN IF NOT EXISTS poll_deadline TIMESTAMP")
+
+
+class JobQueue:
+    """generation_jobs表的读写操作"""
+
+    def __init__(self, get_connection, lease_seconds=300, poll_interval=5,
+                 max_poll_attempts=60, max_errors=5):
+        self.get_connection = get_connection
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+        self.max_poll_attempts = max_poll_attempts
+        self.max_errors = max_errors
+
+    @property
+    def poll_budget(self):
+        """提交后最多轮询多久（秒）"""
+        return self.max_poll_attempts * self.poll_interval
+
+    def remaining_poll_seconds(self, job):
+        """
+        已提交任务剩余的轮询时间（秒），按数据库中的截止时间计算，至少再轮询一次
+        刚提交、还没有截止时间的任务使用完整的预算
+        """
+        remaining = job.get('poll_remaining')
+        if remaining is None:
+            remaining = self.poll_budget
+        return max(float(remaining), self.poll_interval)
+
+    def enqueue(self, cursor, image_id, kind, photo_index=None, lease=True):
+        """
+        在调用方的事务中创建任务，和images插入一起提交
+        lease=True时任务直接由当前进程持有，避免被其他进程重复领取
+        """
+        cursor.execute(
+            '''
+            INSERT INTO generation_jobs (image_id, kind, photo_index, locked_by, locked_until)
+            VALUES (%s, %s, %s, %s,
+                    CASE WHEN %s THEN CURRENT_TIMESTAMP + %s * INTERVAL '1 second' END)
+            RETURNING id, image_id, kind, photo_index, state, bfl_task_id, polling_url, attempts, errors
+            ''',
+            (image_id, kind, photo_index, worker_id() if lease else None, lease, self.lease_seconds)
+        )
+        row = cursor.fetchone()
+        columns = [desc[0] for desc in cursor.description]
+        return dict(zip(columns, row))
+
+    def enqueue_many(self, cursor, items, lease=True):
+        """
+        在调用方的事务中用一条多行INSERT创建多个任务
+        items为 [(image_id, kind, photo_index)]，返回的任务顺序和items一致
+        """
+        if not items:
+            return []
+        owner = worker_id() if lease else None
+        rows = execute_values(
+            cursor,
+            '''
+            INSERT INTO generation_jobs (image_id, kind, photo_index, locked_by, locked_until)
+            VALUES %s
+            RETURNING id, image_id, kind, photo_index, state, bfl_task_id, polling_url, attempts, errors
+            ''',
+            [(image_id, kind, photo_index, owner, lease, self.lease_seconds)
+             for image_id, kind, photo_index in items],
+            template="(%s, %s, %s, %s, CASE WHEN %s THEN CURRENT_TIMESTAMP + %s * INTERVAL '1 second' END)",
+            fetch=True
+        )
+        columns = [desc[0] for desc in cursor.description]
+        jobs = {row[1]: dict(zip(columns, row)) for row in rows}
+        return [jobs[image_id] for image_id, _, _ in items]
+
+    def claim_due(self, limit):
+        """领取到期且未被持有的任务"""
+        if limit <= 0:
+            return []
+        conn = self.get_connection()
+        if not conn:
+            return []
+        try:
+            cursor = conn.cursor(cursor_factory=RealDictCursor)
+            cursor.execute(
+                '''
+                UPDATE generation_jobs SET
+                    locked_by = %s,
+                    locked_until = CURRENT_TIMESTAMP + %s * INTERVAL '1 second',
+                    -- 截止时间列加入之前提交的任务，按已轮询的次数补上截止时间
+                    poll_deadline = COALESCE(poll_deadline, CASE WHEN polling_url IS NOT NULL THEN
+                        CURRENT_TIMESTAMP + GREATEST(%s - attempts, 1) * %s * INTERVAL '1 second' END),
+                    updated_at = CURRENT_TIMESTAMP
+                WHERE id IN (
+                    SELECT id FROM generation_jobs
+                    WHERE state <> 'done'
+                      AND next_poll_at <= CURRENT_TIMESTAMP
+                      AND (locked_until IS NULL OR locked_until < CURRENT_TIMESTAMP)
+                    ORDER BY next_poll_at
+                    LIMIT %s
+                    FOR UPDATE SKIP LOCKED
+                )
+                RETURNING id, image_id, kind, photo_index, state, bfl_task_id, polling_url, attempts, errors,
+                          EXTRACT(EPOCH FROM poll_deadline - CURRENT_TIMESTAMP) AS poll_remaining
+                ''',
+                (worker_id(), self.lease_seconds, self.max_poll_attempts, self.poll_interval, limit)
+            )
+            jobs = [dict(row) for row in cursor.fetchall()]
+            conn.commit()
+            cursor.close()
+            return jobs
+        finally:
+            conn.close()
+
+    def _update(self, job_id, sql, params):
+        """执行一条更新，返回更新的行数（数据库不可用时为0）"""
+        conn = self.get_connection()
+        if not conn:
+            logger.error(f"❌ 数据库连接失败，无法更新任务 {job_id}")
+            return 0
+        try:
+            cursor = conn.cursor()
+            cursor.execute(sql, params + (job_id,))
+            updated = cursor.rowcount
+            conn.commit()
+            cursor.close()
+            return updated
+        finally:
+            conn.close()
+
+    def mark_submitted(self, job_id, task_id, polling_url, keep_lease=False):
+        """
+        已提交给BFL，安排第一次轮询
+        keep_lease=True时由当前进程继续持有（交给进程内的轮询器），否则释放给任意进程领取；
+        返回False表示完成回调已经先到达并领取了结果处理（state不再是queued），调用方不需要再轮询
+        """
+        if self._update(
+            job_id,
+            '''
+            UPDATE generation_jobs SET
+                state = 'submitted', bfl_task_id = %s, polling_url = %s,
+                next_poll_at = CURRENT_TIMESTAMP + %s * INTERVAL '1 second',
+                poll_deadline = CURRENT_TIMESTAMP + %s * INTERVAL '1 second',
+                locked_by = CASE WHEN %s THEN locked_by END,
+                locked_until = CASE WHEN %s THEN CURRENT_TIMESTAMP + %s * INTERVAL '1 second' END,
+                updated_at = CURRENT_TIMESTAMP
+            WHERE id = %s AND state = 'queued'
+            ''',
+            (task_id, polling_url, self.poll_interval, self.poll_budget,
+             keep_lease, keep_lease, self.lease_seconds)
+        ):
+            return True
+        # 不改变状态和租约，只补上轮询地址：处理结果的进程退出后，任务被重新领取时可以轮询而不是重新提交
+        self._update(
+            job_id,
+            '''
+            UPDATE generation_jobs SET
+                bfl_task_id = COALESCE(bfl_task_id, %s), polling_url = COALESCE(polling_url, %s),
+                poll_deadline = COALESCE(poll_deadline, CURRENT_TIMESTAMP + %s * INTERVAL '1 second'),
+                updated_at = CURRENT_TIMESTAMP
+            WHERE id = %s AND state <> 'done'
+            ''',
+            (task_id, polling_url, self.poll_budget)
+        )
+        return False
+
+    def claim_completion(self, job_id, task_id=None):
+        """
+        领取任务的结果处理，回调和轮询同时收到结果时只有一方下载保存
+        处理中的进程退出后租约到期，任务会被重新领取并由轮询完成；
+        返回任务记录，已结束或正由其他进程处理时返回None
+        """
+        conn = self.get_connection()
+        if not conn:
+            raise RuntimeError('数据库连接失败')
+        try:
+            cursor = conn.cursor(cursor_factory=RealDictCursor)
+            cursor.execute(
+                '''
+                UPDATE generation_jobs SET
+                    state = 'completing', bfl_task_id = COALESCE(bfl_task_id, %s),
+                    locked_by = %s,
+                    locked_until = CURRENT_TIMESTAMP + %s * INTERVAL '1 second',
+                    updated_at = CURRENT_TIMESTAMP
+                WHERE id = %s AND state <> 'done'
+                  -- 同一进程的轮询线程和回调请求也只能有一方领取
+                  AND (state <> 'completing' OR locked_until IS NULL OR locked_until < CURRENT_TIMESTAMP)
+                RETURNING id, image_id, kind, photo_index, state, bfl_task_id, polling_url, attempts, errors
+                ''',
+                (task_id, worker_id(), self.lease_seconds, job_id)
+            )
+            row = cursor.fetchone()
+            conn.commit()
+            cursor.close()
+            return dict(row) if row else None
+        finally:
+            conn.close()
+
+    def extend_leases(self, job_ids):
+        """续租当前进程仍在处理的任务"""
+        if not job_ids:
+            return
+        conn = self.get_connection()
+        if not conn:
+            return
+        try:
+            cursor = conn.cursor()
+            cursor.execute(
+                '''
+                UPDATE generation_jobs SET
+                    locked_until = CURRENT_TIMESTAMP + %s * INTERVAL '1 second'
+                WHERE id = ANY(%s) AND locked_by = %s AND state <> 'done'
+                ''',
+                (self.lease_seconds, list(job_ids), worker_id())
+            )
+            conn.commit()
+            cursor.close()
+        finally:
+            conn.close()
+
+    def release(self, job_ids):
+        """进程退出前释放持有的任务，其他进程可以立即接手"""
+        if not job_ids:
+            return
+        conn = self.get_connection()
+        if not conn:
+            return
+        try:
+            cursor = conn.cursor()
+            cursor.execute(
+                '''
+                UPDATE generation_jobs SET locked_by = NULL, locked_until = NULL
+                WHERE id = ANY(%s) AND locked_by = %s AND state <> 'done'
+                ''',
+                (list(job_ids), worker_id())
+            )
+            conn.commit()
+            cursor.close()
+        finally:
+            conn.close()
+
+    def reschedule(self, job_id, delay=None, error=None):
+        """任务仍在进行，释放持有并安排下一次轮询"""
+        delay = self.poll_interval if delay is None else delay
+        self._update(
+            job_id,
+            '''
+            UPDATE generation_jobs SET
+                attempts = attempts + 1,
+                errors = errors + CASE WHEN %s IS NULL THEN 0 ELSE 1 END,
+                last_error = COALESCE(%s, last_error),
+                next_poll_at = CURRENT_TIMESTAMP + %s * INTERVAL '1 second',
+                locked_by = NULL, locked_until = NULL, updated_at = CURRENT_TIMESTAMP
+            WHERE id = %s
+            ''',
+            (error, error, delay)
+        )
+
+    def defer(self, job_id, delay):
+        """生成服务暂不可用，请求没有发出；释放持有并延后，不计入轮询次数和错误次数"""
+        self._update(
+            job_id,
+            '''
+            UPDATE generation_jobs SET
+                next_poll_at = CURRENT_TIMESTAMP + %s * INTERVAL '1 second',
+                locked_by = NULL, locked_until = NULL, updated_at = CURRENT_TIMESTAMP
+            WHERE id = %s
+            ''',
+            (delay,)
+        )
+
+    def finish(self, job_id, error=None):
+        """任务结束"""
+        self._update(
+            job_id,
+            '''
+            UPDATE generation_jobs SET
+                state = 'done', last_error = COALESCE(%s, last_error),
+                locked_by = NULL, locked_until = NULL, updated_at = CURRENT_TIMESTAMP
+            WHERE id = %s
+            ''',
+            (error,)
+        )
+
+    def stats(self):
+        """各状态的任务数"""
+        conn = self.get_connection()
+        if not conn:
+            return {}
+        try:
+            cursor = conn.cursor()
+            cursor.execute(
+                "SELECT state, COUNT(*) FROM generation_jobs WHERE state <> 'done' GROUP BY state"
+            )
+            data = {state: count for state, count in cursor.fetchall()}
+            cursor.close()
+            return data
+        except Exception as e:
+            logger.warning(f"⚠️ 获取任务统计失败: {e}")
+            return {}
+        finally:
+            conn.close()
+
+
+class JobDispatcher:
+    """
+    后台调度线程
+    按执行器的空闲名额从数据库领取到期任务，交给执行器运行一步
+    """
+
+    def __init__(self, job_queue, executor, handler, on_give_up=None, interval=1.0):
+        self.job_queue = job_queue
+        self.executor = executor
+        self.handler = handler
+        self.on_give_up = on_give_up
+        self.interval = interval
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._pid = None
+
+    def start(self):
+        """启动调度线程（fork后的子进程会重新启动）"""
+        if self._pid == os.getpid() and self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='job-dispatcher', daemon=True)
+        self._thread.start()
+        self._pid = os.getpid()
+        logger.info(f"📬 任务调度线程已启动 ({worker_id()})")
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+
+    def wake(self):
+        """有新任务时立即唤醒调度"""
+        self._wake.set()
+
+    def run_forever(self):
+        """在当前线程中运行调度（独立worker进程使用）"""
+        self._run()
+
+    def _run(self):
+        while not self._stop.is_set():
+            claimed = 0
+            try:
+                jobs = self.job_queue.claim_due(self.executor.available_slots())
+                for index, job in enumerate(jobs):
+                    try:
+                        self.executor.submit(self.run_job, job)
+                    except QueueFullError:
+                        # 领取后名额被其他请求占用：释放剩下的任务，不让它们等到租约过期
+                        self.job_queue.release([rest['id'] for rest in jobs[index:]])
+                        logger.warning(f"⚠️ 执行器队列已满，释放 {len(jobs) - index} 个已领取的任务")
+                        jobs = jobs[:index]
+                        break
+                claimed = len(jobs)
+            except Exception as e:
+                logger.error(f"❌ 领取生成任务失败: {e}")
+            if not claimed:
+                self._wake.wait(self.interval)
+                self._wake.clear()
+
+    def run_job(self, job):
+        """执行一步任务，异常时按错误次数重试或放弃"""
+        try:
+            self.handler(job)
+        except Exception as e:
+            logger.error(f"❌ 生成任务 {job['id']} 执行异常: {e}")
+            if job['errors'] + 1 >= self.job_queue.max_errors:
+                self.job_queue.finish(job['id'], error=str(e))
+                if self.on_give_up:
+                    self.on_give_up(job)
+            else:
+                self.job_queue.reschedule(job['id'], error=str(e))
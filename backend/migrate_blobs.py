@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+把旧的BYTEA图片迁移到blob存储的脚本
+分批读取images / studio_backgrounds中尚未迁移的行，写入blob存储后只保留key，
+并清空原BYTEA列以释放表空间
+"""
+
+import sys
+import argparse
+import psycopg2
+from config import DB_CONFIG
+from blob_store import get_blob_store, record_blob
+from upload_ingest import sniff_image_type, HEADER_SIZE
+from migrations import migrate
+
+# (表名, BYTEA列, key列)
+MIGRATIONS = [
+    ('images', 'original_image', 'original_key'),
+    ('images', 'generated_image', 'generated_key'),
+    ('studio_backgrounds', 'image_data', 'blob_key'),
+]
+
+def content_type_of(data):
+    """按文件头判断旧数据的类型（旧数据可能是PNG等格式），判断不了时按JPEG记录"""
+    kind = sniff_image_type(data[:HEADER_SIZE])
+    return f"image/{kind}" if kind else 'image/jpeg'
+
+def migrate_column(conn, store, table, data_column, key_column, batch_size, dry_run=False):
+    """按id分批迁移一列，返回迁移的行数和字节数"""
+    last_id = 0
+    rows_done = 0
+    bytes_done = 0
+
+    while True:
+        cursor = conn.cursor()
+        cursor.execute(
+            f"SELECT id, {data_column} FROM {table} "
+            f"WHERE {key_column} IS NULL AND {data_column} IS NOT NULL AND id > %s "
+            f"ORDER BY id LIMIT %s",
+            (last_id, batch_size)
+        )
+        rows = cursor.fetchall()
+        if not rows:
+            cursor.close()
+            break
+
+        for row_id, data in rows:
+            last_id = row_id
+            if dry_run:
+                rows_done += 1
+                bytes_done += len(data)
+                continue
+            data = bytes(data)
+            blob = store.put(data, content_type_of(data))
+            record_blob(cursor, blob)
+            cursor.execute(
+                f"UPDATE {table} SET {key_column} = %s, {data_column} = NULL WHERE id = %s",
+                (blob.key, row_id)
+            )
+            rows_done += 1
+            bytes_done += blob.size
+
+        conn.commit()
+        cursor.close()
+        print(f"  📦 {table}.{data_column}: 已处理 {rows_done} 行 ({bytes_done / 1024 / 1024:.1f} MB)，最后ID {last_id}")
+
+    return rows_done, bytes_done
+
+def main():
+    """主函数"""
+    parser = argparse.ArgumentParser(description='把BYTEA图片迁移到blob存储')
+    parser.add_argument('--batch-size', type=int, default=20, help='每批迁移的行数')
+    parser.add_argument('--dry-run', action='store_true', help='只统计，不写入')
+    args = parser.parse_args()
+
+    print("🚀 BYTEA图片迁移工具")
+    print("=" * 40)
+
+    try:
+        conn = psycopg2.connect(**DB_CONFIG)
+    except Exception as e:
+        print(f"❌ 数据库连接失败: {e}")
+        sys.exit(1)
+
+    store = get_blob_store()
+
+    # 确保key列已存在
+    migrate(conn)
+
+    total_rows = 0
+    total_bytes = 0
+    for table, data_column, key_column in MIGRATIONS:
+        print(f"\n🔄 迁移 {table}.{data_column} -> {key_column}")
+        rows, size = migrate_column(conn, store, table, data_column, key_column, args.batch_size, args.dry_run)
+        total_rows += rows
+        total_bytes += size
+
+    conn.close()
+
+    action = "需要迁移" if args.dry_run else "已迁移"
+    print(f"\n✅ {action} {total_rows} 张图片，共 {total_bytes / 1024 / 1024:.1f} MB")
+    if total_rows and not args.dry_run:
+        print("💡 可以在低峰期执行 VACUUM FULL images; VACUUM FULL studio_backgrounds; 回收表空间")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,278 @@
+#!/usr/bin/env python3
+"""
+数据库版本化迁移
+schema_migrations表记录已执行的版本，迁移在部署时用命令行执行一次，应用进程启动时不再执行DDL：
+    python migrations.py            # 执行所有未执行的迁移
+    python migrations.py status     # 查看迁移状态
+多个实例同时执行时用advisory锁保证只有一个进程在迁移，其他进程等待后发现已无待执行的迁移；
+标记为online的迁移在autocommit模式下执行，可以使用CREATE INDEX CONCURRENTLY等不能放在事务中的操作
+"""
+
+import io
+import sys
+import time
+import logging
+import argparse
+
+import psycopg2
+from psycopg2 import sql
+
+from blob_store import get_blob_store, init_blob_schema, record_blob
+from job_queue import init_job_table, init_job_poll_deadline
+from images_schema import init_images_schema, backfill_has_generated, STATUS_INDEXES
+from renditions import init_rendition_table
+from dedup import init_dedup_schema, DEDUP_INDEXES
+from upload_batches import init_batch_tables
+
+logger = logging.getLogger(__name__)
+
+# 迁移用的advisory锁（pg_advisory_lock(hashtext(...))）
+MIGRATION_LOCK_KEY = 'petechoes:schema_migrations'
+
+
+class Migration:
+    """一个迁移版本：online为True时在事务外执行"""
+
+    def __init__(self, version, name, apply, online=False):
+        self.version = version
+        self.name = name
+        self.apply = apply
+        self.online = online
+
+
+def create_index_concurrently(cursor, name, definition):
+    """
+    不阻塞写入地创建索引
+    之前中断的CONCURRENTLY会留下无效索引，IF NOT EXISTS会跳过它，所以先删除
+    """
+    cursor.execute(
+        '''
+        SELECT NOT i.indisvalid FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+        WHERE c.relname = %s AND pg_table_is_visible(c.oid)
+        ''',
+        (name,)
+    )
+    row = cursor.fetchone()
+    if row and row[0]:
+        logger.warning(f"⚠️ 删除之前未完成的索引 {name}")
+        cursor.execute(sql.SQL("DROP INDEX CONCURRENTLY IF EXISTS {}").format(sql.Identifier(name)))
+    cursor.execute(
+        sql.SQL("CREATE INDEX CONCURRENTLY IF NOT EXISTS {} ").format(sql.Identifier(name)) + sql.SQL(definition)
+    )
+
+
+def create_base_tables(cursor):
+    """图片、照相馆背景和生成任务表（已有的数据库上不做任何改动）"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS images (
+            id SERIAL PRIMARY KEY,
+            original_image BYTEA NOT NULL,
+            generated_image BYTEA,
+            status VARCHAR(50) DEFAULT 'pending',
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS studio_backgrounds (
+            id SERIAL PRIMARY KEY,
+            image_data BYTEA NOT NULL,
+            is_active BOOLEAN DEFAULT true,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    init_job_table(cursor)
+
+
+def create_status_indexes(cursor):
+    for name, definition in STATUS_INDEXES:
+        create_index_concurrently(cursor, name, definition)
+
+
+def create_dedup_indexes(cursor):
+    for name, definition in DEDUP_INDEXES:
+        create_index_concurrently(cursor, name, definition)
+
+
+def seed_studio_background(cursor):
+    """
+    没有照相馆背景时插入一张占位图片
+    实际的背景图片2需要部署后通过 /upload-studio-background 上传
+    """
+    cursor.execute("SELECT COUNT(*) FROM studio_backgrounds WHERE is_active = true")
+    if cursor.fetchone()[0]:
+        return
+
+    from PIL import Image
+
+    # 402x874的浅黄色占位图片
+    placeholder = Image.new('RGB', (402, 874), color='#F5DEB3')
+    buffer = io.BytesIO()
+    placeholder.save(buffer, format='JPEG', quality=90)
+
+    blob = get_blob_store().put(buffer.getvalue())
+    record_blob(cursor, blob)
+    cursor.execute(
+        "INSERT INTO studio_backgrounds (blob_key, is_active) VALUES (%s, %s)",
+        (blob.key, True)
+    )
+    logger.info("📸 已插入占位符背景图片，请通过管理接口上传实际的图片2")
+
+
+# 版本号只增不改，已发布的迁移不能修改，变更通过增加新版本完成
+MIGRATIONS = [
+    Migration(1, 'base_tables', create_base_tables),
+    Migration(2, 'blob_store', init_blob_schema),
+    Migration(3, 'image_has_generated', init_images_schema),
+    Migration(4, 'image_status_indexes', create_status_indexes, online=True),
+    Migration(5, 'image_renditions', init_rendition_table),
+    Migration(6, 'generation_dedup', init_dedup_schema),
+    Migration(7, 'generation_dedup_index', create_dedup_indexes, online=True),
+    Migration(8, 'upload_batches', init_batch_tables),
+    Migration(9, 'studio_background_placeholder', seed_studio_background),
+    Migration(10, 'image_has_generated_backfill', backfill_has_generated, online=True),
+    Migration(11, 'generation_job_poll_deadline', init_job_poll_deadline),
+]
+
+LATEST_VERSION = MIGRATIONS[-1].version
+
+
+def init_migration_table(cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INTEGER PRIMARY KEY,
+            name VARCHAR(100) NOT NULL,
+            duration_ms INTEGER,
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+
+def applied_versions(cursor):
+    """已执行的迁移版本，迁移表不存在时返回空集合"""
+    cursor.execute("SELECT to_regclass('schema_migrations') IS NOT NULL")
+    if not cursor.fetchone()[0]:
+        return set()
+    cursor.execute("SELECT version FROM schema_migrations")
+    return {row[0] for row in cursor.fetchall()}
+
+
+def pending_migrations(conn):
+    """未执行的迁移"""
+    cursor = conn.cursor()
+    try:
+        done = applied_versions(cursor)
+    finally:
+        cursor.close()
+    conn.rollback()
+    return [migration for migration in MIGRATIONS if migration.version not in done]
+
+
+def describe_schema(done):
+    """按已执行的版本返回 (是否已是最新版本, 状态内容)"""
+    pending = [migration.name for migration in MIGRATIONS if migration.version not in done]
+    return not pending, {
+        'schema_version': max(done, default=0),
+        'latest_version': LATEST_VERSION,
+        'pending_migrations': pending,
+    }
+
+
+def schema_status(conn):
+    """就绪检查用：返回 (是否已是最新版本, 状态内容)"""
+    cursor = conn.cursor()
+    try:
+        done = applied_versions(cursor)
+    finally:
+        cursor.close()
+    conn.rollback()
+    return describe_schema(done)
+
+
+def migrate(conn, target=None):
+    """
+    按版本顺序执行未执行的迁移，返回本次执行的版本列表
+    conn应为专用连接（执行期间切换为autocommit并持有会话级advisory锁）
+    """
+    autocommit = conn.autocommit
+    conn.autocommit = True
+    cursor = conn.cursor()
+    cursor.execute("SELECT pg_advisory_lock(hashtext(%s))", (MIGRATION_LOCK_KEY,))
+    try:
+        init_migration_table(cursor)
+        done = applied_versions(cursor)
+        applied = []
+        for migration in MIGRATIONS:
+            if migration.version in done or (target is not None and migration.version > target):
+                continue
+            logger.info(f"🔄 执行迁移 {migration.version}: {migration.name}")
+            start = time.monotonic()
+            if migration.online:
+                # 事务外执行，失败后下次会重新执行（迁移本身需要可重复执行）
+                migration.apply(cursor)
+                record_migration(cursor, migration, start)
+            else:
+                conn.autocommit = False
+                try:
+                    migration.apply(cursor)
+                    record_migration(cursor, migration, start)
+                    conn.commit()
+                except Exception:
+                    conn.rollback()
+                    raise
+                finally:
+                    conn.autocommit = True
+            applied.append(migration.version)
+            logger.info(f"✅ 迁移 {migration.version} 完成，用时 {time.monotonic() - start:.2f}s")
+        return applied
+    finally:
+        cursor.execute("SELECT pg_advisory_unlock(hashtext(%s))", (MIGRATION_LOCK_KEY,))
+        cursor.close()
+        conn.autocommit = autocommit
+
+
+def record_migration(cursor, migration, start):
+    cursor.execute(
+        "INSERT INTO schema_migrations (version, name, duration_ms) VALUES (%s, %s, %s)",
+        (migration.version, migration.name, int((time.monotonic() - start) * 1000))
+    )
+
+
+def main():
+    """命令行入口"""
+    from config import DB_CONFIG
+
+    parser = argparse.ArgumentParser(description='数据库迁移')
+    parser.add_argument('command', nargs='?', default='upgrade', choices=['upgrade', 'status'])
+    parser.add_argument('--target', type=int, help='只迁移到指定版本')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    try:
+        conn = psycopg2.connect(**DB_CONFIG)
+    except Exception as e:
+        logger.error(f"❌ 数据库连接失败: {e}")
+        sys.exit(1)
+
+    try:
+        if args.command == 'status':
+            pending = pending_migrations(conn)
+            logger.info(f"📊 最新版本 {LATEST_VERSION}，待执行 {len(pending)} 个迁移")
+            for migration in pending:
+                logger.info(f"  ⏳ {migration.version}: {migration.name}{'（online）' if migration.online else ''}")
+            return
+
+        applied = migrate(conn, args.target)
+        if applied:
+            logger.info(f"✅ 已执行 {len(applied)} 个迁移: {applied}")
+        else:
+            logger.info("✅ 数据库已是最新版本")
+    except Exception as e:
+        logger.error(f"❌ 迁移失败: {e}")
+        sys.exit(1)
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
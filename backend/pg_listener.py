@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+"""
+PostgreSQL LISTEN/NOTIFY 监听线程
+用一个独立连接接收通知，在多个worker进程之间广播缓存失效、任务状态变化等事件
+"""
+
+import os
+import time
+import select
+import logging
+import threading
+
+import psycopg2
+import psycopg2.extensions
+from psycopg2 import sql
+
+logger = logging.getLogger(__name__)
+
+
+def notify(cursor, channel, payload=''):
+    """在调用方的事务中发送通知（事务提交后才会送达）"""
+    cursor.execute("SELECT pg_notify(%s, %s)", (channel, str(payload)))
+
+
+class PgListener:
+    """后台监听线程，按频道分发通知"""
+
+    def __init__(self, db_config, reconnect_delay=5, select_timeout=5):
+        self.db_config = dict(db_config)
+        self.reconnect_delay = reconnect_delay
+        self.select_timeout = select_timeout
+        self._lock = threading.Lock()
+        self._callbacks = {}
+        self._reconnect_callbacks = []
+        self._thread = None
+        self._pid = None
+        self._stop = threading.Event()
+        self._conn = None
+        self._pending_listen = False
+        self._stats = {'notifications': 0, 'reconnects': 0, 'connected': False}
+
+    def subscribe(self, channel, callback):
+        """订阅频道，callback(payload) 在监听线程中调用，应尽快返回"""
+        with self._lock:
+            self._callbacks.setdefault(channel, []).append(callback)
+            conn = self._conn
+        if conn is not None and self._pid == os.getpid():
+            # 已连接时由监听线程在下一轮补发LISTEN
+            self._pending_listen = True
+
+    def on_reconnect(self, callback):
+        """连接（重新）建立时调用，断线期间可能错过通知，订阅方应在这里做全量失效"""
+        with self._lock:
+            self._reconnect_callbacks.append(callback)
+
+    def start(self):
+        """启动监听线程（fork后的子进程会重新启动）"""
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._conn = None
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='pg-listener', daemon=True)
+            self._thread.start()
+            self._pid = os.getpid()
+
+    def stop(self):
+        self._stop.set()
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, channels=sorted(self._callbacks))
+
+    def _listen_all(self, conn, channels):
+        cursor = conn.cursor()
+        for channel in channels:
+            cursor.execute(sql.SQL("LISTEN {}").format(sql.Identifier(channel)))
+        cursor.close()
+
+    def _run(self):
+        while not self._stop.is_set():
+            conn = None
+            try:
+                conn = psycopg2.connect(**self.db_config)
+                conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+                with self._lock:
+                    channels = set(self._callbacks)
+                    reconnect_callbacks = list(self._reconnect_callbacks)
+                    self._conn = conn
+                    self._stats['connected'] = True
+                self._pending_listen = False
+                self._listen_all(conn, channels)
+                logger.info(f"👂 已监听数据库通知: {sorted(channels)}")
+                for callback in reconnect_callbacks:
+                    self._safe_call(callback)
+
+                while not self._stop.is_set():
+                    if self._pending_listen:
+                        self._pending_listen = False
+                        with self._lock:
+                            new_channels = set(self._callbacks) - channels
+                        self._listen_all(conn, new_channels)
+                        channels |= new_channels
+                    if select.select([conn], [], [], self.select_timeout) == ([], [], []):
+                        continue
+                    conn.poll()
+                    while conn.notifies:
+                        notification = conn.notifies.pop(0)
+                        self._dispatch(notification.channel, notification.payload)
+            except Exception as e:
+                logger.warning(f"⚠️ 数据库通知监听中断，{self.reconnect_delay}秒后重连: {e}")
+            finally:
+                with self._lock:
+                    self._conn = None
+                    self._stats['connected'] = False
+                if conn is not None:
+                    try:
+                        conn.close()
+                    except Exception:
+                        pass
+            if not self._stop.is_set():
+                with self._lock:
+                    self._stats['reconnects'] += 1
+                time.sleep(self.reconnect_delay)
+
+    def _dispatch(self, channel, payload):
+        with self._lock:
+            callbacks = list(self._callbacks.get(channel, ()))
+            self._stats['notifications'] += 1
+        for callback in callbacks:
+            self._safe_call(callback, payload)
+
+    @staticmethod
+    def _safe_call(fn, *args):
+        try:
+            fn(*args)
+        except Exception as e:
+            logger.error(f"❌ 通知回调 {getattr(fn, '__name__', fn)} 异常: {e}")
@@ -3,57 +3,34 @@ from flask_cors import CORS
 import psycopg2
 from psycopg2.extras import RealDictCursor
 import os
-import requests
 from PIL import Image
 import io
 import threading
+import db_pool
+from http_client import http_client
+from sample_download import download_sample, download_stats, SampleDownloadError
+from blob_store import get_blob_store, record_blob
+from image_processing import image_normalizer, InvalidImageError
+from upload_ingest import IngestRequest, UPLOAD_CONFIG, UPLOAD_REJECTIONS, ingested
 from config import DB_CONFIG, MODELSCOPE_API_KEY, get_db_connection_with_retry
+from migrations import schema_status
 
 app = Flask(__name__)
+app.request_class = IngestRequest
+app.config['MAX_CONTENT_LENGTH'] = UPLOAD_CONFIG['max_request_bytes']
 CORS(app)
 
 # ModelScope API配置
 MODELSCOPE_API_URL = 'https://api.modelscope.cn/v1/models/black-forest-labs/FLUX.1-Kontext-dev/inference'
 
 def get_db_connection():
-    """获取数据库连接"""
+    """获取数据库连接，用完调用 conn.close() 归还连接池"""
     try:
         return get_db_connection_with_retry(max_retries=3, retry_delay=1)
     except Exception as e:
         print(f"❌ 数据库连接失败: {e}")
         return None
 
-def init_database():
-    """初始化数据库表"""
-    try:
-        conn = get_db_connection()
-        if not conn:
-            return False
-            
-        cursor = conn.cursor()
-        
-        # 创建图片表
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS images (
-                id SERIAL PRIMARY KEY,
-                original_image BYTEA NOT NULL,
-                generated_image BYTEA,
-                status VARCHAR(50) DEFAULT 'pending',
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        conn.commit()
-        cursor.close()
-        conn.close()
-        
-        print("✅ 数据库表初始化成功")
-        return True
-        
-    except Exception as e:
-        print(f"❌ 数据库初始化失败: {e}")
-        return False
-
 @app.route('/upload', methods=['POST'])
 def upload_image():
     """上传图片并触发AI生成"""
@@ -65,8 +42,9 @@ def upload_image():
         if file.filename == '':
             return jsonify({'error': '没有选择文件'}), 400
         
-        # 读取图片数据
-        image_data = file.read()
+        # 上传内容已流式写入临时文件，规范化后写入blob存储
+        normalized = image_normalizer.normalize(ingested(file).name)
+        blob = get_blob_store().put(normalized.data, normalized.content_type)
         
         # 保存到数据库
         conn = get_db_connection()
@@ -74,9 +52,10 @@ def upload_image():
             return jsonify({'error': '数据库连接失败'}), 500
         
         cursor = conn.cursor()
+        record_blob(cursor, blob)
         cursor.execute(
-            "INSERT INTO images (original_image, status) VALUES (%s, %s) RETURNING id",
-            (image_data, 'processing')
+            "INSERT INTO images (original_key, status) VALUES (%s, %s) RETURNING id",
+            (blob.key, 'processing')
         )
         image_id = cursor.fetchone()[0]
         conn.commit()
@@ -89,9 +68,14 @@ def upload_image():
         return jsonify({
             'success': True,
             'image_id': image_id,
-            'message': '图片上传成功，正在生成新图片...'
+            'message': '图片上传成功，正在生成新图片...',
+            'normalization': normalized.summary()
         })
         
+    except UPLOAD_REJECTIONS as e:
+        return jsonify({'error': e.description}), e.code
+    except InvalidImageError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         print(f"❌ 上传失败: {e}")
         return jsonify({'error': f'上传失败: {str(e)}'}), 500
@@ -123,7 +107,7 @@ def generate_new_image(image_id):
         print(f"Headers: {headers}")
         print(f"Payload keys: {list(payload.keys())}")
         
-        response = requests.post(MODELSCOPE_API_URL, json=payload, headers=headers)
+        response = http_client.post(MODELSCOPE_API_URL, endpoint='modelscope.submit', json=payload, headers=headers)
         
         print(f"📡 API响应状态码: {response.status_code}")
         print(f"📡 API响应内容: {response.text[:500]}...")
@@ -133,16 +117,25 @@ def generate_new_image(image_id):
             generated_image_url = result.get('output', {}).get('generated_image_url')
             
             if generated_image_url:
-                # 下载生成的图片
-                img_response = requests.get(generated_image_url)
-                if img_response.status_code == 200:
-                    # 保存生成的图片到数据库
+                # 流式下载生成的图片，边下载边计算哈希
+                try:
+                    sample = download_sample(generated_image_url, endpoint='modelscope.sample')
+                except (SampleDownloadError, OSError) as e:
+                    sample = None
+                    print(f"❌ 下载生成图片失败: {e}")
+                if sample:
+                    # 保存生成的图片到blob存储，数据库只记录key
+                    with sample:
+                        blob = get_blob_store().put_hashed_file(
+                            sample.path, sample.sha256, sample.size, sample.content_type
+                        )
                     conn = get_db_connection()
                     if conn:
                         cursor = conn.cursor()
+                        record_blob(cursor, blob)
                         cursor.execute(
-                            "UPDATE images SET generated_image = %s, status = %s WHERE id = %s",
-                            (img_response.content, 'completed', image_id)
+                            "UPDATE images SET generated_key = %s, has_generated = true, status = %s WHERE id = %s",
+                            (blob.key, 'completed', image_id)
                         )
                         conn.commit()
                         cursor.close()
@@ -151,7 +144,6 @@ def generate_new_image(image_id):
                     else:
                         print(f"❌ 数据库连接失败，无法保存生成的图片")
                 else:
-                    print(f"❌ 下载生成图片失败: {img_response.status_code}")
                     update_image_status(image_id, 'failed')
             else:
                 print(f"❌ 未收到生成图片URL")
@@ -189,20 +181,31 @@ def get_image(image_id):
         
         cursor = conn.cursor()
         
+        # 只读取key，尚未迁移的旧数据才读取BYTEA
         if image_type == 'original':
-            cursor.execute("SELECT original_image FROM images WHERE id = %s", (image_id,))
+            cursor.execute(
+                "SELECT i.original_key, CASE WHEN i.original_key IS NULL THEN i.original_image END, b.content_type "
+                "FROM images i LEFT JOIN blobs b ON b.key = i.original_key WHERE i.id = %s",
+                (image_id,)
+            )
         else:
-            cursor.execute("SELECT generated_image FROM images WHERE id = %s", (image_id,))
+            cursor.execute(
+                "SELECT i.generated_key, CASE WHEN i.generated_key IS NULL THEN i.generated_image END, b.content_type "
+                "FROM images i LEFT JOIN blobs b ON b.key = i.generated_key WHERE i.id = %s",
+                (image_id,)
+            )
         
         result = cursor.fetchone()
         cursor.close()
         conn.close()
         
-        if not result or not result[0]:
+        if not result or not (result[0] or result[1]):
             return jsonify({'error': '图片不存在'}), 404
         
+        if result[0]:
+            return send_file(get_blob_store().open(result[0]), mimetype=result[2] or 'image/jpeg')
         return send_file(
-            io.BytesIO(result[0]),
+            io.BytesIO(result[1]),
             mimetype='image/jpeg'
         )
         
@@ -220,7 +223,7 @@ def get_status(image_id):
         
         cursor = conn.cursor(cursor_factory=RealDictCursor)
         cursor.execute(
-            "SELECT status, (generated_image IS NOT NULL) as has_generated_image FROM images WHERE id = %s",
+            "SELECT status, has_generated as has_generated_image FROM images WHERE id = %s",
             (image_id,)
         )
         
@@ -259,7 +262,8 @@ def home():
             '/upload - 图片上传',
             '/status/<id> - 查询状态', 
             '/image/<id> - 获取图片',
-            '/test - 测试接口'
+            '/test - 测试接口',
+            '/metrics - 运行指标'
         ]
     })
 
@@ -293,9 +297,34 @@ def health_check():
     """健康检查"""
     return jsonify({'status': 'healthy', 'message': 'PostgreSQL服务器运行正常'})
 
+@app.route('/ready', methods=['GET'])
+def readiness_check():
+    """就绪检查：数据库可以连接且表结构已是最新版本时返回200，否则返回503"""
+    try:
+        conn = get_db_connection_with_retry(max_retries=1)
+    except Exception as e:
+        return jsonify({'status': 'unavailable', 'reason': f'数据库连接失败: {e}'}), 503
+    try:
+        ready, details = schema_status(conn)
+    except Exception as e:
+        conn.discard()
+        return jsonify({'status': 'unavailable', 'reason': f'读取迁移版本失败: {e}'}), 503
+    conn.close()
+    if not ready:
+        return jsonify(dict(details, status='unavailable', reason='数据库表结构需要迁移')), 503
+    return jsonify(dict(details, status='ready'))
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """运行指标（连接池等）"""
+    return jsonify({
+        'db_pool': db_pool.pool_stats(),
+        'image_normalizer': image_normalizer.stats(),
+        'http_client': http_client.stats(),
+        'sample_download': download_stats()
+    })
+
 if __name__ == '__main__':
-    if init_database():
-        print("🌐 PostgreSQL服务器启动在 http://localhost:5001")
-        app.run(host='0.0.0.0', port=5001, debug=True)
-    else:
-        print("❌ 数据库初始化失败") 
\ No newline at end of file
+    # 表结构由 python migrations.py 创建和升级
+    print("🌐 PostgreSQL服务器启动在 http://localhost:5001")
+    app.run(host='0.0.0.0', port=5001, debug=True) 
\ No newline at end of file
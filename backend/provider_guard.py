@@ -0,0 +1,261 @@
+#!/usr/bin/env python3
+"""
+生成服务的自适应并发限制和熔断器
+并发上限按AIMD调整：满载且延迟正常时加性增长，429 / 5xx / 超时或延迟超过基线时减半；
+连续失败时熔断器打开，期间不再请求生成服务（任务留在队列里），冷却后半开放行少量探测请求，
+成功后恢复，失败后重新打开
+"""
+
+import os
+import time
+import random
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+# 配置（提交和轮询各有一个并发限制，共用一个熔断器）
+PROVIDER_GUARD_CONFIG = {
+    'submit_initial': int(os.getenv('BFL_SUBMIT_CONCURRENCY', '4')),
+    'submit_max': int(os.getenv('BFL_SUBMIT_CONCURRENCY_MAX', '16')),
+    'poll_initial': int(os.getenv('BFL_POLL_CONCURRENCY', '10')),
+    'poll_max': int(os.getenv('BFL_POLL_CONCURRENCY_MAX', '20')),
+    # 延迟超过基线的倍数时视为过载
+    'latency_tolerance': float(os.getenv('BFL_LATENCY_TOLERANCE', '2.0')),
+    # 等待提交名额的最长时间（秒），超时后任务留在队列里稍后再试
+    'acquire_timeout': float(os.getenv('BFL_CONCURRENCY_WAIT', '10')),
+    'failure_threshold': int(os.getenv('BFL_BREAKER_FAILURES', '5')),
+    'open_seconds': float(os.getenv('BFL_BREAKER_OPEN_SECONDS', '30')),
+    'half_open_probes': int(os.getenv('BFL_BREAKER_HALF_OPEN_PROBES', '1')),
+}
+
+# 熔断器状态
+BREAKER_CLOSED = 'closed'
+BREAKER_OPEN = 'open'
+BREAKER_HALF_OPEN = 'half_open'
+
+
+class ProviderBusyError(Exception):
+    """熔断器打开或没有空闲名额，请求没有发出，任务应留在队列里retry_after秒后再试"""
+
+    def __init__(self, reason, retry_after):
+        super().__init__(f"生成服务暂不可用（{reason}），{retry_after:.0f}秒后重试")
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class ProviderOverloadedError(Exception):
+    """生成服务返回429 / 5xx或网络错误（已计入熔断器）"""
+
+
+class AdaptiveConcurrencyLimit:
+    """
+    AIMD并发上限（线程安全）
+    acquire()阻塞等待名额，try_acquire()不等待（供事件循环使用）；
+    请求结束后调用release()报告延迟和是否过载，没有发出请求时调用cancel()
+    """
+
+    def __init__(self, name, initial=4, min_limit=1, max_limit=16, backoff=0.5,
+                 latency_tolerance=2.0, decrease_cooldown=1.0, baseline_drift=0.01):
+        self.name = name
+        self.min_limit = min_limit
+        self.max_limit = max(max_limit, min_limit)
+        self.backoff = backoff
+        self.latency_tolerance = latency_tolerance
+        self.decrease_cooldown = decrease_cooldown
+        self.baseline_drift = baseline_drift
+        self._limit = float(min(max(initial, min_limit), self.max_limit))
+        self._in_flight = 0
+        self._baseline = None
+        self._last_decrease = 0.0
+        self._cond = threading.Condition()
+        self._stats = {
+            'acquired': 0, 'rejected': 0, 'timeouts': 0, 'increases': 0, 'decreases': 0,
+            'waited_ms_total': 0.0, 'last_latency_ms': None,
+        }
+
+    @property
+    def limit(self):
+        return int(self._limit)
+
+    def try_acquire(self):
+        with self._cond:
+            if self._in_flight < int(self._limit):
+                self._in_flight += 1
+                self._stats['acquired'] += 1
+                return True
+            self._stats['rejected'] += 1
+            return False
+
+    def acquire(self, timeout=None):
+        """等待名额，超时返回False"""
+        started = time.monotonic()
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._in_flight < int(self._limit), timeout):
+                self._stats['timeouts'] += 1
+                return False
+            self._in_flight += 1
+            self._stats['acquired'] += 1
+            self._stats['waited_ms_total'] += (time.monotonic() - started) * 1000
+            return True
+
+    def cancel(self):
+        """归还没有使用的名额，不调整上限"""
+        with self._cond:
+            self._in_flight -= 1
+            self._cond.notify()
+
+    def release(self, latency_ms, overloaded=False):
+        """归还名额并按结果调整上限"""
+        with self._cond:
+            saturated = self._in_flight >= int(self._limit)
+            self._in_flight -= 1
+            self._stats['last_latency_ms'] = round(latency_ms, 1)
+            if overloaded:
+                self._decrease()
+            else:
+                # 基线跟随最小延迟，缓慢向上漂移，生成服务整体变慢后会成为新的正常值
+                if self._baseline is None or latency_ms < self._baseline:
+                    self._baseline = latency_ms
+                else:
+                    self._baseline += (latency_ms - self._baseline) * self.baseline_drift
+                if latency_ms > self._baseline * self.latency_tolerance:
+                    self._decrease()
+                elif saturated and self._limit < self.max_limit:
+                    # 满载时大约每完成limit个请求加1
+                    self._limit = min(self.max_limit, self._limit + 1 / self._limit)
+                    self._stats['increases'] += 1
+            self._cond.notify_all()
+
+    def _decrease(self):
+        now = time.monotonic()
+        # 同一批并发请求一起失败时只减一次
+        if now - self._last_decrease < self.decrease_cooldown:
+            return
+        self._last_decrease = now
+        previous = int(self._limit)
+        self._limit = max(self.min_limit, self._limit * self.backoff)
+        self._stats['decreases'] += 1
+        if int(self._limit) != previous:
+            logger.warning(f"⚠️ {self.name} 并发上限降为 {int(self._limit)}")
+
+    def stats(self):
+        with self._cond:
+            data = dict(self._stats, limit=int(self._limit), in_flight=self._in_flight,
+                        min_limit=self.min_limit, max_limit=self.max_limit)
+            data['latency_baseline_ms'] = round(self._baseline, 1) if self._baseline is not None else None
+        data['waited_ms_total'] = round(data['waited_ms_total'], 1)
+        return data
+
+
+class CircuitBreaker:
+    """
+    熔断器（线程安全）
+    allow()在半开状态下会占用一个探测名额，放行后必须调用record()报告结果
+    """
+
+    def __init__(self, name, failure_threshold=5, open_seconds=30, half_open_probes=1):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.open_seconds = open_seconds
+        self.half_open_probes = half_open_probes
+        self._state = BREAKER_CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probes = 0
+        self._lock = threading.Lock()
+        self._stats = {'opened': 0, 'short_circuited': 0, 'successes': 0, 'failures': 0}
+
+    def _refresh(self):
+        if self._state == BREAKER_OPEN and time.monotonic() - self._opened_at >= self.open_seconds:
+            self._state = BREAKER_HALF_OPEN
+            self._probes = 0
+            logger.info(f"🔌 {self.name} 熔断器半开，放行探测请求")
+
+    @property
+    def state(self):
+        with self._lock:
+            self._refresh()
+            return self._state
+
+    def is_open(self):
+        """是否应直接拒绝（不占用探测名额）"""
+        with self._lock:
+            self._refresh()
+            return self._state == BREAKER_OPEN or (
+                self._state == BREAKER_HALF_OPEN and self._probes >= self.half_open_probes
+            )
+
+    def allow(self):
+        """是否放行一个请求"""
+        with self._lock:
+            self._refresh()
+            if self._state == BREAKER_CLOSED:
+                return True
+            if self._state == BREAKER_HALF_OPEN and self._probes < self.half_open_probes:
+                self._probes += 1
+                return True
+            self._stats['short_circuited'] += 1
+            return False
+
+    def record(self, ok):
+        """报告一个已放行请求的结果"""
+        with self._lock:
+            if ok:
+                self._stats['successes'] += 1
+                self._failures = 0
+                # 打开前发出、打开后才返回的请求不改变状态，等半开探测的结果
+                if self._state == BREAKER_HALF_OPEN:
+                    self._state = BREAKER_CLOSED
+                    logger.info(f"✅ {self.name} 已恢复，熔断器关闭")
+                return
+            self._stats['failures'] += 1
+            self._failures += 1
+            if self._state == BREAKER_HALF_OPEN or (
+                    self._state == BREAKER_CLOSED and self._failures >= self.failure_threshold):
+                self._state = BREAKER_OPEN
+                self._opened_at = time.monotonic()
+                self._stats['opened'] += 1
+                logger.warning(f"🚫 {self.name} 连续失败 {self._failures} 次，熔断 {self.open_seconds:.0f} 秒")
+
+    def retry_after(self):
+        """建议的重试等待秒数（带随机抖动，避免恢复时同时涌入）"""
+        with self._lock:
+            remaining = 0.0
+            if self._state == BREAKER_OPEN:
+                remaining = self.open_seconds - (time.monotonic() - self._opened_at)
+        return max(remaining, 1.0) * random.uniform(1.0, 1.5)
+
+    def stats(self):
+        with self._lock:
+            self._refresh()
+            return dict(self._stats, state=self._state, consecutive_failures=self._failures,
+                        failure_threshold=self.failure_threshold, open_seconds=self.open_seconds)
+
+
+bfl_breaker = CircuitBreaker(
+    'BFL',
+    failure_threshold=PROVIDER_GUARD_CONFIG['failure_threshold'],
+    open_seconds=PROVIDER_GUARD_CONFIG['open_seconds'],
+    half_open_probes=PROVIDER_GUARD_CONFIG['half_open_probes'],
+)
+bfl_submit_concurrency = AdaptiveConcurrencyLimit(
+    'BFL提交',
+    initial=PROVIDER_GUARD_CONFIG['submit_initial'],
+    max_limit=PROVIDER_GUARD_CONFIG['submit_max'],
+    latency_tolerance=PROVIDER_GUARD_CONFIG['latency_tolerance'],
+)
+bfl_poll_concurrency = AdaptiveConcurrencyLimit(
+    'BFL轮询',
+    initial=PROVIDER_GUARD_CONFIG['poll_initial'],
+    max_limit=PROVIDER_GUARD_CONFIG['poll_max'],
+    latency_tolerance=PROVIDER_GUARD_CONFIG['latency_tolerance'],
+)
+
+
+def guard_stats():
+    return {
+        'breaker': bfl_breaker.stats(),
+        'submit': bfl_submit_concurrency.stats(),
+        'poll': bfl_poll_concurrency.stats(),
+    }
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+生成图片的缩略图和多格式版本
+生成完成时一次性生成 thumb / medium 尺寸和 WebP / AVIF 格式，存放在blob存储中，
+/image/<id> 按 ?size= 和 ?format=（或Accept头）选择版本，移动端预览不需要下载原图
+"""
+
+import os
+import logging
+
+from blob_store import get_blob_store, record_blob
+from image_processing import image_normalizer, OUTPUT_FORMATS
+
+logger = logging.getLogger(__name__)
+
+# 版本配置
+RENDITION_CONFIG = {
+    'sizes': {
+        'thumb': int(os.getenv('RENDITION_THUMB_EDGE', '256')),
+        'medium': int(os.getenv('RENDITION_MEDIUM_EDGE', '768')),
+        'full': None,
+    },
+    # JPEG总是生成，这里配置额外的格式（不支持的格式会被忽略）
+    'formats': [
+        fmt.strip() for fmt in os.getenv('RENDITION_FORMATS', 'webp,avif').split(',') if fmt.strip()
+    ],
+    'quality': int(os.getenv('RENDITION_QUALITY', '80')),
+}
+
+RENDITION_SIZES = tuple(RENDITION_CONFIG['sizes'])
+RENDITION_FORMATS = ('jpeg',) + tuple(
+    fmt for fmt in RENDITION_CONFIG['formats'] if fmt in OUTPUT_FORMATS and fmt != 'jpeg'
+)
+
+# Accept协商时的优先顺序（体积从小到大）
+NEGOTIATION_ORDER = ('avif', 'webp')
+
+
+def init_rendition_table(cursor):
+    """创建版本表（在迁移中调用）"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS image_renditions (
+            image_id INTEGER NOT NULL REFERENCES images(id) ON DELETE CASCADE,
+            size VARCHAR(16) NOT NULL,
+            format VARCHAR(8) NOT NULL,
+            blob_key VARCHAR(64) NOT NULL REFERENCES blobs(key),
+            width INTEGER,
+            height INTEGER,
+            PRIMARY KEY (image_id, size, format)
+        )
+    ''')
+
+
+def create_renditions(source):
+    """
+    生成各版本并写入blob存储（不涉及数据库），返回 [(尺寸, 格式, BlobInfo, 宽, 高)]
+    source为图片字节或文件路径（按路径时由规范化进程直接读取）
+    """
+    rendered = image_normalizer.render(
+        source, RENDITION_CONFIG['sizes'], RENDITION_FORMATS, RENDITION_CONFIG['quality']
+    )
+    store = get_blob_store()
+    renditions = []
+    for size, fmt, encoded, width, height, content_type in rendered:
+        renditions.append((size, fmt, store.put(encoded, content_type), width, height))
+    logger.info(
+        f"🖼️ 已生成 {len(renditions)} 个图片版本，共 {sum(r[2].size for r in renditions)} bytes"
+    )
+    return renditions
+
+
+def record_renditions(cursor, image_id, renditions):
+    """在调用方的事务中登记版本"""
+    for size, fmt, blob, width, height in renditions:
+        record_blob(cursor, blob)
+        cursor.execute(
+            '''
+            INSERT INTO image_renditions (image_id, size, format, blob_key, width, height)
+            VALUES (%s, %s, %s, %s, %s, %s)
+            ON CONFLICT (image_id, size, format) DO UPDATE
+                SET blob_key = EXCLUDED.blob_key, width = EXCLUDED.width, height = EXCLUDED.height
+            ''',
+            (image_id, size, fmt, blob.key, width, height)
+        )
+
+
+def negotiate_format(requested, accept_mimetypes):
+    """
+    选择输出格式：显式的 ?format= 优先，否则按Accept头选择客户端支持的最小格式
+    返回格式名，请求了不支持的格式时返回None
+    """
+    if requested:
+        requested = requested.lower()
+        if requested == 'jpg':
+            requested = 'jpeg'
+        return requested if requested in RENDITION_FORMATS else None
+    # 只看客户端明确列出的类型，*/* 不代表能解码AVIF / WebP
+    accepted = {value for value, quality in accept_mimetypes if quality > 0}
+    for fmt in NEGOTIATION_ORDER:
+        if fmt in RENDITION_FORMATS and OUTPUT_FORMATS[fmt][1] in accepted:
+            return fmt
+    return 'jpeg'
+
+
+# 查找版本（app.py和async_app.py共用，异步应用经async_db.asyncpg_query转换占位符）
+FIND_RENDITION_SQL = '''
+    SELECT r.blob_key, b.content_type, b.created_at
+    FROM image_renditions r JOIN blobs b ON b.key = r.blob_key
+    WHERE r.image_id = %s AND r.size = %s AND r.format = %s
+'''
+
+
+def find_rendition(cursor, image_id, size, fmt):
+    """查找版本，返回 (blob_key, content_type, created_at)，不存在时返回None"""
+    cursor.execute(FIND_RENDITION_SQL, (image_id, size, fmt))
+    return cursor.fetchone()
@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+"""
+生成图片的流式下载
+按块从生成服务的地址读取，写入临时文件的同时计算SHA-256、大小并解析图片尺寸，
+不把整张图片放进内存；下载结束后按Content-Length校验完整性，
+连接中断时用Range请求从已收到的位置继续（服务不支持Range时从头重新下载）
+"""
+
+import os
+import re
+import logging
+import hashlib
+import tempfile
+import threading
+
+import requests
+from PIL import ImageFile
+
+from http_client import http_client
+from upload_ingest import sniff_image_type, HEADER_SIZE
+
+logger = logging.getLogger(__name__)
+
+# 下载配置
+SAMPLE_DOWNLOAD_CONFIG = {
+    'chunk_size': int(os.getenv('SAMPLE_CHUNK_SIZE', str(64 * 1024))),
+    'max_bytes': int(os.getenv('SAMPLE_MAX_BYTES', str(50 * 1024 * 1024))),
+    # 传输中断后继续下载的次数
+    'max_resumes': int(os.getenv('SAMPLE_MAX_RESUMES', '3')),
+    'tmp_dir': os.getenv('SAMPLE_TMP_DIR') or None,
+}
+
+CONTENT_RANGE = re.compile(r'bytes (\d+)-(\d+)/(\d+|\*)')
+
+_stats_lock = threading.Lock()
+_stats = {'downloads': 0, 'failed': 0, 'bytes': 0, 'resumes': 0, 'restarts': 0, 'integrity_errors': 0}
+
+
+class SampleDownloadError(Exception):
+    """下载失败或内容不完整"""
+
+
+class SampleFile:
+    """
+    下载中的生成图片，内容在临时文件中
+    写入时计算哈希和大小，文件头到达后判断类型，读到图片头部后取得宽高（之后不再解析）
+    """
+
+    def __init__(self, max_bytes, tmp_dir=None):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.kind = None
+        self.width = None
+        self.height = None
+        self._digest = hashlib.sha256()
+        self._header = b''
+        self._parser = ImageFile.Parser()
+        self._file = tempfile.NamedTemporaryFile(dir=tmp_dir, prefix='.sample-')
+
+    @property
+    def path(self):
+        return self._file.name
+
+    @property
+    def sha256(self):
+        return self._digest.hexdigest()
+
+    @property
+    def content_type(self):
+        return f"image/{self.kind}"
+
+    def write(self, chunk):
+        self.size += len(chunk)
+        if self.size > self.max_bytes:
+            raise SampleDownloadError(f"生成图片超过大小限制（{self.max_bytes // 1024 // 1024}MB）")
+        if self.kind is None:
+            self._header += chunk[:HEADER_SIZE - len(self._header)]
+            if len(self._header) >= HEADER_SIZE:
+                self.kind = sniff_image_type(self._header)
+                if self.kind is None:
+                    raise SampleDownloadError('下载的内容不是图片')
+        if self.width is None:
+            self._parse(chunk)
+        self._digest.update(chunk)
+        self._file.write(chunk)
+
+    def _parse(self, chunk):
+        try:
+            self._parser.feed(chunk)
+        except Exception:
+            # 尺寸只用于记录，解析不了时跳过，由后续生成缩略图时发现损坏的图片
+            self.width = self.height = 0
+            return
+        if self._parser.image is not None:
+            self.width, self.height = self._parser.image.size
+            # 取得尺寸后丢弃解析器，避免继续解码占用内存
+            self._parser = None
+
+    def finish(self):
+        """下载结束，把内容刷到磁盘供其他进程按路径读取"""
+        if self.kind is None:
+            raise SampleDownloadError('下载的内容不是图片')
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _expected_total(response, offset):
+    """
+    按响应头得到完整内容的大小（未知时为None）
+    返回 (总大小, 是否从offset继续)；服务忽略Range返回200时需要从头开始
+    """
+    if response.status_code == 206:
+        match = CONTENT_RANGE.match(response.headers.get('Content-Range', ''))
+        if not match or int(match.group(1)) != offset:
+            raise SampleDownloadError(f"Content-Range不匹配: {response.headers.get('Content-Range')}")
+        return (None if match.group(3) == '*' else int(match.group(3))), True
+    length = response.headers.get('Content-Length')
+    return (int(length) if length and length.isdigit() else None), False
+
+
+def _count(**values):
+    with _stats_lock:
+        for name, value in values.items():
+            _stats[name] += value
+
+
+def download_sample(url, endpoint='sample', max_bytes=None, max_resumes=None, chunk_size=None):
+    """
+    流式下载生成图片，返回SampleFile（调用方用完后close()）
+    大小和Content-Length不一致、超过大小限制、不是图片或多次中断后抛出SampleDownloadError
+    """
+    max_bytes = max_bytes or SAMPLE_DOWNLOAD_CONFIG['max_bytes']
+    max_resumes = SAMPLE_DOWNLOAD_CONFIG['max_resumes'] if max_resumes is None else max_resumes
+    chunk_size = chunk_size or SAMPLE_DOWNLOAD_CONFIG['chunk_size']
+
+    sample = SampleFile(max_bytes, SAMPLE_DOWNLOAD_CONFIG['tmp_dir'])
+    total = None
+    interruptions = 0
+    try:
+        while True:
+            # 按原始字节计算大小，不接受压缩传输
+            headers = {'Accept-Encoding': 'identity'}
+            if sample.size:
+                headers['Range'] = f'bytes={sample.size}-'
+            response = http_client.get(url, endpoint=endpoint, stream=True, headers=headers)
+            try:
+                if response.status_code not in (200, 206):
+                    raise SampleDownloadError(f"HTTP {response.status_code}")
+                expected, resumed = _expected_total(response, sample.size)
+                if sample.size and not resumed:
+                    # 服务不支持Range，丢弃已收到的部分从头开始
+                    logger.warning(f"⚠️ 下载地址不支持断点续传，从头重新下载（已收到 {sample.size} bytes）")
+                    _count(restarts=1)
+                    sample.close()
+                    sample = SampleFile(max_bytes, SAMPLE_DOWNLOAD_CONFIG['tmp_dir'])
+                total = expected if expected is not None else total
+                if total is not None and total > max_bytes:
+                    raise SampleDownloadError(f"生成图片超过大小限制（{total} bytes）")
+                for chunk in response.iter_content(chunk_size=chunk_size):
+                    sample.write(chunk)
+                if total is not None and sample.size < total:
+                    raise requests.exceptions.ChunkedEncodingError(f"连接提前结束（{sample.size}/{total} bytes）")
+            except (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError) as e:
+                interruptions += 1
+                if interruptions > max_resumes:
+                    raise SampleDownloadError(f"下载多次中断: {e}")
+                logger.warning(f"⚠️ 下载生成图片中断，从 {sample.size} bytes 继续（第 {interruptions} 次）: {e}")
+                _count(resumes=1)
+                continue
+            finally:
+                response.close()
+
+            if total is not None and sample.size != total:
+                _count(integrity_errors=1)
+                raise SampleDownloadError(f"下载不完整: 收到 {sample.size} bytes，应为 {total} bytes")
+            sample.finish()
+            _count(downloads=1, bytes=sample.size)
+            logger.info(
+                f"📥 生成图片已下载: {sample.kind} {sample.width}x{sample.height} {sample.size} bytes"
+                f"（{sample.sha256[:12]}）"
+            )
+            return sample
+    except Exception:
+        _count(failed=1)
+        sample.close()
+        raise
+
+
+def download_stats():
+    with _stats_lock:
+        return dict(_stats)
@@ -52,14 +52,22 @@ def main():
     
     try:
         # 导入应用模块
-        from postgres_server import app, init_database
+        from app import app
+        from migrations import migrate
+        from config import DB_CONFIG
+        import psycopg2
         
-        # 初始化数据库
-        logger.info("📂 正在初始化数据库...")
-        if init_database():
-            logger.info("✅ 数据库初始化成功")
-        else:
-            logger.warning("⚠️ 数据库初始化失败，但继续启动服务器")
+        # 部署时执行一次数据库迁移（多个实例同时启动时由advisory锁保证只执行一次）
+        logger.info("📂 正在执行数据库迁移...")
+        try:
+            conn = psycopg2.connect(**DB_CONFIG)
+            try:
+                applied = migrate(conn)
+            finally:
+                conn.close()
+            logger.info(f"✅ 数据库迁移完成，本次执行 {len(applied)} 个")
+        except Exception as e:
+            logger.warning(f"⚠️ 数据库迁移失败，但继续启动服务器: {e}")
         
         # 获取端口
         port = int(os.getenv('PORT', 5001))
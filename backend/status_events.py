@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+"""
+图片状态变化的推送
+状态写入数据库时在同一事务中发送NOTIFY，每个进程的监听线程收到后交给进程内的StatusBroker，
+再唤醒等待该图片的SSE连接或长轮询请求（?wait=），客户端不需要每5秒查询一次
+"""
+
+import os
+import json
+import queue
+import asyncio
+import logging
+import threading
+from contextlib import contextmanager
+
+from pg_listener import notify
+
+logger = logging.getLogger(__name__)
+
+# 状态变化的数据库通知频道，payload为 "图片ID:状态"
+IMAGE_STATUS_CHANNEL = 'image_status_changed'
+
+# 推送配置
+STATUS_STREAM_CONFIG = {
+    'heartbeat_interval': float(os.getenv('STATUS_STREAM_HEARTBEAT', '15')),
+    'max_duration': float(os.getenv('STATUS_STREAM_MAX_SECONDS', '600')),
+    'retry_ms': int(os.getenv('STATUS_STREAM_RETRY_MS', '3000')),
+    # GET /status/<id>?wait= 最多等待的秒数
+    'long_poll_max': float(os.getenv('STATUS_LONG_POLL_MAX_SECONDS', '30')),
+}
+
+# 不会再变化的状态
+TERMINAL_STATUSES = ('completed', 'failed')
+
+# 批量状态查询一次最多的ID数
+STATUS_BATCH_MAX = int(os.getenv('STATUS_BATCH_MAX', '100'))
+
+
+def notify_status(cursor, image_id, status):
+    """在调用方的事务中广播状态变化（事务提交后送达所有进程）"""
+    notify(cursor, IMAGE_STATUS_CHANNEL, f"{image_id}:{status}")
+
+
+def status_response_data(image_id, status, has_generated_image):
+    """状态接口返回的内容"""
+    response_data = {
+        'status': status,
+        'has_generated_image': has_generated_image
+    }
+
+    if status == 'completed' and has_generated_image:
+        base_url = os.getenv('PUBLIC_URL', 'https://petecho.zeabur.app')
+        response_data['generated_image_url'] = f"{base_url}/image/{image_id}?type=generated"
+        response_data['thumbnail_url'] = f"{base_url}/image/{image_id}?type=generated&size=thumb"
+
+    return response_data
+
+
+def status_rows_data(rows):
+    """images_schema.STATUS_QUERY的结果转换为 {图片ID: 状态内容}"""
+    return {
+        image_id: status_response_data(image_id, status, has_generated_image)
+        for image_id, status, has_generated_image in rows
+    }
+
+
+def parse_image_ids(values):
+    """解析ID列表（逗号分隔的字符串或数组），格式错误时抛出ValueError"""
+    if isinstance(values, str):
+        values = [value for value in values.split(',') if value.strip()]
+    if not isinstance(values, list):
+        raise ValueError('ids必须是数组或逗号分隔的字符串')
+    image_ids = list(dict.fromkeys(int(value) for value in values))
+    if len(image_ids) > STATUS_BATCH_MAX:
+        raise ValueError(f'一次最多查询 {STATUS_BATCH_MAX} 个ID')
+    return image_ids
+
+
+def sse_event(event, data):
+    """编码一条Server-Sent Event"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+def parse_status_payload(payload):
+    """解析通知payload，返回 (图片ID, 状态)"""
+    image_id, _, status = payload.partition(':')
+    return int(image_id), status
+
+
+class StatusBroker:
+    """进程内的状态订阅表，每个订阅是一个队列"""
+
+    queue_class = queue.Queue
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = {}
+        self._stats = {'published': 0, 'delivered': 0}
+
+    def subscribe(self, image_id):
+        """订阅一张图片的状态变化，返回接收新状态的队列"""
+        events = self.queue_class()
+        with self._lock:
+            self._subscribers.setdefault(image_id, set()).add(events)
+        return events
+
+    def unsubscribe(self, image_id, events):
+        with self._lock:
+            subscribers = self._subscribers.get(image_id)
+            if subscribers is not None:
+                subscribers.discard(events)
+                if not subscribers:
+                    del self._subscribers[image_id]
+
+    @contextmanager
+    def subscription(self, image_id):
+        """订阅的上下文管理器，退出时自动取消"""
+        events = self.subscribe(image_id)
+        try:
+            yield events
+        finally:
+            self.unsubscribe(image_id, events)
+
+    def publish(self, image_id, status):
+        with self._lock:
+            subscribers = list(self._subscribers.get(image_id, ()))
+            self._stats['published'] += 1
+            self._stats['delivered'] += len(subscribers)
+        for events in subscribers:
+            events.put_nowait(status)
+
+    def on_notification(self, payload):
+        """pg_listener的回调"""
+        try:
+            image_id, status = parse_status_payload(payload)
+        except ValueError:
+            logger.warning(f"⚠️ 无法解析状态通知: {payload}")
+            return
+        self.publish(image_id, status)
+
+    def stats(self):
+        with self._lock:
+            return dict(
+                self._stats,
+                images=len(self._subscribers),
+                subscribers=sum(len(s) for s in self._subscribers.values())
+            )
+
+
+class AsyncStatusBroker(StatusBroker):
+    """
+    asyncio版本（async_app.py使用）：订阅队列为asyncio.Queue，
+    只能在事件循环中发布（数据库通知由事件循环中的监听连接送达）
+    """
+
+    queue_class = asyncio.Queue
+
+
+status_broker = StatusBroker()
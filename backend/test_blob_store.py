@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+"""
+blob存储测试
+本地后端写在临时目录中；S3后端使用内存中的替身客户端，不需要boto3和真实的存储服务
+运行: python -m pytest -q backend/test_blob_store.py
+"""
+
+import io
+import hashlib
+
+import pytest
+
+import blob_store
+from blob_store import LocalBlobStore, S3BlobStore, BlobNotFoundError
+
+PNG_DATA = b'\x89PNG\r\n\x1a\n' + bytes(range(256)) * 4
+
+
+class StubS3Client:
+    """只实现S3BlobStore用到的接口，对象保存在字典中"""
+
+    class exceptions:
+        class NoSuchKey(Exception):
+            pass
+
+    def __init__(self):
+        self.objects = {}
+        self.uploads = 0
+
+    def head_object(self, Bucket, Key):
+        if (Bucket, Key) not in self.objects:
+            raise self.exceptions.NoSuchKey(Key)
+        return {'ContentLength': len(self.objects[(Bucket, Key)][0])}
+
+    def upload_fileobj(self, fileobj, bucket, key, ExtraArgs=None):
+        self.uploads += 1
+        self.objects[(bucket, key)] = (fileobj.read(), (ExtraArgs or {}).get('ContentType'))
+
+    def upload_file(self, path, bucket, key, ExtraArgs=None):
+        with open(path, 'rb') as f:
+            self.upload_fileobj(f, bucket, key, ExtraArgs)
+
+    def get_object(self, Bucket, Key):
+        if (Bucket, Key) not in self.objects:
+            raise self.exceptions.NoSuchKey(Key)
+        return {'Body': io.BytesIO(self.objects[(Bucket, Key)][0])}
+
+    def delete_object(self, Bucket, Key):
+        self.objects.pop((Bucket, Key), None)
+
+    def generate_presigned_url(self, method, Params, ExpiresIn):
+        return f"https://s3.example.com/{Params['Bucket']}/{Params['Key']}?expires={ExpiresIn}"
+
+
+def make_s3_store(client):
+    """跳过创建boto3客户端，直接使用替身客户端"""
+    store = S3BlobStore.__new__(S3BlobStore)
+    store.bucket = 'petechoes-test'
+    store.prefix = 'blobs/'
+    store.client = client
+    return store
+
+
+@pytest.fixture
+def local_store(tmp_path, monkeypatch):
+    store = LocalBlobStore(str(tmp_path / 'blobs'))
+    monkeypatch.setattr(blob_store, '_store', store)
+    return store
+
+
+@pytest.fixture
+def s3_client(monkeypatch):
+    client = StubS3Client()
+    monkeypatch.setattr(blob_store, '_store', make_s3_store(client))
+    monkeypatch.setitem(blob_store.BLOB_CONFIG, 'redirect_ttl', 0)
+    return client
+
+
+@pytest.fixture
+def flask_app(monkeypatch):
+    monkeypatch.setitem(blob_store.BLOB_CONFIG, 'accel_redirect_prefix', None)
+    import app
+    return app.app
+
+
+def test_local_put_is_content_addressed(local_store):
+    """key是内容的SHA-256，重复写入相同内容得到相同的key"""
+    blob = local_store.put(PNG_DATA, 'image/png')
+    assert blob.key == hashlib.sha256(PNG_DATA).hexdigest()
+    assert blob.size == len(PNG_DATA)
+    assert blob.content_type == 'image/png'
+    assert local_store.put(PNG_DATA).key == blob.key
+    assert local_store.exists(blob.key)
+    assert local_store.get(blob.key) == PNG_DATA
+    assert local_store.local_path(blob.key).endswith(local_store.relative_path(blob.key))
+
+
+def test_local_open_reads_ranges(local_store):
+    blob = local_store.put(PNG_DATA)
+    with local_store.open(blob.key) as f:
+        f.seek(100)
+        assert f.read(50) == PNG_DATA[100:150]
+
+
+def test_local_missing_and_delete(local_store):
+    blob = local_store.put(PNG_DATA)
+    local_store.delete(blob.key)
+    local_store.delete(blob.key)
+    assert not local_store.exists(blob.key)
+    assert local_store.local_path(blob.key) is None
+    with pytest.raises(BlobNotFoundError):
+        local_store.open(blob.key)
+
+
+def test_local_put_hashed_file(local_store, tmp_path):
+    source = tmp_path / 'download.png'
+    source.write_bytes(PNG_DATA)
+    key = hashlib.sha256(PNG_DATA).hexdigest()
+    blob = local_store.put_hashed_file(str(source), key, len(PNG_DATA), 'image/png')
+    assert blob.key == key
+    assert local_store.get(key) == PNG_DATA
+
+
+def test_s3_put_uploads_once(s3_client):
+    store = blob_store.get_blob_store()
+    blob = store.put(PNG_DATA, 'image/png')
+    assert blob.key == hashlib.sha256(PNG_DATA).hexdigest()
+    assert s3_client.objects[('petechoes-test', f'blobs/{blob.key}')] == (PNG_DATA, 'image/png')
+    store.put(PNG_DATA, 'image/png')
+    assert s3_client.uploads == 1
+    assert store.get(blob.key) == PNG_DATA
+    assert store.local_path(blob.key) is None
+
+
+def test_s3_missing_and_delete(s3_client):
+    store = blob_store.get_blob_store()
+    blob = store.put(PNG_DATA)
+    store.delete(blob.key)
+    assert not store.exists(blob.key)
+    with pytest.raises(BlobNotFoundError):
+        store.open(blob.key)
+
+
+def test_s3_download_url_follows_redirect_ttl(s3_client, monkeypatch):
+    store = blob_store.get_blob_store()
+    blob = store.put(PNG_DATA)
+    assert store.download_url(blob.key) is None
+    monkeypatch.setitem(blob_store.BLOB_CONFIG, 'redirect_ttl', 600)
+    assert store.download_url(blob.key).endswith(f'blobs/{blob.key}?expires=600')
+
+
+def test_send_local_image_range_and_etag(local_store, flask_app):
+    """本地图片：强ETag为内容哈希，Range返回206，If-None-Match返回304"""
+    from app import send_stored_image
+    blob = local_store.put(PNG_DATA, 'image/png')
+
+    with flask_app.test_request_context('/image/1', headers={'Range': 'bytes=10-19'}):
+        response = send_stored_image(blob.key, content_type='image/png')
+        response.direct_passthrough = False
+        assert response.status_code == 206
+        assert response.get_data() == PNG_DATA[10:20]
+        assert response.headers['Content-Range'] == f'bytes 10-19/{len(PNG_DATA)}'
+        assert response.headers['ETag'] == f'"{blob.key}"'
+        response.close()
+
+    with flask_app.test_request_context('/image/1', headers={'If-None-Match': f'"{blob.key}"'}):
+        response = send_stored_image(blob.key)
+        assert response.status_code == 304
+        assert 'immutable' in response.headers['Cache-Control']
+
+
+def test_send_s3_image_streams_content(s3_client, flask_app):
+    """S3图片不重定向时按块转发完整内容"""
+    from app import send_stored_image
+    blob = blob_store.get_blob_store().put(PNG_DATA, 'image/png')
+
+    with flask_app.test_request_context('/image/1'):
+        response = send_stored_image(blob.key, content_type='image/png')
+        response.direct_passthrough = False
+        assert response.status_code == 200
+        assert response.get_data() == PNG_DATA
+        assert response.headers['ETag'] == f'"{blob.key}"'
+        response.close()
+
+
+def test_send_s3_image_redirects_when_enabled(s3_client, flask_app, monkeypatch):
+    from app import send_stored_image
+    monkeypatch.setitem(blob_store.BLOB_CONFIG, 'redirect_ttl', 600)
+    blob = blob_store.get_blob_store().put(PNG_DATA)
+
+    with flask_app.test_request_context('/image/1'):
+        response = send_stored_image(blob.key)
+        assert response.status_code == 302
+        assert response.headers['Location'].endswith('?expires=600')
+        assert response.cache_control.max_age == 300
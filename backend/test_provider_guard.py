@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+"""
+自适应并发限制和熔断器测试（时间用可控的时钟代替time.monotonic）
+运行: python -m pytest -q backend/test_provider_guard.py
+"""
+
+import pytest
+
+import provider_guard
+from provider_guard import (
+    AdaptiveConcurrencyLimit, CircuitBreaker, BREAKER_CLOSED, BREAKER_OPEN, BREAKER_HALF_OPEN,
+)
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(provider_guard.time, 'monotonic', clock)
+    return clock
+
+
+def fill(limit):
+    """占满所有名额"""
+    for _ in range(limit.limit):
+        assert limit.try_acquire()
+
+
+def test_limit_rejects_when_full():
+    limit = AdaptiveConcurrencyLimit('test', initial=2)
+    fill(limit)
+    assert not limit.try_acquire()
+    assert not limit.acquire(timeout=0.01)
+    limit.cancel()
+    assert limit.try_acquire()
+    stats = limit.stats()
+    assert (stats['in_flight'], stats['rejected'], stats['timeouts']) == (2, 1, 1)
+
+
+def test_limit_grows_additively_when_saturated(clock):
+    """满载且延迟正常时，大约每完成limit个请求上限加1"""
+    limit = AdaptiveConcurrencyLimit('test', initial=2, max_limit=3)
+    fill(limit)
+    for _ in range(3):
+        # 完成一个请求后立即补满
+        limit.release(100)
+        while limit.try_acquire():
+            pass
+    assert limit.limit == 3
+    # 不超过上限
+    for _ in range(10):
+        limit.release(100)
+        while limit.try_acquire():
+            pass
+    assert limit.limit == 3
+
+
+def test_limit_does_not_grow_when_idle(clock):
+    limit = AdaptiveConcurrencyLimit('test', initial=4)
+    for _ in range(20):
+        assert limit.try_acquire()
+        limit.release(100)
+    assert limit.limit == 4
+
+
+def test_limit_halves_on_overload_once_per_cooldown(clock):
+    limit = AdaptiveConcurrencyLimit('test', initial=8, decrease_cooldown=1.0)
+    fill(limit)
+    # 同一批请求一起失败只减一次
+    for _ in range(4):
+        limit.release(100, overloaded=True)
+    assert limit.limit == 4
+    clock.advance(1.0)
+    limit.release(100, overloaded=True)
+    assert limit.limit == 2
+    clock.advance(1.0)
+    limit.release(100, overloaded=True)
+    clock.advance(1.0)
+    limit.release(100, overloaded=True)
+    assert limit.limit == 1
+    assert limit.stats()['decreases'] == 4
+
+
+def test_limit_decreases_when_latency_exceeds_baseline(clock):
+    limit = AdaptiveConcurrencyLimit('test', initial=8, latency_tolerance=2.0)
+    assert limit.try_acquire()
+    limit.release(100)
+    assert limit.try_acquire()
+    limit.release(150)
+    assert limit.limit == 8
+    assert limit.try_acquire()
+    limit.release(500)
+    assert limit.limit == 4
+
+
+def test_breaker_opens_after_consecutive_failures(clock):
+    breaker = CircuitBreaker('test', failure_threshold=3, open_seconds=30)
+    for _ in range(2):
+        assert breaker.allow()
+        breaker.record(False)
+    # 成功后重新计数
+    breaker.record(True)
+    for _ in range(2):
+        breaker.record(False)
+    assert breaker.state == BREAKER_CLOSED
+    breaker.record(False)
+    assert breaker.state == BREAKER_OPEN
+    assert breaker.is_open()
+    assert not breaker.allow()
+    assert 20 <= breaker.retry_after() <= 45
+
+
+def test_breaker_half_open_probe_closes_on_success(clock):
+    breaker = CircuitBreaker('test', failure_threshold=1, open_seconds=30, half_open_probes=1)
+    breaker.record(False)
+    clock.advance(29)
+    assert breaker.state == BREAKER_OPEN
+    clock.advance(1)
+    assert breaker.state == BREAKER_HALF_OPEN
+    assert not breaker.is_open()
+    # 只放行一个探测请求
+    assert breaker.allow()
+    assert breaker.is_open()
+    assert not breaker.allow()
+    breaker.record(True)
+    assert breaker.state == BREAKER_CLOSED
+    assert breaker.allow()
+
+
+def test_breaker_half_open_probe_reopens_on_failure(clock):
+    breaker = CircuitBreaker('test', failure_threshold=1, open_seconds=30)
+    breaker.record(False)
+    clock.advance(30)
+    assert breaker.allow()
+    breaker.record(False)
+    assert breaker.state == BREAKER_OPEN
+    clock.advance(29)
+    assert not breaker.allow()
+    clock.advance(1)
+    assert breaker.state == BREAKER_HALF_OPEN
+    assert breaker.stats()['opened'] == 2
+
+
+def test_breaker_ignores_late_success_while_open(clock):
+    """打开前发出、打开后才返回的成功请求不关闭熔断器"""
+    breaker = CircuitBreaker('test', failure_threshold=1, open_seconds=30)
+    breaker.record(False)
+    breaker.record(True)
+    assert breaker.state == BREAKER_OPEN
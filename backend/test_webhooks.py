@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+BFL完成回调的签名和回调接口测试（不需要数据库：签名无效和进度通知在领取任务之前返回）
+运行: python -m pytest -q backend/test_webhooks.py
+"""
+
+import json
+
+import pytest
+
+import webhooks
+from webhooks import (
+    WEBHOOK_CONFIG, SIGNATURE_PREFIX, sign_payload, verify_signature, webhook_fields, parse_completion,
+)
+from bfl_poller import POLL_READY, POLL_FAILED, POLL_PENDING
+
+SECRET = 'test-webhook-secret'
+BODY = json.dumps({'id': 'task-1', 'status': 'Ready', 'result': {'sample': 'https://cdn.example.com/1.jpg'}}).encode()
+
+
+@pytest.fixture
+def secret(monkeypatch):
+    monkeypatch.setitem(WEBHOOK_CONFIG, 'secret', SECRET)
+    monkeypatch.setitem(WEBHOOK_CONFIG, 'public_url', 'https://petecho.example.com')
+    return SECRET
+
+
+@pytest.fixture
+def client(secret, monkeypatch):
+    import app as app_module
+    # 不启动任务调度线程
+    monkeypatch.setattr(app_module, 'JOB_DISPATCHER_ENABLED', False)
+    return app_module.create_app().test_client()
+
+
+def test_sign_payload_is_hmac_sha256(secret):
+    signature = sign_payload(BODY)
+    assert signature.startswith(SIGNATURE_PREFIX)
+    assert len(signature) == len(SIGNATURE_PREFIX) + 64
+    assert sign_payload(BODY) == signature
+    assert sign_payload(BODY, 'other-secret') != signature
+
+
+def test_verify_signature(secret):
+    signature = sign_payload(BODY)
+    assert verify_signature(BODY, signature)
+    # 不带 sha256= 前缀也接受
+    assert verify_signature(BODY, signature[len(SIGNATURE_PREFIX):])
+    assert not verify_signature(BODY + b' ', signature)
+    assert not verify_signature(BODY, sign_payload(BODY, 'other-secret'))
+    assert not verify_signature(BODY, '')
+    assert not verify_signature(BODY, None)
+
+
+def test_verify_signature_disabled_without_secret(monkeypatch):
+    monkeypatch.setitem(WEBHOOK_CONFIG, 'secret', None)
+    assert not webhooks.webhooks_enabled()
+    assert not verify_signature(BODY, sign_payload(BODY, SECRET))
+    assert webhook_fields(1) == {}
+
+
+def test_webhook_fields(secret):
+    assert webhook_fields(42) == {
+        'webhook_url': 'https://petecho.example.com/webhooks/bfl/42',
+        'webhook_secret': SECRET,
+    }
+    assert webhook_fields(None) == {}
+
+
+def test_parse_completion():
+    assert parse_completion(json.loads(BODY)) == ('task-1', POLL_READY, 'https://cdn.example.com/1.jpg')
+    assert parse_completion({'task_id': 'task-2', 'status': 'Error'}) == ('task-2', POLL_FAILED, 'Error')
+    assert parse_completion({'id': 'task-3', 'status': 'Pending'}) == ('task-3', POLL_PENDING, 'Pending')
+    assert parse_completion([]) == (None, None, 'invalid payload')
+
+
+def test_webhook_rejects_bad_signature(client):
+    response = client.post('/webhooks/bfl/1', data=BODY, headers={
+        WEBHOOK_CONFIG['signature_header']: sign_payload(BODY, 'other-secret'),
+    })
+    assert response.status_code == 401
+    response = client.post('/webhooks/bfl/1', data=BODY)
+    assert response.status_code == 401
+
+
+def test_webhook_ignores_progress_notifications(client):
+    body = json.dumps({'id': 'task-1', 'status': 'Pending'}).encode()
+    response = client.post('/webhooks/bfl/1', data=body, headers={
+        WEBHOOK_CONFIG['signature_header']: sign_payload(body),
+    })
+    assert response.status_code == 202
+    assert response.get_json()['status'] == 'ignored'
+
+
+def test_webhook_rejects_non_json(client):
+    body = b'not json'
+    response = client.post('/webhooks/bfl/1', data=body, headers={
+        WEBHOOK_CONFIG['signature_header']: sign_payload(body),
+    })
+    assert response.status_code == 400
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+批量上传
+一次请求上传多张记忆照片：图片用一条多行INSERT写入，整批记录在upload_batches中，
+客户端用一个批次ID查询整批的汇总状态
+"""
+
+import os
+import logging
+
+from psycopg2.extras import execute_values
+
+logger = logging.getLogger(__name__)
+
+# 一个批次最多的图片数
+BATCH_MAX_FILES = int(os.getenv('MEMORY_PHOTO_BATCH_MAX', '12'))
+
+
+def init_batch_tables(cursor):
+    """创建批次表（在迁移中调用）"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS upload_batches (
+            id SERIAL PRIMARY KEY,
+            kind VARCHAR(32) NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    # 去重后多个批次可能共享同一张图片，所以用关联表而不是images上的外键
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS upload_batch_images (
+            batch_id INTEGER NOT NULL REFERENCES upload_batches(id) ON DELETE CASCADE,
+            photo_index INTEGER NOT NULL,
+            image_id INTEGER NOT NULL REFERENCES images(id) ON DELETE CASCADE,
+            PRIMARY KEY (batch_id, photo_index)
+        )
+    ''')
+
+
+def create_batch(cursor, kind):
+    """在调用方的事务中创建批次，返回批次ID"""
+    cursor.execute("INSERT INTO upload_batches (kind) VALUES (%s) RETURNING id", (kind,))
+    return cursor.fetchone()[0]
+
+
+def insert_images(cursor, rows):
+    """
+    用一条多行INSERT创建图片，rows为 [(original_key, dedup_key)]
+    返回图片ID，顺序和rows一致（同一次插入中dedup_key互不相同）
+    """
+    if not rows:
+        return []
+    inserted = execute_values(
+        cursor,
+        "INSERT INTO images (original_key, status, dedup_key) VALUES %s RETURNING id, dedup_key",
+        [(original_key, 'processing', dedup_key) for original_key, dedup_key in rows],
+        fetch=True
+    )
+    ids = {dedup_key: image_id for image_id, dedup_key in inserted}
+    return [ids[dedup_key] for _, dedup_key in rows]
+
+
+def add_batch_images(cursor, batch_id, members):
+    """登记批次中的图片，members为 [(photo_index, image_id)]"""
+    execute_values(
+        cursor,
+        "INSERT INTO upload_batch_images (batch_id, photo_index, image_id) VALUES %s",
+        [(batch_id, photo_index, image_id) for photo_index, image_id in members]
+    )
+
+
+def aggregate_status(statuses):
+    """整批的状态：全部完成为completed，全部失败为failed，仍有进行中为processing，其余为partial"""
+    if not statuses:
+        return 'failed'
+    if any(status not in ('completed', 'failed') for status in statuses):
+        return 'processing'
+    if all(status == 'completed' for status in statuses):
+        return 'completed'
+    if all(status == 'failed' for status in statuses):
+        return 'failed'
+    return 'partial'
+
+
+def load_batch_members(cursor, batch_id):
+    """
+    读取批次中每张图片的状态（不读取图片内容）
+    返回 [(photo_index, image_id, status, has_generated_image)]，批次不存在时返回None
+    """
+    cursor.execute("SELECT 1 FROM upload_batches WHERE id = %s", (batch_id,))
+    if cursor.fetchone() is None:
+        return None
+    cursor.execute(
+        '''
+        SELECT m.photo_index, i.id, i.status, i.has_generated
+        FROM upload_batch_images m JOIN images i ON i.id = m.image_id
+        WHERE m.batch_id = %s
+        ORDER BY m.photo_index
+        ''',
+        (batch_id,)
+    )
+    return cursor.fetchall()
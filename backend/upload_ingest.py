@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""
+流式接收上传文件
+替换werkzeug的文件流工厂：multipart解析器每收到一块数据就写入临时文件，
+同时增量计算SHA-256、检查大小上限，并在收到前几个字节时按文件头拒绝非图片内容，
+请求线程的内存占用只和分块大小有关，和文件大小无关
+"""
+
+import os
+import hashlib
+import logging
+import tempfile
+
+from flask import Request
+from werkzeug.exceptions import RequestEntityTooLarge, UnsupportedMediaType
+
+logger = logging.getLogger(__name__)
+
+# 上传配置
+UPLOAD_CONFIG = {
+    'max_file_bytes': int(os.getenv('UPLOAD_MAX_FILE_BYTES', str(20 * 1024 * 1024))),
+    'max_request_bytes': int(os.getenv('UPLOAD_MAX_REQUEST_BYTES', str(64 * 1024 * 1024))),
+    'tmp_dir': os.getenv('UPLOAD_TMP_DIR') or None,
+}
+
+# 判断文件类型需要的字节数
+HEADER_SIZE = 12
+
+# ISO BMFF容器（HEIC / AVIF）的品牌
+HEIF_BRANDS = {b'heic', b'heix', b'hevc', b'hevx', b'heim', b'heis', b'mif1', b'msf1', b'avif', b'avis'}
+
+
+def sniff_image_type(header):
+    """按文件头判断图片类型，不是支持的图片时返回None"""
+    if header.startswith(b'\xff\xd8\xff'):
+        return 'jpeg'
+    if header.startswith(b'\x89PNG\r\n\x1a\n'):
+        return 'png'
+    if header[:4] == b'RIFF' and header[8:12] == b'WEBP':
+        return 'webp'
+    if header[4:8] == b'ftyp' and header[8:12] in HEIF_BRANDS:
+        return 'heif'
+    if header[:6] in (b'GIF87a', b'GIF89a'):
+        return 'gif'
+    if header[:2] == b'BM':
+        return 'bmp'
+    if header[:4] in (b'II*\x00', b'MM\x00*'):
+        return 'tiff'
+    return None
+
+
+class UploadTooLargeError(RequestEntityTooLarge):
+    description = '图片超过大小限制'
+
+
+class UnsupportedUploadError(UnsupportedMediaType):
+    description = '只支持JPEG、PNG、WebP、HEIC等图片格式'
+
+
+# 上传被拒绝时的异常（包括werkzeug按MAX_CONTENT_LENGTH拒绝的请求）
+UPLOAD_REJECTIONS = (RequestEntityTooLarge, UnsupportedMediaType)
+
+
+class IngestSpool:
+    """
+    可读写的上传文件容器
+    写入时校验文件头和大小并计算哈希，内容落在带名字的临时文件中，
+    规范化进程可以直接按路径读取，不需要再经过请求线程的内存
+    """
+
+    def __init__(self, max_bytes, tmp_dir=None):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.kind = None
+        self._digest = hashlib.sha256()
+        self._header = b''
+        self._file = tempfile.NamedTemporaryFile(dir=tmp_dir, prefix='.ingest-')
+
+    @property
+    def name(self):
+        return self._file.name
+
+    @property
+    def sha256(self):
+        return self._digest.hexdigest()
+
+    def _check_header(self):
+        self.kind = sniff_image_type(self._header)
+        if self.kind is None:
+            raise UnsupportedUploadError()
+
+    def write(self, chunk):
+        self.size += len(chunk)
+        if self.size > self.max_bytes:
+            raise UploadTooLargeError(f"图片超过大小限制（{self.max_bytes // 1024 // 1024}MB）")
+        if self.kind is None:
+            self._header += chunk[:HEADER_SIZE - len(self._header)]
+            if len(self._header) >= HEADER_SIZE:
+                self._check_header()
+        self._digest.update(chunk)
+        return self._file.write(chunk)
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        # 解析结束时会seek(0)，文件不足HEADER_SIZE字节时在这里校验
+        if self.kind is None and self.size:
+            self._check_header()
+        return self._file.seek(offset, whence)
+
+    def __getattr__(self, name):
+        return getattr(self._file, name)
+
+    def __iter__(self):
+        return iter(self._file)
+
+
+class IngestRequest(Request):
+    """上传文件直接写入IngestSpool的请求类（app.request_class）"""
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return IngestSpool(UPLOAD_CONFIG['max_file_bytes'], UPLOAD_CONFIG['tmp_dir'])
+
+
+def upload_rejection_message(e):
+    """上传被拒绝（UPLOAD_REJECTIONS）时返回给客户端的说明"""
+    if isinstance(e, UploadTooLargeError):
+        return f"图片超过大小限制（单张 {UPLOAD_CONFIG['max_file_bytes'] // 1024 // 1024}MB）"
+    if e.code == 413:
+        return f"请求超过大小限制（{UPLOAD_CONFIG['max_request_bytes'] // 1024 // 1024}MB）"
+    return e.description
+
+
+def ingested(file):
+    """取得上传文件的IngestSpool"""
+    spool = file.stream
+    if not isinstance(spool, IngestSpool):
+        raise RuntimeError('上传文件没有经过IngestRequest接收，请设置app.request_class')
+    # 规范化进程按路径读取，先把缓冲区写到磁盘
+    spool.flush()
+    return spool
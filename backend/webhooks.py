@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+BFL任务完成回调
+设置BFL_WEBHOOK_SECRET后，提交任务时带上 webhook_url / webhook_secret，
+BFL在任务结束时POST到 /webhooks/bfl/<job_id>，校验签名后直接下载生成图片；
+轮询只作为丢失回调时的兜底，间隔放慢到BFL_WEBHOOK_POLL_INTERVAL
+"""
+
+import os
+import hmac
+import hashlib
+import logging
+import threading
+
+from bfl_poller import classify_poll_response
+
+logger = logging.getLogger(__name__)
+
+# 回调配置，不设置密钥时不使用回调（只轮询）
+WEBHOOK_CONFIG = {
+    'secret': os.getenv('BFL_WEBHOOK_SECRET'),
+    # BFL回调的公网地址，默认和PUBLIC_URL相同
+    'public_url': os.getenv('WEBHOOK_PUBLIC_URL', os.getenv('PUBLIC_URL', 'https://petecho.zeabur.app')),
+    # 签名头，值为 sha256=<请求体的HMAC-SHA256十六进制>（不带前缀也接受）
+    'signature_header': os.getenv('BFL_WEBHOOK_SIGNATURE_HEADER', 'X-BFL-Signature'),
+    'safety_poll_interval': float(os.getenv('BFL_WEBHOOK_POLL_INTERVAL', '60')),
+}
+
+SIGNATURE_PREFIX = 'sha256='
+
+_stats_lock = threading.Lock()
+_stats = {'received': 0, 'rejected': 0, 'completed': 0, 'duplicates': 0, 'ignored': 0}
+
+
+def webhooks_enabled():
+    return bool(WEBHOOK_CONFIG['secret'])
+
+
+def webhook_fields(job_id):
+    """放进BFL请求的回调字段，没有开启回调时为空"""
+    if not webhooks_enabled() or job_id is None:
+        return {}
+    return {
+        'webhook_url': f"{WEBHOOK_CONFIG['public_url']}/webhooks/bfl/{job_id}",
+        'webhook_secret': WEBHOOK_CONFIG['secret'],
+    }
+
+
+def sign_payload(body, secret=None):
+    """请求体的签名头值（本地模拟服务发送回调时也使用）"""
+    secret = secret or WEBHOOK_CONFIG['secret']
+    return SIGNATURE_PREFIX + hmac.new(secret.encode('utf-8'), body, hashlib.sha256).hexdigest()
+
+
+def verify_signature(body, signature):
+    """校验回调的签名头"""
+    if not webhooks_enabled() or not signature:
+        return False
+    if not signature.startswith(SIGNATURE_PREFIX):
+        signature = SIGNATURE_PREFIX + signature
+    return hmac.compare_digest(sign_payload(body), signature)
+
+
+def parse_completion(payload):
+    """
+    解析回调内容，返回 (BFL任务ID, 分类, 详情)
+    回调和轮询响应的格式相同（status / result.sample），按classify_poll_response归类
+    """
+    if not isinstance(payload, dict):
+        return None, None, 'invalid payload'
+    task_id = payload.get('task_id') or payload.get('id')
+    outcome, detail = classify_poll_response(200, payload)
+    return task_id, outcome, detail
+
+
+def count(event):
+    with _stats_lock:
+        _stats[event] += 1
+
+
+def webhook_stats():
+    with _stats_lock:
+        data = dict(_stats)
+    data['enabled'] = webhooks_enabled()
+    data['safety_poll_interval'] = WEBHOOK_CONFIG['safety_poll_interval']
+    return data
@@ -0,0 +1,27 @@
+#!/usr/bin/env python3
+"""
+独立的生成任务worker进程
+只处理generation_jobs表中的任务，不提供HTTP服务；
+需要更高吞吐时增加worker进程数即可
+"""
+
+import os
+import logging
+
+# worker进程在主线程里运行调度，不需要app导入时再启动后台调度线程
+os.environ['JOB_DISPATCHER_ENABLED'] = 'false'
+
+import app
+
+logger = logging.getLogger(__name__)
+
+def main():
+    """主函数"""
+    logger.info("👷 生成任务worker启动中...")
+    try:
+        app.job_dispatcher.run_forever()
+    except KeyboardInterrupt:
+        logger.info("👋 worker已停止")
+
+if __name__ == '__main__':
+    main()